@@ -19,15 +19,6 @@ TODO Split app sections/steps into different files ?
         See new Streamlit functionality for displaying multiple pages
 TODO Select a category and add a filter for numerical &
         non-numerical filters (using sliders and number inputs)
-BUG It is not possible to build a table of missing data ('nan_table') with
-        the 'results_df_merged' dataframe.
-        Getting below error message:
-        BUG'''StreamlitAPIException: ('cannot mix list and non-list, non-null
-            values', 'Conversion failed for column None with type object')'''
-BUG Renaming the flattened 'langues', 'formations' and 'competences'
-        variables is not working
-TODO Get last week's number of job offers
-        (use search_categories["Content-Range"] ?)
 TODO Write a snippet for subsetting filtered data (see 'lambda' functions)
 TODO Format numbers with a space between thousands
         => '{number:,}'.replace(',', ' ') is not working...
@@ -50,14 +41,25 @@ XXX Not possible to change the names of x-axis label in barplots (or elsewhere)
 from datetime import date
 from dateutil import relativedelta
 from offres_emploi import Api
-from offres_emploi.utils import dt_to_str_iso, filters_to_df
+from offres_emploi.utils import dt_to_str_iso
 from st_aggrid import AgGrid
 import matplotlib.pyplot as plt
 import pandas as pd
+import pydeck as pdk
 import seaborn as sns
 import streamlit as st
 import time
+import cassette
+import coalesce
 import custom_functions as cf
+import dedup
+import geo
+import history
+import pipeline
+import planner
+import ratelimit
+import similar
+import text_index
 
 # -------------------------------------------------------------------------------------------
 
@@ -121,18 +123,42 @@ api_list = [
 
 # Call API client using the token details provided
 # (client ID and secret from the 'secrets.toml' file)
-client = Api(
-    client_id=st.secrets["passwords"]["API_PE_CLIENT"],
-    client_secret=st.secrets["passwords"]["API_PE_SECRET"],
-)
-
-# Search the client's API
-basic_search = cf.start_search(api_client=client)
-
-# Tuple unpacking of search content
-(results, filters, content_range) = cf.extract_search_content(
-    search_session=basic_search
-)
+# In 'replay' mode, the recorded API traffic is served instead, so no
+# credentials are needed (see 'API_PE_CASSETTE_MODE' in 'cassette.py')
+if cassette.get_cassette_mode() == "replay":
+    client = cassette.wrap_client()
+else:
+    client = cassette.wrap_client(
+        Api(
+            client_id=st.secrets["passwords"]["API_PE_CLIENT"],
+            client_secret=st.secrets["passwords"]["API_PE_SECRET"],
+        )
+    )
+# The identical searches sent at the same time by several sessions are sent
+# to the API only once (see 'coalesce.py'), and the requests of all the
+# sessions are kept under the rate limit of the API (see 'ratelimit.py')
+client = coalesce.CoalescingClient(ratelimit.RateLimitedClient(client))
+
+# Read the job offers prepared by the batch harvest (see 'main.py')
+# The client's API is only searched if no snapshot was harvested yet
+snapshot_df, snapshot_metadata = cf.load_snapshot(name="default")
+# The keywords are searched locally in the harvested offers when possible
+offers_index = cf.load_text_index(name="default")
+
+if snapshot_df is not None:
+    filters = snapshot_metadata["filtresPossibles"]
+    content_range = snapshot_metadata["Content-Range"]
+    data_as_of = pd.Timestamp(snapshot_metadata["harvested_at"])
+else:
+    # Search the client's API
+    # The results may be up to 1 hour old (refreshed in the background)
+    basic_search = cf.start_search(api_client=client)
+    data_as_of = cf.get_search_time()
+
+    # Tuple unpacking of search content
+    (results, filters, content_range) = cf.extract_search_content(
+        search_session=basic_search
+    )
 
 # Get total number of lines
 content_max = cf.display_max_content(
@@ -146,170 +172,53 @@ customised_search = (
 )
 
 # Convert the search content into a dataframe
-results_df = cf.convert_search_results_to_dataframe(
-    search_results=results
+# (the snapshots are already converted and cleaned; the fields of a live
+# search unknown to the schema are kept)
+if snapshot_df is not None:
+    results_df = snapshot_df
+else:
+    results_df = pipeline.normalize_offers(results, keep_unknown=True)
+
+    # DATA CLEANING
+
+    # Variable 'lieuTravail.libelle' is split into 'departement' and 'ville',
+    # dates are converted and salaries are parsed (the empty categories are
+    # dropped below, with the sparse ones)
+    results_df = pipeline.clean_offers(results_df)
+
+# Flag the job offers posted several times (e.g. by several agencies)
+if "is_duplicate" not in results_df:
+    results_df = dedup.flag_duplicates(results_df)
+nb_duplicates = int(results_df["is_duplicate"].sum())
+hide_duplicates = st.sidebar.checkbox(
+    label="Hide the duplicate job offers", value=True
 )
-
-# DATA CLEANING
-
-# Variable 'lieuTravail.libelle'
-# Extract the words separated by a '-'
-results_df = cf.extract_linked_categories(
-    dataframe=results_df,
-    category_to_extract="lieuTravail.libelle",
-    new_fields=["departement", "ville"],
-)
-# 'flattened_lieuTravail' variable is to be coded using above and
-# below function structures so merging will work without the duplicate
-# error message
-
-# Variable 'langues'
-# Extract the categories WITHIN the category
-flattened_langues = cf.flatten_category(
-    dataframe=results_df, category="langues"
-)
-
-# Rename automatically the categories previously extracted
-flattened_langues = cf.rename_columns_auto(
-    dataframe=flattened_langues,
-    column_name="langues"
-)
-
-# # Rename specific categories
-# # Below NOT working
-# flattened_langues = cf.rename_category(
-#     dataframe=flattened_langues,
-#     columns={
-#         "('langues 0',)": "langues_0",
-#         "('langues 1',)": "langues_1",
-#     },
-# )
-
-# Variable 'qualitesProfessionnelles'
-flattened_qualitesPro = cf.flatten_category(
-    dataframe=results_df, category="qualitesProfessionnelles"
-)
-
-flattened_qualitesPro = cf.rename_columns_auto(
-    dataframe=flattened_qualitesPro,
-    column_name="qualitesPro"
-)
-
-# # Below NOT working
-# flattened_qualitesPro = cf.rename_category(
-#     dataframe=flattened_qualitesPro,
-#     columns={
-#         "('qualitePro 0',)": "qualitePro_0",
-#         "('qualitePro 1',)": "qualitePro_1",
-#         "('qualitePro 2',)": "qualitePro_2",
-#     },
-# )
-
-# Variable 'competences'
-flattened_competences = cf.flatten_category(
-    dataframe=results_df, category="competences"
-)
-
-flattened_competences = cf.rename_columns_auto(
-    dataframe=flattened_competences,
-    column_name="competences"
-)
-
-# Keep top 3 competences
-flattened_competences = flattened_competences.iloc[:, 0:3]
-
-# # Below NOT working
-# flattened_competences = cf.rename_category(
-#     dataframe=flattened_competences,
-#     columns={
-#         "('competences 0',)": "competences_0",
-#         "('competences 1',)": "competences_1",
-#         "('competences 2',)": "competences_2",
-#     },
-# )
-
-# Variable 'permis'
-flattened_permis = cf.flatten_category(
-    dataframe=results_df,
-    category="permis"
-)
-
-flattened_permis = cf.rename_columns_auto(
-    dataframe=flattened_permis,
-    column_name="permis"
-)
-
-# # Below NOT working
-# flattened_permis = cf.rename_category(
-#     flattened_permis, columns={
-#         0: "permis_0",
-#         1: "permis_1"
-#     }
-# )
-
-# Variable 'formations'
-flattened_formations = cf.flatten_category(
-    dataframe=results_df, category="formations"
-)
-
-# # Below NOT working
-# flattened_formations = cf.rename_category(
-#     dataframe=flattened_formations,
-#     columns={
-#         "('formations 0',)": "formations_0",
-#         "('formations 1',)": "formations_1",
-#     },
-# )
-
-# Concatenate flattened categories
-# Note: 'id' column was added to apply the '.merge()' function later on
-flattened_categories = [
-    results_df["id"],
-    # flattened_lieuTravail,
-    flattened_langues,
-    flattened_qualitesPro,
-    flattened_competences,
-    flattened_permis,
-    flattened_formations,
-]
-flattened_categories = cf.concatenate_dataframes(
-    column_list=flattened_categories
-)
-
-# Merge initial 'results_df' with flattened categories
-# Use a custom function
-# Below NOT working
-results_df_merged = cf.merge_dataframes(
-    results_df, flattened_categories, on="id"
-)
-# # Use the 'left cache' method to delete 'permis_x' after merge
-# # # Also rename de 'permis_y' variable
-# # .rename(columns={"permis_y": "permis"})
-# results_df_merged
+if hide_duplicates:
+    results_df = results_df[~results_df["is_duplicate"]]
 
 # Display percentage of missing data in a table
-nan_table = cf.create_missing_data_table(
-    # dataframe=results_df_merged,  # NOT working so using initial data
-    dataframe=results_df
+# Variables 'langues', 'qualitesProfessionnelles', 'competences', 'permis'
+# and 'formations' are counted per item, e.g. 'langues_0', 'langues_1',
+# without expanding them (top 3 competences)
+nan_table = pipeline.profile_fields(
+    dataframe=results_df,
+    max_items={"competences": 3},
 )
 
 # # Create a dictionary of the categories
 # category_dictionary =
 
-# Detect columns with a high number of missing values
-low_category_list = cf.detect_low_occurrence_categories(
-    dataframe=nan_table,
+# Drop the categories with a high number of missing values, then expand
+# each list left into one column per item (the sparse items are not
+# expanded)
+results_df_redux = pipeline.prune_sparse_fields(
+    dataframe=results_df,
     threshold=20,
+    max_items={"competences": 3},
+    profile=nan_table,
 )
-
-# Drop categories not needed or redundant
-results_df_redux = cf.drop_categories(
-    dataframe=results_df_merged, drop_list=low_category_list,
-)
-# # Drop the 'description' column to simplify display of the data table
-# results_df_redux = cf.drop_categories(
-#     dataframe=results_df_merged, drop_list=["description"],
-# )
+# The 'description' columns of the snapshots are read on demand, hence not
+# in the data table (see 'text_store.py')
 
 # Display missing values status for each column in a matrix
 missing_data_matrix = cf.create_missing_data_matrix(
@@ -319,45 +228,37 @@ missing_data_matrix = cf.create_missing_data_matrix(
 # BUILD A METRIC DASHBOARD
 
 # Transform a filter search into a dataframe
-filters_df = filters_to_df(filters)
+# The API counts the duplicates, hence the offers are counted locally when
+# the duplicates are hidden
+if hide_duplicates:
+    filters_df = pipeline.count_filters(results_df)
+else:
+    filters_df = pipeline.filters_to_frame(filters)
 
 # Set a default start date
 default_start_date = (
     date.today() - relativedelta.relativedelta(days=7)
 )
 
-# # Get last week's number of job offers
-# # (use search_categories["Content-Range"] ?)
-# past_week_offers =
+# Get last week's number of job offers from the history of the harvests
+# (see 'history.py'), and the daily numbers for the trend
+# The counts of the filter values are compared with those of the same
+# source: the distinct offers when the duplicates are hidden, else the API
+previous_week_offers, previous_week_filters = cf.load_previous_counts(
+    name="default", days=7, distinct=hide_duplicates
+)
+daily_offers = cf.load_offer_history(name="default", days=30)
+filters_df = history.add_filter_deltas(
+    filters_df=filters_df, previous_counts=previous_week_filters
+)
 
 # DRAW AN HISTOGRAM OF JOB OFFERS FOR EACH CATEGORY
 
 # Set dataframes for each filter name
-filter_names = [
-    "typeContrat",
-    "experience",
-    "qualification",
-    "natureContrat"
-]
-
-contract_type_df = cf.filter_categories(
-    dataframe=filters_df, filter_name="typeContrat"
-)
-experience_df = cf.filter_categories(
-    dataframe=filters_df, filter_name="experience"
-)
-qualification_df = cf.filter_categories(
-    dataframe=filters_df, filter_name="qualification"
-)
-contract_nature_df = cf.filter_categories(
-    dataframe=filters_df, filter_name="natureContrat"
-)
-
-filters_list = (
-    contract_type_df,
-    experience_df,
-    qualification_df,
-    contract_nature_df,
+# ('typeContrat', 'experience', 'qualification' and 'natureContrat')
+filters_list = tuple(
+    pipeline.select_filter(filters_df=filters_df, filter_name=filter_name)
+    for filter_name in pipeline.FILTER_NAMES
 )
 
 # CUSTOMISE THE SEARCH
@@ -421,7 +322,12 @@ if cf.check_password():
     if search_type == "Default analysis":
         st.subheader("Default analysis")
 
+        st.caption(f"Data as of {data_as_of:%Y-%m-%d %H:%M} (UTC)")
         st.write(f"Total number of job offers: {content_max}")
+        st.write(
+            f"Number of duplicate job offers: {nb_duplicates}"
+            f"{' (hidden)' if hide_duplicates else ''}"
+        )
 
         # --------------------------------------------------------------------
 
@@ -455,10 +361,6 @@ if cf.check_password():
 
         st.subheader("Summary of Missing Data")
 
-        # Below NOT working as some flattened columns are not deleted although
-        # their missing data are higher than the threshold value
-        # The reason is that the 'nan_table' did not work with
-        # 'results_df_redux' and 'results_df' was used instead
         st.pyplot(missing_data_matrix.figure)
 
         st.subheader("Table of job offers (cleaned)")
@@ -470,6 +372,22 @@ if cf.check_password():
         # not the first 150 entries as it is now
         st.write(f"Total number of job offers: {len(results_df_redux)}")
 
+        # The descriptions of the harvested offers are not kept in the table,
+        # they are read from the snapshot when an offer is expanded
+        offer_texts = cf.load_snapshot_texts(name="default")
+        if offer_texts is not None:
+            offer_titles = dict(zip(results_df["id"], results_df["intitule"]))
+            read_offer = st.selectbox(
+                label="Read a job offer",
+                options=list(offer_titles),
+                format_func=lambda offer_id: (
+                    f"{offer_id} - {offer_titles[offer_id]}"
+                ),
+            )
+            with st.expander("Description"):
+                for column in offer_texts.columns:
+                    st.write(offer_texts.get_text(column, read_offer))
+
         # Save the search output
         save_output = cf.save_output_file(
             dataframe=results_df_redux,
@@ -504,21 +422,20 @@ if cf.check_password():
             )
 
         # Add a metric of the change in job offer number since previous week
-        # i.e. use the non-working snippet below:
-        default_start_date
-
-        # # Get last week's number of job offers
-        # # (use search_categories["Content-Range"] ?)
-        # past_week_offers =
-
         with right_column:
             st.metric(
                 label="Number of job offers since previous week",
-                value=654321,
-                # value=past_week_offers,  # 'past_week_offers' to be coded
-                # delta=12345,
-                delta=int(content_max) - 654321,
+                value=int(content_max),
+                delta=(
+                    int(content_max) - previous_week_offers
+                    if previous_week_offers is not None else None
+                ),
             )
+            if len(daily_offers) > 1:
+                st.altair_chart(
+                    cf.create_sparkline(daily_offers),
+                    use_container_width=True,
+                )
 
         # --------------------------------------------------------------------
 
@@ -528,6 +445,150 @@ if cf.check_password():
             filters_barplot = cf.create_barplot(filter_var)
             st.altair_chart(filters_barplot, use_container_width=True)
 
+        # --------------------------------------------------------------------
+
+        # AGGREGATES OF THE JOB OFFERS
+
+        # Read from the cube updated at each harvest (all the offers
+        # harvested so far), else built from the current offers
+        offer_cube = cf.load_cube(name="default")
+        if offer_cube is None:
+            offer_cube = cf.build_cube(
+                dataframe=results_df[~results_df["is_duplicate"]]
+            )
+
+        st.subheader("Number of Job Offers per Week")
+        offers_per_week = offer_cube.rollup(["semaine"])
+        st.bar_chart(
+            offers_per_week[offers_per_week["semaine"] != ""]
+            .set_index("semaine")["nb_offres"]
+        )
+
+        st.subheader("Job Offers, Companies and Salaries per Departement")
+        selected_contracts = st.multiselect(
+            label="Type of contract",
+            options=sorted(offer_cube.cells["typeContrat"].unique()),
+        )
+        offer_cube.rollup(
+            ["departement"],
+            where={"typeContrat": selected_contracts}
+            if selected_contracts else None,
+        ).sort_values("nb_offres", ascending=False)
+
+        # Approximate distinct counts and quartiles of the last 30 days, read
+        # from the sketches updated at each harvest
+        offer_sketches = cf.load_sketches(name="default")
+        if offer_sketches is None:
+            offer_sketches = cf.build_sketches(
+                dataframe=results_df[~results_df["is_duplicate"]]
+            )
+        last_30_days = offer_sketches.summarize(
+            start=(date.today() - relativedelta.relativedelta(days=29))
+            .strftime("%Y-%m-%d")
+        )
+        if not last_30_days.empty:
+            st.subheader("Job Offers of the Last 30 Days (approximate)")
+            summary = last_30_days.iloc[0]
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Job offers", f"{summary['nb_offres']:,.0f}")
+            col2.metric("Companies", f"{summary['nb_entreprises']:,.0f}")
+            col3.metric("Communes", f"{summary['nb_communes']:,.0f}")
+            col4.metric(
+                "Median annual salary", f"{summary['salaire_q50']:,.0f} €"
+            )
+
+        # --------------------------------------------------------------------
+
+        # COMPETENCES AND QUALITIES ASKED TOGETHER
+
+        st.subheader("Competences and Qualities Asked Together")
+
+        cooccurrence_model = cf.build_cooccurrence_model(dataframe=results_df)
+        if cooccurrence_model.items.empty:
+            st.write("No competence nor quality in the job offers.")
+        else:
+            # The same libelle may be both a competence and a quality
+            item_list = list(
+                cooccurrence_model.items.sort_values(
+                    "nb_offres", ascending=False
+                )[["categorie", "libelle"]].itertuples(index=False, name=None)
+            )
+            left_column, right_column = st.columns(2)
+            with left_column:
+                selected_category, selected_item = st.selectbox(
+                    label="Pick a competence or a quality",
+                    options=item_list,
+                    format_func=lambda item: f"{item[1]} ({item[0]})",
+                )
+            with right_column:
+                ranking = st.radio(
+                    label="Rank by", options=("lift", "count"),
+                    horizontal=True,
+                )
+            st.write(
+                """
+                A lift above 1 means that both are asked together more often
+                than by chance.
+                """
+            )
+            cooccurrence_model.top_k(
+                selected_item, k=10, by=ranking, category=selected_category
+            )
+
+        # --------------------------------------------------------------------
+
+        # MAP THE JOB OFFERS
+
+        st.subheader("Map of Job Offers")
+
+        geo_index = cf.build_geo_index(dataframe=results_df)
+        left_column, right_column = st.columns(2)
+        with left_column:
+            place = st.text_input(
+                label="Search around a commune, e.g. Bordeaux"
+            )
+        with right_column:
+            radius_km = st.slider(
+                label="Distance (km)", min_value=5, max_value=200, value=30
+            )
+        map_centre = (46.6, 2.5)  # France
+        if place:
+            place_coordinates = geo_index.locate(place)
+            if place_coordinates is None:
+                st.warning(f"No job offer located in '{place}'.")
+            else:
+                map_centre = place_coordinates
+                offers_around = results_df.iloc[
+                    geo_index.within_radius(*place_coordinates, radius_km)
+                ]
+                st.write(
+                    f"Number of job offers within {radius_km} km of "
+                    f"{place}: {len(offers_around)}"
+                )
+                st.write("Nearest communes with job offers")
+                geo_index.nearest_communes(*place_coordinates, k=5)
+
+        # The offers are aggregated into hexagons before being sent to the
+        # browser
+        hexbin_radius_km = max(radius_km / 10, 2) if place else 10
+        hexbins = geo.aggregate_hexbins(
+            latitudes=geo_index.latitudes,
+            longitudes=geo_index.longitudes,
+            radius_km=hexbin_radius_km,
+        )
+        st.pydeck_chart(
+            pdk.Deck(
+                layers=[geo.create_hexbin_layer(hexbins, hexbin_radius_km)],
+                initial_view_state=pdk.ViewState(
+                    latitude=map_centre[0],
+                    longitude=map_centre[1],
+                    zoom=8 if place else 5,
+                    pitch=40,
+                ),
+                tooltip={"text": "{nb_offres} job offers"},
+            )
+        )
+
     # ------------------------------------------------------------------------
 
     # CUSTOMISE THE SEARCH
@@ -585,36 +646,76 @@ if cf.check_password():
             "minCreationDate": dt_to_str_iso(start_date),
             "maxCreationDate": dt_to_str_iso(end_date),
         }
-        search_date = cf.start_search(
-            api_client=client, params=parameters
+        # Search the keywords in the harvested offers when they cover the
+        # dates, and only the days not harvested in the API (see 'planner.py')
+        search_plan = planner.plan_query(
+            parameters,
+            metadata=snapshot_metadata,
+            has_index=offers_index is not None,
         )
+        st.caption(f"Search plan: {search_plan.mode} ({search_plan.reason})")
+        if key_words and search_plan.mode != "remote":
+            keyword_matches = planner.execute_plan(
+                search_plan,
+                dataframe=results_df,
+                index=offers_index,
+                # All the pages of the API are fetched, not only the first
+                search=lambda params: pipeline.fetch_offers(
+                    api_client=client, params=params
+                ),
+            )
+            st.write(
+                f"Number of job offers matching the keywords: "
+                f"{len(keyword_matches)}"
+            )
+            cf.convert_df_to_html_table(dataframe=keyword_matches)
 
-        # Prepare filters output
-        filters = search_date["filtresPossibles"]
-        # Transform filters list into a dataframe using `filters_to_df()`
-        st.info(
-            """
-            Search Filters based on:\n
-                - Contract Type\n
-                - Experience\n
-                - Qualification\n
-                - Contract Nature
-            """
-        )
+            # Save the search output
+            save_output = cf.save_output_file(
+                dataframe=keyword_matches,
+                file_name="keyword_search_output.csv"
+            )
+            if save_output:
+                with st.spinner(text="Saving..."):
+                    time.sleep(1)
+                st.success("File saved.")
 
-        filters_df = filters_to_df(filters)
-        AgGrid(filters_df)
+        # Otherwise, search the client's API
+        else:
+            search_date = cf.start_search(
+                api_client=client, params=parameters
+            )
+            st.caption(
+                "Data as of "
+                f"{cf.get_search_time(parameters):%Y-%m-%d %H:%M} (UTC)"
+            )
 
-        # Save the search output
-        save_output = cf.save_output_file(
-            dataframe=filters_df,
-            file_name="filter_output.csv"
-        )
-        if save_output:
-            # Below NOT working
-            with st.spinner(text="Saving..."):
-                time.sleep()
-            st.success("File saved.")
+            # Prepare filters output
+            filters = search_date["filtresPossibles"]
+            # Transform filters list into a dataframe
+            st.info(
+                """
+                Search Filters based on:\n
+                    - Contract Type\n
+                    - Experience\n
+                    - Qualification\n
+                    - Contract Nature
+                """
+            )
+
+            filters_df = pipeline.filters_to_frame(filters)
+            AgGrid(filters_df)
+
+            # Save the search output
+            save_output = cf.save_output_file(
+                dataframe=filters_df,
+                file_name="filter_output.csv"
+            )
+            if save_output:
+                # Below NOT working
+                with st.spinner(text="Saving..."):
+                    time.sleep()
+                st.success("File saved.")
 
     # ------------------------------------------------------------------------
 
@@ -646,6 +747,45 @@ if cf.check_password():
         key_words = st.text_input(
             label="Enter One or More Keywords, e.g. data analyst, bi"
         )
+        # Search the keywords in the harvested offers, without calling the API
+        if offers_index is not None and key_words:
+            keyword_matches = text_index.search_offers(
+                dataframe=results_df,
+                index=offers_index,
+                query=key_words,
+            )
+            st.write(
+                f"Best {len(keyword_matches)} job offers matching the keywords"
+            )
+            cf.convert_df_to_html_table(dataframe=keyword_matches)
+
+        # Drill down the harvested offers through the search filters
+        # The counts are computed locally, without any new search of the API
+        st.subheader("Filter the Job Offers")
+        facet_index = cf.build_facet_index(dataframe=results_df)
+        facet_columns = st.columns(len(facet_index.values) or 1)
+        facet_selection = {}
+        for facet_column, (facet, facet_values) in zip(
+            facet_columns, facet_index.values.items()
+        ):
+            with facet_column:
+                facet_selection[facet] = st.multiselect(
+                    label=facet, options=facet_values
+                )
+        selected_offers = results_df.iloc[
+            facet_index.select(facet_selection)
+        ]
+        st.write(f"Number of job offers selected: {len(selected_offers)}")
+        facet_counts = facet_index.count(facet_selection)
+        for filter_name in facet_index.values:
+            st.altair_chart(
+                cf.create_barplot(
+                    pipeline.select_filter(
+                        filters_df=facet_counts, filter_name=filter_name
+                    )
+                ),
+                use_container_width=True,
+            )
 
         # Select/deselect categories
         # Click a button to clear the selected categories
@@ -685,23 +825,97 @@ if cf.check_password():
             "qualitesProfessionnelles": "ouverture d'esprit",
         }
 
-        search_categories = cf.start_search(
-            api_client=client, params=parameters
+        # Serve the search from the harvested offers when they cover it
+        # (see 'planner.py')
+        search_plan = planner.plan_query(
+            parameters,
+            metadata=snapshot_metadata,
+            has_index=offers_index is not None,
         )
+        st.caption(f"Search plan: {search_plan.mode} ({search_plan.reason})")
+        if search_plan.mode == "remote":
+            search_categories = cf.start_search(
+                api_client=client, params=parameters
+            )
+            st.caption(
+                "Data as of "
+                f"{cf.get_search_time(parameters):%Y-%m-%d %H:%M} (UTC)"
+            )
+
+            # Prepare search results
+            results = search_categories["resultats"]
 
-        # Prepare search results
-        results = search_categories["resultats"]
+            # Get the number of hits from the search
+            content_range = search_categories["Content-Range"]
+            nb_category_offers = content_range["max_results"]
+
+            results_df_from_categories = pipeline.parse_salaries(
+                pipeline.normalize_offers(results, keep_unknown=True)
+            )
+        else:
+            results_df_from_categories = planner.execute_plan(
+                search_plan,
+                dataframe=results_df,
+                index=offers_index,
+                # All the pages of the API are fetched, not only the first
+                search=lambda params: pipeline.fetch_offers(
+                    api_client=client, params=params
+                ),
+            )
+            nb_category_offers = len(results_df_from_categories)
 
         # Transform results list into a dataframe
         st.subheader("Summary Table")
+        st.write(f"Total number of job offers: {nb_category_offers}")
 
-        # Get the number of hits from the search
-        content_range = search_categories["Content-Range"]
-        st.write(
-            f"Total number of job offers: {content_range['max_results']}")
+        category_table = cf.convert_df_to_html_table(
+            dataframe=results_df_from_categories
+        )
 
-        results_df_from_categories = pd.DataFrame(results)
-        cf.convert_df_to_html_table(dataframe=results_df_from_categories)
+        # Show the harvested offers most similar to the offer ticked in the
+        # table, without any new search of the API
+        selected_rows = category_table["selected_rows"]
+        if selected_rows:
+            st.subheader("Similar Job Offers")
+            similar_offers = similar.recommend_offers(
+                dataframe=results_df,
+                model=cf.build_similar_offers(dataframe=results_df),
+                offer=pd.Series(selected_rows[0]),
+            )
+            st.dataframe(
+                similar_offers[
+                    ["similarite", "intitule", "entreprise.nom", "ville"]
+                ]
+            )
+
+        # Run the same search in several departements at once
+        # The departements are the codes of the referentiel of the API, not
+        # the 'departement' of the offers (a region or a free text when the
+        # 'lieuTravail.libelle' has no code)
+        st.subheader("Compare Departements")
+        departement_names = {
+            departement["code"]: departement["libelle"]
+            for departement in cf.get_referentiel(
+                api_client=client, referentiel="departements"
+            )
+        }
+        compared_departements = st.multiselect(
+            label="Departements",
+            options=sorted(departement_names),
+            format_func=lambda code: f"{code} - {departement_names[code]}",
+        )
+        if compared_departements:
+            compared_offers, compared_totals = cf.search_batch(
+                api_client=client,
+                queries={
+                    departement: {**parameters, "departement": departement}
+                    for departement in compared_departements
+                },
+            )
+            st.bar_chart(compared_totals.set_index("requete")["nb_resultats"])
+            st.write(
+                f"Number of job offers fetched: {len(compared_offers)}"
+            )
 
         # Save the search output
         save_output = cf.save_output_file(
@@ -727,12 +941,11 @@ if cf.check_password():
             """
         )
 
-        # Delete and/or merge code snippet below with subsetting snippet
-        # Also, all columns should be flattened out
-        # Use hard-coded parameters for now
-        filtered_results = pd.DataFrame(results)[
-            ["id", "entreprise", "salaire"]
-        ]
+        # Select enterprise name from `entreprise.nom` column & salary from
+        # `salaire.libelle` column
+        salary_by_enterprise = pipeline.extract_salary_by_enterprise(
+            dataframe=results_df_from_categories
+        )
 
         # Custom filters
         # Filter a category based on  a value
@@ -741,21 +954,27 @@ if cf.check_password():
         #     options=category_list
         #     )
 
-        # Select enterprise name from `nom` column & salary from `libelle` col
-        salary_by_enterprise = filtered_results.agg(
-            dict(
-                entreprise=lambda x: x.get("nom"),
-                salaire=lambda x: x.get("libelle"),
+        # Filter and plot the offers on their (annual) salary
+        salaries = salary_by_enterprise["salaire_annuel"].dropna()
+        if not salaries.empty:
+            min_salary, max_salary = st.slider(
+                label="Annual salary range (Euros)",
+                min_value=int(salaries.min()),
+                max_value=int(salaries.max()) + 1,
+                value=(int(salaries.min()), int(salaries.max()) + 1),
+            )
+            in_salary_range = salary_by_enterprise["salaire_annuel"].between(
+                min_salary, max_salary
+            )
+            salary_by_enterprise = salary_by_enterprise[
+                in_salary_range | salary_by_enterprise["salaire_annuel"].isna()
+            ]
+            st.altair_chart(
+                cf.create_histogram(
+                    data=salary_by_enterprise, column="salaire_annuel"
+                ),
+                use_container_width=True,
             )
-        )
-
-        # Transform 'id' column into a series type to be able to use the
-        # 'insert()' function to add it to the dataframe after the previous
-        # operation
-        id_offre = filtered_results["id"].squeeze()
-
-        # Re-insert the 'id_offre' series to the 'salary_by_enterprise' df
-        salary_by_enterprise.insert(0, "id", id_offre)
 
         # Drop the rows with missing data
         salary_by_enterprise_dropna = salary_by_enterprise.dropna()
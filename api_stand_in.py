@@ -0,0 +1,650 @@
+"""Local stand-in server for the 'Offres d'emploi v2' API of Pole Emploi.
+
+The server implements the parts of the API used by the app, so the fetch
+layer can be load-tested without burning the API quota:
+- the OAuth token issuance (client credentials grant)
+- the search endpoint, with its parameters, `range` pagination,
+    `Content-Range` header and `filtresPossibles` aggregates
+- the referentiels
+
+The job offers are either synthetic (see `offer_generator.py`) or recorded
+from a previous search (JSON file with a list of offers or a search output).
+Latency, error rate and throttling (429 'Too Many Requests') are configurable.
+
+The real `offres_emploi.Api` client can be pointed at the stand-in with
+`point_client_to()`, e.g.:
+
+    server = start_stand_in(nb_offers=5000, latency=0.1)
+    point_client_to(server.base_url)
+    client = Api(client_id="any", client_secret="any")
+    client.search(params={"motsCles": "data"})
+
+Usage:
+    python api_stand_in.py --port 8000 --offers 10000 --rate-limit 10
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cassette
+import offer_generator as og
+
+TOKEN_PATH = "/connexion/oauth2/access_token"
+OFFRES_DEMPLOI_V2_PATH = "/partenaire/offresdemploi/v2"
+SEARCH_PATH = f"{OFFRES_DEMPLOI_V2_PATH}/offres/search"
+REFERENTIEL_PATH = f"{OFFRES_DEMPLOI_V2_PATH}/referentiel/"
+
+# Limits of the 'range' parameter, as documented by Pole Emploi
+MAX_RANGE_SIZE = 150
+MAX_FIRST_INDEX = 3000
+TOKEN_LIFETIME = 1499  # seconds
+
+# Search parameters matched against a key of the offers
+EXACT_MATCH_PARAMETERS = {
+    "typeContrat": "typeContrat",
+    "experience": "experienceExige",
+    "qualification": "qualificationCode",
+    "codeROME": "romeCode",
+    "commune": "lieuTravail.commune",
+    "secteurActivite": "secteurActivite",
+}
+
+
+class StandInSettings:
+    """Behaviour of the stand-in server (latency, errors and throttling).
+
+    Args:
+        latency (float): mean delay before answering, in seconds
+        latency_jitter (float): maximum random delay added to the latency
+        error_rate (float): share of requests answered with an error 5xx
+        rate_limit (float): maximum number of requests per second before
+            answering 429, or `None` for no throttling
+        seed (int): seed of the random generator drawing errors and jitter
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = None,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Token bucket for the throttling
+        self._tokens = rate_limit or 0.0
+        self._last_refill = time.monotonic()
+
+    def draw_delay(self) -> float:
+        """Draw the delay of a response, in seconds."""
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.latency_jitter)
+
+    def draw_error(self) -> bool:
+        """Draw whether a request fails with a server error."""
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def is_throttled(self) -> bool:
+        """Consume a token of the bucket, `True` if there is none left."""
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.rate_limit,
+                self._tokens + (now - self._last_refill) * self.rate_limit,
+            )
+            self._last_refill = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+
+def load_recorded_offers(file_name: str) -> list[dict]:
+    """Load job offers recorded from a previous search.
+
+    Args:
+        file_name (str): JSON file with either a list of offers or a search
+            output (with the `resultats` key), or a cassette directory (see
+            `cassette.py`)
+
+    Returns:
+        list[dict]: the job offers
+    """
+    if os.path.isdir(file_name):
+        return cassette.load_recorded_offers(file_name)
+    with open(file_name, encoding="utf-8") as input_file:
+        recorded = json.load(input_file)
+    if isinstance(recorded, dict):
+        recorded = recorded["resultats"]
+    return recorded
+
+
+def _get_nested(offer: dict, dotted_key: str) -> object:
+    """Get a value from an offer with a key such as 'lieuTravail.commune'."""
+    value = offer
+    for key in dotted_key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _search_text(offer: dict) -> str:
+    """Build the lower-case text searched by the 'motsCles' parameter."""
+    competences = " ".join(
+        competence.get("libelle", "")
+        for competence in offer.get("competences", [])
+    )
+    return " ".join(
+        [
+            offer.get("intitule", ""),
+            offer.get("description", ""),
+            competences,
+        ]
+    ).lower()
+
+
+def build_referentiels(offers: list[dict]) -> dict[str, list[dict]]:
+    """Build the referentiels from the generator constants and the offers.
+
+    Args:
+        offers (list[dict]): the job offers served by the stand-in
+
+    Returns:
+        dict[str, list[dict]]: 'code'/'libelle' lists for each referentiel
+    """
+    communes = {}
+    for offer in offers:
+        lieu_travail = offer.get("lieuTravail", {})
+        if "commune" in lieu_travail:
+            communes[lieu_travail["commune"]] = (
+                lieu_travail.get("libelle", "").split(" - ")[-1]
+            )
+    return {
+        "typesContrats": [
+            {"code": code, "libelle": libelle}
+            for code, libelle, _ in og.CONTRACT_TYPES
+        ],
+        "naturesContrats": [
+            {"code": code, "libelle": libelle}
+            for code, libelle, _ in og.CONTRACT_NATURES
+        ],
+        "metiers": [
+            {"code": code, "libelle": libelle}
+            for code, libelle, *_ in og.JOBS
+        ],
+        "appellations": [
+            {"code": str(index), "libelle": job[2]}
+            for index, job in enumerate(og.JOBS)
+        ],
+        "secteursActivites": [
+            {"code": code, "libelle": libelle}
+            for code, libelle in sorted({(job[3], job[4]) for job in og.JOBS})
+        ],
+        "departements": [
+            {"code": code, "libelle": code}
+            for code in sorted({location[0] for location in og.LOCATIONS})
+        ],
+        "communes": [
+            {"code": code, "libelle": libelle}
+            for code, libelle in sorted(communes.items())
+        ],
+        "langues": [
+            {"code": str(index), "libelle": libelle}
+            for index, libelle in enumerate(og.LANGUES)
+        ],
+        "permis": [
+            {"code": libelle.split(" - ")[0], "libelle": libelle}
+            for libelle in og.PERMIS
+        ],
+        "niveauxFormations": [
+            {"code": code, "libelle": libelle}
+            for code, _, libelle in og.FORMATIONS
+        ],
+    }
+
+
+class StandInCatalogue:
+    """Job offers served by the stand-in, with their search helpers.
+
+    Args:
+        offers (list[dict]): the job offers
+    """
+
+    def __init__(self, offers: list[dict]):
+        self.offers = offers
+        # Pre-compute what is matched by the search parameters
+        self._texts = [_search_text(offer) for offer in offers]
+        self._departements = [
+            offer.get("lieuTravail", {}).get("libelle", "").split(" - ")[0]
+            for offer in offers
+        ]
+        self._creation_dates = [
+            offer.get("dateCreation", "")[:19] for offer in offers
+        ]
+        nature_codes = {
+            libelle: code for code, libelle, _ in og.CONTRACT_NATURES
+        }
+        self._natures = [
+            nature_codes.get(offer.get("natureContrat"))
+            for offer in offers
+        ]
+        self.referentiels = build_referentiels(offers)
+
+    def search(self, params: dict[str, str]) -> list[dict]:
+        """Select the offers matching the search parameters.
+
+        Args:
+            params (dict[str, str]): query parameters of the search
+
+        Returns:
+            list[dict]: the matching offers, most recent first
+        """
+        keywords = [
+            keyword.strip().lower()
+            for keyword in params.get("motsCles", "").split(",")
+            if keyword.strip()
+        ]
+        departements = set(
+            filter(None, params.get("departement", "").split(","))
+        )
+        natures = set(
+            filter(None, params.get("natureContrat", "").split(","))
+        )
+        exact_matches = {
+            key: set(params[parameter].split(","))
+            for parameter, key in EXACT_MATCH_PARAMETERS.items()
+            if params.get(parameter)
+        }
+        min_date = params.get("minCreationDate", "")[:19]
+        max_date = params.get("maxCreationDate", "")[:19]
+
+        selection = []
+        for index, offer in enumerate(self.offers):
+            if keywords and not all(
+                keyword in self._texts[index] for keyword in keywords
+            ):
+                continue
+            if departements and self._departements[index] not in departements:
+                continue
+            if natures and self._natures[index] not in natures:
+                continue
+            if min_date and not (
+                min_date <= self._creation_dates[index] <= max_date
+            ):
+                continue
+            if any(
+                _get_nested(offer, key) not in values
+                for key, values in exact_matches.items()
+            ):
+                continue
+            selection.append(offer)
+        selection.sort(key=lambda offer: offer.get("dateCreation", ""),
+                       reverse=True)
+        return selection
+
+
+def parse_range(range_parameter: str) -> tuple[int, int]:
+    """Parse and validate the 'range' parameter, e.g. '0-149'.
+
+    Args:
+        range_parameter (str): the 'range' parameter
+
+    Raises:
+        ValueError: the range is malformed or exceeds the API limits
+
+    Returns:
+        tuple[int, int]: the first and last indices
+    """
+    found_range = re.fullmatch(r"(\d+)-(\d+)", range_parameter)
+    if found_range is None:
+        raise ValueError(f"Invalid range '{range_parameter}'")
+    first_index, last_index = map(int, found_range.groups())
+    if last_index < first_index:
+        raise ValueError("The last index is lower than the first index")
+    if last_index - first_index >= MAX_RANGE_SIZE:
+        raise ValueError(
+            f"The range cannot contain more than {MAX_RANGE_SIZE} offers"
+        )
+    if first_index > MAX_FIRST_INDEX:
+        raise ValueError(
+            f"The first index cannot be higher than {MAX_FIRST_INDEX}"
+        )
+    return first_index, last_index
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer the requests made to the stand-in server."""
+
+    server_version = "ApiPoleEmploiStandIn/1.0"
+
+    def log_message(self, format, *args):
+        """Silence the request logging unless the server is verbose."""
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: object,
+                   headers: dict = None) -> None:
+        """Send a JSON response."""
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str,
+                    headers: dict = None) -> None:
+        """Send an error formatted as the API does."""
+        self._send_json(status, {"codeHttp": status, "message": message},
+                        headers)
+
+    def _simulate_conditions(self) -> bool:
+        """Apply latency, throttling and random errors.
+
+        Returns:
+            bool: `True` if an error response has already been sent
+        """
+        settings = self.server.settings
+        self.server.count_request()
+        time.sleep(settings.draw_delay())
+        if settings.is_throttled():
+            self._send_error(429, "Too Many Requests", {"Retry-After": "1"})
+            return True
+        if settings.draw_error():
+            self._send_error(502, "Bad Gateway")
+            return True
+        return False
+
+    def _is_authorized(self) -> bool:
+        """Check the bearer token of the request."""
+        authorization = self.headers.get("Authorization", "")
+        token = authorization.removeprefix("Bearer ")
+        return self.server.is_valid_token(token)
+
+    def do_POST(self):
+        """Issue an OAuth token (client credentials grant)."""
+        url = urlsplit(self.path)
+        if url.path != TOKEN_PATH:
+            self._send_error(404, "Not Found")
+            return
+        if self._simulate_conditions():
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if (
+            form.get("grant_type", [""])[0] != "client_credentials"
+            or not form.get("client_id")
+            or not form.get("client_secret")
+        ):
+            self._send_json(
+                400,
+                {"error": "invalid_client",
+                 "error_description": "Client authentication failed"},
+            )
+            return
+        self._send_json(
+            200,
+            {
+                "access_token": self.server.issue_token(),
+                "token_type": "Bearer",
+                "expires_in": TOKEN_LIFETIME,
+                "scope": form.get("scope", [""])[0],
+            },
+        )
+
+    def do_GET(self):
+        """Answer a search or a referentiel request."""
+        url = urlsplit(self.path)
+        if url.path != SEARCH_PATH and not url.path.startswith(
+            REFERENTIEL_PATH
+        ):
+            self._send_error(404, "Not Found")
+            return
+        if self._simulate_conditions():
+            return
+        if not self._is_authorized():
+            self._send_error(401, "Unauthorized")
+            return
+        if url.path == SEARCH_PATH:
+            # Repeated parameters (e.g. from a list of keywords) are joined
+            params = {
+                key: ",".join(values)
+                for key, values in parse_qs(url.query).items()
+            }
+            self._search(params)
+        else:
+            referentiel = url.path[len(REFERENTIEL_PATH):]
+            if referentiel not in self.server.catalogue.referentiels:
+                self._send_error(404, f"Unknown referentiel '{referentiel}'")
+                return
+            self._send_json(
+                200, self.server.catalogue.referentiels[referentiel]
+            )
+
+    def _search(self, params: dict[str, str]) -> None:
+        """Answer a search with the requested range of offers."""
+        try:
+            first_index, last_index = parse_range(
+                params.get("range", f"0-{MAX_RANGE_SIZE - 1}")
+            )
+        except ValueError as error:
+            self._send_error(400, str(error))
+            return
+        if bool(params.get("minCreationDate")) != bool(
+            params.get("maxCreationDate")
+        ):
+            self._send_error(
+                400,
+                "Les paramètres minCreationDate et maxCreationDate "
+                "doivent être renseignés ensemble",
+            )
+            return
+        selection = self.server.catalogue.search(params)
+        if not selection:
+            self.send_response(204)
+            self.end_headers()
+            return
+        page = selection[first_index:last_index + 1]
+        last_index = first_index + max(len(page) - 1, 0)
+        status = 200 if len(page) == len(selection) else 206
+        self._send_json(
+            status,
+            {
+                "resultats": page,
+                "filtresPossibles": og.build_filters(selection),
+            },
+            {
+                "Content-Range": (
+                    f"offres {first_index}-{last_index}/{len(selection)}"
+                ),
+                "Accept-Range": str(MAX_RANGE_SIZE),
+            },
+        )
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the catalogue and the settings.
+
+    Args:
+        address (tuple[str, int]): host and port to listen to
+        catalogue (StandInCatalogue): job offers to serve
+        settings (StandInSettings): latency, errors and throttling
+        verbose (bool): whether to log the requests
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        catalogue: StandInCatalogue,
+        settings: StandInSettings,
+        verbose: bool = False,
+    ):
+        super().__init__(address, StandInHandler)
+        self.catalogue = catalogue
+        self.settings = settings
+        self.verbose = verbose
+        self.request_count = 0
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        """URL of the server, e.g. 'http://127.0.0.1:8000'."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self) -> None:
+        """Count the requests received (throttled and failed included)."""
+        with self._lock:
+            self.request_count += 1
+
+    def issue_token(self) -> str:
+        """Issue a new access token."""
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._tokens[token] = time.monotonic() + TOKEN_LIFETIME
+        return token
+
+    def is_valid_token(self, token: str) -> bool:
+        """Check that a token was issued and has not expired."""
+        with self._lock:
+            return self._tokens.get(token, 0) > time.monotonic()
+
+
+def start_stand_in(
+    nb_offers: int = 1000,
+    recorded_file: str = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    seed: int = 0,
+    verbose: bool = False,
+    **settings,
+) -> StandInServer:
+    """Start the stand-in server in a background thread.
+
+    Args:
+        nb_offers (int, optional): number of synthetic offers to serve.
+            Defaults to 1000.
+        recorded_file (str, optional): JSON file of recorded offers to serve
+            instead of synthetic ones. Defaults to None.
+        host (str, optional): host to listen to. Defaults to "127.0.0.1".
+        port (int, optional): port to listen to, 0 for any free port.
+            Defaults to 0.
+        seed (int, optional): seed of the offer generator. Defaults to 0.
+        verbose (bool, optional): whether to log the requests.
+            Defaults to False.
+        **settings: keyword arguments of `StandInSettings`
+
+    Returns:
+        StandInServer: the running server (call `shutdown()` to stop it)
+    """
+    if recorded_file is not None:
+        offers = load_recorded_offers(recorded_file)
+    else:
+        offers = og.generate_offers(nb_offers, seed=seed)
+    server = StandInServer(
+        (host, port),
+        StandInCatalogue(offers),
+        StandInSettings(seed=seed, **settings),
+        verbose=verbose,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def point_client_to(base_url: str) -> None:
+    """Point the `offres_emploi` client to another server.
+
+    The endpoints of the client are module constants, hence this applies to
+    every `offres_emploi.Api` instance of the process.
+
+    Args:
+        base_url (str): URL of the server, e.g. 'http://127.0.0.1:8000'
+    """
+    from offres_emploi import api
+
+    api.ENDPOINT_ACCESS_TOKEN = f"{base_url}{TOKEN_PATH}"
+    api.OFFRES_DEMPLOI_V2_BASE = f"{base_url}{OFFRES_DEMPLOI_V2_PATH}"
+    api.REFERENTIEL_ENDPOINT = f"{base_url}{REFERENTIEL_PATH.rstrip('/')}"
+    api.SEARCH_ENDPOINT = f"{base_url}{SEARCH_PATH}"
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--offers", type=int, default=1000,
+        help="number of synthetic offers to serve",
+    )
+    parser.add_argument(
+        "--recorded", default=None,
+        help="JSON file or cassette of recorded offers to serve instead",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="in seconds"
+    )
+    parser.add_argument(
+        "--latency-jitter", type=float, default=0.0, help="in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="share of requests answered with a 502 error",
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, default=None,
+        help="requests per second before answering 429",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    """Run the stand-in server from the command line."""
+    arguments = parse_arguments()
+    server = start_stand_in(
+        nb_offers=arguments.offers,
+        recorded_file=arguments.recorded,
+        host=arguments.host,
+        port=arguments.port,
+        seed=arguments.seed,
+        verbose=arguments.verbose,
+        latency=arguments.latency,
+        latency_jitter=arguments.latency_jitter,
+        error_rate=arguments.error_rate,
+        rate_limit=arguments.rate_limit,
+    )
+    print(f"Stand-in API listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
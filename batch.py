@@ -0,0 +1,94 @@
+"""Run several searches at once, e.g. to compare departements side by side.
+
+The searches are deduplicated on their canonical form (see
+`query.SearchQuery`), then run concurrently with the search function of the
+caller, typically cached (the cached searches are answered at once) and
+rate-limited (see `ratelimit.py`). The offers of all the searches are
+returned in a single long dataframe, with the name of their search in a
+'requete' column; an offer found by several searches appears once per
+search.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import pandas as pd
+
+import pipeline
+from query import SearchQuery
+
+
+def get_query_name(params: object) -> str:
+    """Name a search after its canonical parameters.
+
+    Args:
+        params (dict | SearchQuery): parameters of the search
+
+    Returns:
+        str: the name, e.g. 'departement=33&motsCles=BI,Bac+5'
+    """
+    return urlencode(SearchQuery(params).to_params(), safe=",+") or "*"
+
+
+def search_batch(
+    search,
+    queries: object,
+    max_workers: int = 8,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Run several searches concurrently.
+
+    Args:
+        search (callable): the function searching the API, called with the
+            parameters of a search and returning its output, e.g.
+            `lambda params: api_client.search(params=params)`
+        queries (dict | list): the searches, as a dict of name ->
+            parameters, or a list of parameters (named after them)
+        max_workers (int, optional): number of searches run concurrently.
+            Defaults to 8.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: the offers of all the searches,
+            normalized (see `pipeline.normalize_offers()`) and tagged by
+            'requete', and the 'requete' and total number of offers
+            ('nb_resultats') of each search
+    """
+    if not isinstance(queries, dict):
+        queries = {get_query_name(params): params for params in queries}
+    search_queries = {
+        name: SearchQuery(params) for name, params in queries.items()
+    }
+    distinct_queries = list(dict.fromkeys(search_queries.values()))
+
+    def run(search_query: SearchQuery) -> dict:
+        try:
+            return search(search_query.to_params())
+        except KeyError:
+            # No 'Content-Range' header, i.e. no job offer found (HTTP 204)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outputs = dict(
+            zip(distinct_queries, executor.map(run, distinct_queries))
+        )
+
+    offers, totals = [], []
+    for name, search_query in search_queries.items():
+        output = outputs[search_query]
+        results = output["resultats"] if output else []
+        totals.append(
+            {
+                "requete": name,
+                "nb_resultats": int(
+                    output["Content-Range"]["max_results"] if output else 0
+                ),
+            }
+        )
+        if results:
+            offers.append(
+                pipeline.normalize_offers(results).assign(requete=name)
+            )
+    offers_df = (
+        pd.concat(offers, ignore_index=True)
+        if offers else pd.DataFrame(columns=["requete"])
+    )
+    return offers_df, pd.DataFrame(totals, columns=["requete", "nb_resultats"])
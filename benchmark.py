@@ -0,0 +1,339 @@
+"""Offline benchmark of the data pipeline on synthetic job offers.
+
+Each stage of the pipeline (see `pipeline.py`, as run by the app and the
+batch harvest) is timed on synthetic search outputs of increasing size, and
+its peak memory is traced.
+No API credentials are needed as the offers come from `offer_generator`.
+
+The results are written to a JSON file (sorted keys, one stage per entry)
+so that two releases can be compared with a simple diff.
+
+The offers can also be replayed from a cassette recorded from the API (see
+`cassette.py`), to benchmark production-shaped data offline.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --sizes 150 10000 --output files/bench.json
+    python benchmark.py --cassette files/cassette
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import pandas as pd
+
+import cassette
+import dedup
+import offer_generator as og
+import pipeline
+
+DEFAULT_SIZES = [150, 10_000, 100_000, 1_000_000]
+DEFAULT_OUTPUT = "./files/benchmark_results.json"
+
+
+def stage_normalize(context: dict) -> dict:
+    """Convert the search results into a dataframe."""
+    results_df = pipeline.normalize_offers(context["results"])
+    return {"results_df": results_df}
+
+
+def stage_clean(context: dict) -> dict:
+    """Split the location, convert the dates and parse the salaries."""
+    results_df = pipeline.clean_offers(context["results_df"].copy())
+    return {"results_df": results_df}
+
+
+def stage_dedup(context: dict) -> dict:
+    """Flag the near-duplicate offers."""
+    results_df = dedup.flag_duplicates(context["results_df"])
+    return {"results_df": results_df}
+
+
+def stage_flatten(context: dict) -> dict:
+    """Expand the nested list categories into one column per item."""
+    results_df_merged = pipeline.flatten_list_categories(
+        context["results_df"], max_items={"competences": 3}
+    )
+    return {"results_df_merged": results_df_merged}
+
+
+def stage_profile(context: dict) -> dict:
+    """Build the table of missing data, before the flattening."""
+    nan_table = pipeline.profile_fields(
+        context["results_df"], max_items={"competences": 3}
+    )
+    return {"nan_table": nan_table}
+
+
+def stage_prune(context: dict) -> dict:
+    """Drop the categories with too many missing values, then flatten."""
+    results_df_redux = pipeline.prune_sparse_fields(
+        context["results_df"],
+        threshold=20,
+        max_items={"competences": 3},
+        profile=context["nan_table"],
+    )
+    return {"results_df_redux": results_df_redux}
+
+
+def stage_filters(context: dict) -> dict:
+    """Transform the search filters into a dataframe."""
+    filters_df = pipeline.filters_to_frame(context["filters"])
+    return {"filters_df": filters_df}
+
+
+def stage_salary_by_enterprise(context: dict) -> dict:
+    """Extract the enterprise name and salary of each offer."""
+    salary_by_enterprise = pipeline.extract_salary_by_enterprise(
+        context["results_df"]
+    )
+    return {"salary_by_enterprise": salary_by_enterprise}
+
+
+def stage_export(context: dict) -> dict:
+    """Serialize the cleaned offers to CSV, as for a download."""
+    pipeline.export_offers(context["results_df_redux"], file_format="csv")
+    return {}
+
+
+# Stages in the order they are run by the app
+STAGES = [
+    ("normalize", stage_normalize),
+    ("clean", stage_clean),
+    ("dedup", stage_dedup),
+    ("flatten", stage_flatten),
+    ("profile", stage_profile),
+    ("prune", stage_prune),
+    ("filters", stage_filters),
+    ("salary_by_enterprise", stage_salary_by_enterprise),
+    ("export", stage_export),
+]
+
+
+def load_cassette_search_output(
+    cassette_dir: str,
+    nb_offers: int
+) -> dict:
+    """Build a search output of a given size from a recorded cassette.
+
+    The distinct recorded offers are repeated as many times as needed, with a
+    suffix added to their 'id' so that it remains unique.
+
+    Args:
+        cassette_dir (str): directory of the cassette
+        nb_offers (int): number of offers in the `resultats`
+
+    Raises:
+        ValueError: the cassette does not contain any offer
+
+    Returns:
+        dict: the `resultats`, `filtresPossibles` and `Content-Range`
+    """
+    recorded_offers = cassette.load_recorded_offers(cassette_dir)
+    if not recorded_offers:
+        raise ValueError(f"No job offer recorded in {cassette_dir}")
+    results = []
+    for index in range(nb_offers):
+        offer = recorded_offers[index % len(recorded_offers)]
+        repetition = index // len(recorded_offers)
+        if repetition:
+            offer = {**offer, "id": f"{offer['id']}-{repetition}"}
+        results.append(offer)
+    return {
+        "resultats": results,
+        "filtresPossibles": og.build_filters(results),
+        "Content-Range": {
+            "first_index": "0",
+            "last_index": str(max(nb_offers - 1, 0)),
+            "max_results": str(nb_offers),
+        },
+    }
+
+
+def measure_stage(
+    stage: object,
+    context: dict,
+    repeat: int = 1,
+    trace_memory: bool = True
+) -> tuple[dict, dict]:
+    """Time a pipeline stage and trace its peak memory.
+
+    The stage is timed without tracing (tracing slows down the execution),
+    then run once more under `tracemalloc` to get its peak memory.
+
+    Args:
+        stage (object): stage function taking and returning a context dict
+        context (dict): outputs of the previous stages
+        repeat (int, optional): number of timed runs. Defaults to 1.
+        trace_memory (bool, optional): whether to trace the peak memory.
+            Defaults to True.
+
+    Returns:
+        tuple[dict, dict]: the measures and the outputs of the stage
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = stage(context)
+        timings.append(time.perf_counter() - start)
+    measures = {"seconds": min(timings)}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            stage(context)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        measures["peak_memory_mb"] = round(peak / 2**20, 3)
+    return measures, output
+
+
+def run_benchmark(
+    sizes: list[int],
+    seed: int = 0,
+    repeat: int = 1,
+    trace_memory: bool = True,
+    search_output_loader: object = None,
+) -> list[dict]:
+    """Run every pipeline stage for each number of offers.
+
+    A stage that fails is reported with its error, and the stages depending
+    on its outputs are skipped.
+
+    Args:
+        sizes (list[int]): numbers of offers to benchmark
+        seed (int, optional): seed of the offer generator. Defaults to 0.
+        repeat (int, optional): number of timed runs per stage.
+            Defaults to 1.
+        trace_memory (bool, optional): whether to trace the peak memory.
+            Defaults to True.
+        search_output_loader (object, optional): function returning a search
+            output for a number of offers. Defaults to the synthetic
+            generator.
+
+    Returns:
+        list[dict]: one entry per stage and number of offers
+    """
+    if search_output_loader is None:
+        def search_output_loader(nb_offers):
+            return og.generate_search_output(nb_offers, seed=seed)
+
+    measures = []
+    for nb_offers in sizes:
+        search_output = search_output_loader(nb_offers)
+        results = search_output["resultats"]
+        filters = search_output["filtresPossibles"]
+        context = {"results": results, "filters": filters}
+        for stage_name, stage in STAGES:
+            entry = {"stage": stage_name, "nb_offers": len(results)}
+            try:
+                stage_measures, output = measure_stage(
+                    stage, context, repeat=repeat, trace_memory=trace_memory
+                )
+            except KeyError as error:
+                entry["error"] = f"skipped, missing input {error}"
+            except Exception as error:  # report and carry on
+                entry["error"] = f"{type(error).__name__}: {error}"
+            else:
+                context.update(output)
+                entry.update(stage_measures)
+                entry["offers_per_second"] = round(
+                    len(results) / max(stage_measures["seconds"], 1e-9), 1
+                )
+                entry["seconds"] = round(stage_measures["seconds"], 6)
+            measures.append(entry)
+            print(json.dumps(entry, sort_keys=True))
+    return measures
+
+
+def get_environment() -> dict:
+    """Describe the environment the benchmark was run in.
+
+    Returns:
+        dict: versions of Python and pandas, platform and git commit
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "git_commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def save_benchmark(measures: list[dict], file_name: str) -> None:
+    """Save the benchmark results to a JSON file.
+
+    Args:
+        measures (list[dict]): results of `run_benchmark()`
+        file_name (str): path of the JSON file
+    """
+    with open(file_name, "w", encoding="utf-8") as output_file:
+        json.dump(
+            {"environment": get_environment(), "results": measures},
+            output_file,
+            indent=2,
+            sort_keys=True,
+        )
+        output_file.write("\n")
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command-line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+        help="numbers of offers to benchmark",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        help="number of timed runs per stage (the fastest is kept)",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true",
+        help="do not trace the peak memory of each stage",
+    )
+    parser.add_argument(
+        "--cassette", default=None,
+        help="replay the offers recorded in this cassette directory",
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark from the command line."""
+    arguments = parse_arguments()
+    search_output_loader = None
+    if arguments.cassette is not None:
+        def search_output_loader(nb_offers):
+            return load_cassette_search_output(arguments.cassette, nb_offers)
+
+    measures = run_benchmark(
+        sizes=arguments.sizes,
+        seed=arguments.seed,
+        repeat=arguments.repeat,
+        trace_memory=not arguments.no_memory,
+        search_output_loader=search_output_loader,
+    )
+    save_benchmark(measures, arguments.output)
+    print(f"Results saved to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
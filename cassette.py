@@ -0,0 +1,230 @@
+"""Record and replay the traffic of the Pole Emploi API.
+
+In 'record' mode, every search and referentiel request made through the API
+client is forwarded to the API, and its response is saved (gzip-compressed
+JSON) into a cassette directory, keyed by the normalized search parameters:
+
+    cassette_dir/
+        search/<key>.json.gz
+        referentiel/<name>.json.gz
+
+In 'replay' mode, the responses are served from the cassette only, without
+any API call (nor credentials), which gives deterministic inputs to the app
+and to the benchmarks.
+
+The mode is picked with the `API_PE_CASSETTE_MODE` environment variable
+('record' or 'replay') and the directory with `API_PE_CASSETTE_DIR`.
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+from query import SearchQuery
+
+DEFAULT_CASSETTE_DIR = "./files/cassette"
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """The request was not recorded in the cassette.
+
+    Not a `KeyError`, which the callers of the API client take for a search
+    without any offer (no 'Content-Range' header, HTTP 204): a replay
+    missing a request must fail rather than return no offers.
+    """
+
+
+def normalize_params(params: dict = None) -> dict[str, str]:
+    """Normalize the search parameters so equivalent searches match.
+
+    See `query.SearchQuery` for the canonical form of the parameters.
+
+    Args:
+        params (dict, optional): parameters of the search. Defaults to None.
+
+    Returns:
+        dict[str, str]: the normalized parameters
+    """
+    return SearchQuery(params).to_params()
+
+
+def get_search_key(params: dict = None) -> str:
+    """Hash the normalized search parameters into a file-name-safe key.
+
+    Args:
+        params (dict, optional): parameters of the search. Defaults to None.
+
+    Returns:
+        str: the key of the search in the cassette
+    """
+    return SearchQuery(params).key
+
+
+def _search_file(cassette_dir: Path, params: dict = None) -> Path:
+    """Get the cassette file of a search."""
+    return cassette_dir / "search" / f"{get_search_key(params)}.json.gz"
+
+
+def _referentiel_file(cassette_dir: Path, referentiel: str) -> Path:
+    """Get the cassette file of a referentiel."""
+    return cassette_dir / "referentiel" / f"{referentiel}.json.gz"
+
+
+def _write_entry(file_name: Path, entry: dict) -> None:
+    """Save a cassette entry as gzip-compressed JSON (atomic write)."""
+    file_name.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = file_name.with_suffix(".tmp")
+    with gzip.open(temporary_file, "wt", encoding="utf-8") as output_file:
+        json.dump(entry, output_file, ensure_ascii=False)
+    os.replace(temporary_file, file_name)
+
+
+def _read_entry(file_name: Path) -> dict:
+    """Load a cassette entry."""
+    with gzip.open(file_name, "rt", encoding="utf-8") as input_file:
+        return json.load(input_file)
+
+
+class RecordingClient:
+    """Forward requests to an API client and record its responses.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        cassette_dir (str): directory where the responses are saved
+    """
+
+    def __init__(self, api_client, cassette_dir: str = DEFAULT_CASSETTE_DIR):
+        self.api_client = api_client
+        self.cassette_dir = Path(cassette_dir)
+
+    def search(self, params: dict = None,
+               silent_http_errors: bool = False) -> dict:
+        """Search the API and record the response."""
+        response = self.api_client.search(
+            params=params, silent_http_errors=silent_http_errors
+        )
+        if response is not None:
+            _write_entry(
+                _search_file(self.cassette_dir, params),
+                {"params": normalize_params(params), "response": response},
+            )
+        return response
+
+    def referentiel(self, referentiel: str) -> list[dict]:
+        """Get a referentiel from the API and record it."""
+        response = self.api_client.referentiel(referentiel)
+        _write_entry(
+            _referentiel_file(self.cassette_dir, referentiel),
+            {"referentiel": referentiel, "response": response},
+        )
+        return response
+
+
+class ReplayClient:
+    """Serve the responses recorded in a cassette, without any API call.
+
+    Args:
+        cassette_dir (str): directory where the responses were saved
+    """
+
+    def __init__(self, cassette_dir: str = DEFAULT_CASSETTE_DIR):
+        self.cassette_dir = Path(cassette_dir)
+
+    def search(self, params: dict = None,
+               silent_http_errors: bool = False) -> dict:
+        """Replay a recorded search.
+
+        Raises:
+            CassetteMiss: the search was not recorded
+        """
+        file_name = _search_file(self.cassette_dir, params)
+        if not file_name.exists():
+            raise CassetteMiss(
+                f"Search {normalize_params(params)} not in {self.cassette_dir}"
+            )
+        return _read_entry(file_name)["response"]
+
+    def referentiel(self, referentiel: str) -> list[dict]:
+        """Replay a recorded referentiel.
+
+        Raises:
+            CassetteMiss: the referentiel was not recorded
+        """
+        file_name = _referentiel_file(self.cassette_dir, referentiel)
+        if not file_name.exists():
+            raise CassetteMiss(
+                f"Referentiel '{referentiel}' not in {self.cassette_dir}"
+            )
+        return _read_entry(file_name)["response"]
+
+
+def iter_recorded_searches(cassette_dir: str = DEFAULT_CASSETTE_DIR):
+    """Iterate over the searches recorded in a cassette.
+
+    Args:
+        cassette_dir (str, optional): directory of the cassette.
+            Defaults to DEFAULT_CASSETTE_DIR.
+
+    Yields:
+        tuple[dict, dict]: the normalized parameters and the response
+    """
+    for file_name in sorted(Path(cassette_dir, "search").glob("*.json.gz")):
+        entry = _read_entry(file_name)
+        yield entry["params"], entry["response"]
+
+
+def load_recorded_offers(cassette_dir: str = DEFAULT_CASSETTE_DIR) -> list:
+    """Gather the distinct job offers of all the recorded searches.
+
+    Args:
+        cassette_dir (str, optional): directory of the cassette.
+            Defaults to DEFAULT_CASSETTE_DIR.
+
+    Returns:
+        list[dict]: the job offers, without duplicates
+    """
+    offers = {}
+    for _, response in iter_recorded_searches(cassette_dir):
+        for offer in response.get("resultats", []):
+            offers.setdefault(offer["id"], offer)
+    return list(offers.values())
+
+
+def get_cassette_mode() -> str:
+    """Get the cassette mode from the `API_PE_CASSETTE_MODE` variable."""
+    return os.environ.get("API_PE_CASSETTE_MODE", "off").lower()
+
+
+def wrap_client(api_client=None, mode: str = None, cassette_dir: str = None):
+    """Wrap an API client according to the cassette mode.
+
+    Args:
+        api_client (offres_emploi.Api, optional): the client of the API, not
+            needed in 'replay' mode. Defaults to None.
+        mode (str, optional): 'off', 'record' or 'replay'. Defaults to the
+            `API_PE_CASSETTE_MODE` environment variable, else 'off'.
+        cassette_dir (str, optional): directory of the cassette. Defaults to
+            the `API_PE_CASSETTE_DIR` environment variable, else
+            DEFAULT_CASSETTE_DIR.
+
+    Raises:
+        ValueError: the mode is unknown
+
+    Returns:
+        object: the (possibly wrapped) client
+    """
+    mode = (mode or get_cassette_mode()).lower()
+    cassette_dir = cassette_dir or os.environ.get(
+        "API_PE_CASSETTE_DIR", DEFAULT_CASSETTE_DIR
+    )
+    if mode not in CASSETTE_MODES:
+        raise ValueError(
+            f"Unknown cassette mode '{mode}', expected one of {CASSETTE_MODES}"
+        )
+    if mode == "record":
+        return RecordingClient(api_client, cassette_dir)
+    if mode == "replay":
+        return ReplayClient(cassette_dir)
+    return api_client
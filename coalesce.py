@@ -0,0 +1,111 @@
+"""Coalesce identical concurrent requests to the Pole Emploi API.
+
+When several sessions of the app start at the same time, they all send the
+same searches (e.g. the default search, without any parameter). The
+`SingleFlight` group below runs only the first of several identical
+requests in flight: the callers arriving while it runs wait for its result
+instead of sending the request again. Once the request is complete, the next
+identical request is sent again (this is not a cache).
+
+The requests are identified by their canonical parameters (see
+`query.SearchQuery`), so that e.g. `{"motsCles": {"BI", "Bac+5"}}`
+and `{"motsCles": "BI,Bac+5"}` are coalesced.
+
+The callers share the same response object: it must not be modified.
+"""
+
+import threading
+from concurrent.futures import Future
+
+from query import SearchQuery
+
+
+class SingleFlight:
+    """Run a single call at a time per key, sharing its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def __len__(self) -> int:
+        """Number of calls in flight."""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: str, function, *args, **kwargs) -> object:
+        """Call a function, unless a call with the same key is in flight.
+
+        Args:
+            key (str): the key of the call
+            function (callable): the function, called with `args` and
+                `kwargs` by the first caller only
+
+        Raises:
+            Exception: the exception raised by the function, raised to
+                every caller
+
+        Returns:
+            object: the result of the function
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+
+# Shared by all the sessions (threads) of the app
+_SEARCHES = SingleFlight()
+_REFERENTIELS = SingleFlight()
+
+
+class CoalescingClient:
+    """Coalesce the identical requests in flight to an API client.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API (possibly
+            wrapped, see `cassette.wrap_client()`)
+        searches (SingleFlight, optional): the group of the searches.
+            Defaults to the group shared by the whole process.
+        referentiels (SingleFlight, optional): the group of the referentiels.
+            Defaults to the group shared by the whole process.
+    """
+
+    def __init__(
+        self,
+        api_client,
+        searches: SingleFlight = None,
+        referentiels: SingleFlight = None,
+    ):
+        self.api_client = api_client
+        self.searches = _SEARCHES if searches is None else searches
+        self.referentiels = (
+            _REFERENTIELS if referentiels is None else referentiels
+        )
+
+    def search(self, params: dict = None,
+               silent_http_errors: bool = False) -> dict:
+        """Search the API, or wait for the same search in flight."""
+        key = f"{SearchQuery(params).key}:{silent_http_errors}"
+        return self.searches.do(
+            key,
+            self.api_client.search,
+            params=params,
+            silent_http_errors=silent_http_errors,
+        )
+
+    def referentiel(self, referentiel: str) -> list[dict]:
+        """Get a referentiel, or wait for the same request in flight."""
+        return self.referentiels.do(
+            referentiel, self.api_client.referentiel, referentiel
+        )
@@ -0,0 +1,161 @@
+"""Co-occurrence of the competences and qualities of the job offers.
+
+The 'competences' and 'qualitesProfessionnelles' libelles of each offer are
+one-hot encoded into a sparse matrix `X` (one row per offer, one column per
+libelle). The co-occurrence counts of every pair of libelles are then the
+sparse product `X.T @ X`, and the lift of a pair compares its count with the
+count expected if the two libelles were independent:
+
+    lift(a, b) = count(a, b) * nb_offers / (count(a) * count(b))
+
+A lift above 1 means that the two libelles are asked together more often
+than by chance.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Item categories and the key of their libelle
+ITEM_CATEGORIES = {
+    "competences": "libelle",
+    "qualitesProfessionnelles": "libelle",
+}
+
+
+def encode_items(
+    dataframe: pd.DataFrame,
+    categories: dict[str, str] = None
+) -> tuple[sparse.csr_matrix, pd.DataFrame]:
+    """One-hot encode the libelles of the job offers.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their list categories
+        categories (dict[str, str], optional): the list categories and the
+            key of their libelle. Defaults to ITEM_CATEGORIES.
+
+    Returns:
+        tuple[sparse.csr_matrix, pd.DataFrame]: the matrix (one row per
+            offer, one column per item) and the 'categorie', 'libelle' and
+            'nb_offres' of each item
+    """
+    if categories is None:
+        categories = ITEM_CATEGORIES
+    item_codes = {}
+    rows, columns = [], []
+    for category, key in categories.items():
+        if category not in dataframe:
+            continue
+        for row, items in enumerate(dataframe[category].tolist()):
+            if not isinstance(items, (list, tuple, np.ndarray)):
+                continue
+            for item in items:
+                if isinstance(item, dict) and item.get(key):
+                    rows.append(row)
+                    columns.append(
+                        item_codes.setdefault(
+                            (category, item[key]), len(item_codes)
+                        )
+                    )
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(dataframe), len(item_codes)),
+    )
+    # An item listed twice in an offer counts once
+    matrix.data[:] = 1
+    items = pd.DataFrame(
+        list(item_codes), columns=["categorie", "libelle"]
+    )
+    items["nb_offres"] = np.asarray(matrix.sum(axis=0)).ravel()
+    return matrix, items
+
+
+class CooccurrenceModel:
+    """Co-occurrence counts and lifts of the competences and qualities."""
+
+    def __init__(self, dataframe: pd.DataFrame, categories: dict = None):
+        matrix, self.items = encode_items(dataframe, categories)
+        self.nb_offers = len(dataframe)
+        # Sparse product: only the pairs asked together are stored
+        self.counts = (matrix.T @ matrix).tocsr()
+        # The same libelle may be both a competence and a quality
+        self._positions = {
+            (category, libelle): position
+            for position, (category, libelle) in enumerate(
+                zip(self.items["categorie"], self.items["libelle"])
+            )
+        }
+
+    def get_lifts(self) -> sparse.csr_matrix:
+        """Compute the lift of every pair of items asked together.
+
+        Returns:
+            sparse.csr_matrix: the lifts, with the same sparsity as the
+                co-occurrence counts
+        """
+        supports = self.items["nb_offres"].to_numpy(dtype=np.float64)
+        lifts = self.counts.tocoo()
+        values = lifts.data.astype(np.float64) * self.nb_offers / (
+            supports[lifts.row] * supports[lifts.col]
+        )
+        return sparse.csr_matrix(
+            (values, (lifts.row, lifts.col)), shape=lifts.shape
+        )
+
+    def top_k(
+        self,
+        libelle: str,
+        k: int = 10,
+        by: str = "lift",
+        min_count: int = 2,
+        category: str = None,
+    ) -> pd.DataFrame:
+        """Find the items most often asked together with an item.
+
+        Args:
+            libelle (str): the libelle of the item
+            k (int, optional): number of items. Defaults to 10.
+            by (str, optional): 'lift' or 'count'. Defaults to "lift".
+            min_count (int, optional): minimum number of offers asking for
+                both items, to discard the rare pairs with a high lift.
+                Defaults to 2.
+            category (str, optional): the category of the item, e.g.
+                'competences'. Defaults to None, i.e. the first category
+                holding the libelle.
+
+        Raises:
+            ValueError: unknown ranking
+            KeyError: the item does not appear in any offer
+
+        Returns:
+            pd.DataFrame: the 'categorie', 'libelle' and 'nb_offres' of the
+                items, with the 'count' and 'lift' of each pair
+        """
+        if by not in ("lift", "count"):
+            raise ValueError(f"Unknown ranking '{by}', expected lift or count")
+        if category is None:
+            categories = self.items.loc[
+                self.items["libelle"] == libelle, "categorie"
+            ]
+            if categories.empty:
+                raise KeyError(libelle)
+            category = categories.iloc[0]
+        position = self._positions[(category, libelle)]
+        row = self.counts.getrow(position)
+        columns, counts = row.indices, row.data
+        keep = (columns != position) & (counts >= min_count)
+        columns, counts = columns[keep], counts[keep]
+        supports = self.items["nb_offres"].to_numpy(dtype=np.float64)
+        lifts = counts.astype(np.float64) * self.nb_offers / (
+            supports[position] * supports[columns]
+        )
+        scores = lifts if by == "lift" else counts
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.lexsort((-counts[best], -scores[best]))]
+        pairs = self.items.iloc[columns[best]].reset_index(drop=True)
+        pairs["count"] = counts[best]
+        pairs["lift"] = lifts[best]
+        return pairs
@@ -0,0 +1,340 @@
+"""Aggregation cube of the job offers, for the dashboard panels.
+
+The offers are aggregated by 'romeCode' x 'departement' x 'typeContrat' x
+week of creation. For each cell of the cube, 3 small tables are kept:
+- 'cells': the number of offers
+- 'companies': the distinct companies ('entreprise.nom'), so that the number
+    of distinct companies remains exact once cells are rolled up
+- 'salaries': a histogram of the annual salaries on fixed logarithmic bins,
+    which can be summed across cells and gives the salary quantiles
+
+The cube is updated incrementally as the offers are harvested (the offers
+already counted are skipped), saved next to the snapshots, and queried with
+roll-up (group by fewer dimensions) and slice (filter on some dimensions)
+queries without reading the offers again. Only the ids of the offers of the
+latest harvest are kept to skip them: the offers no longer harvested (e.g.
+expired) remain counted in the cube, but their ids are dropped, so that the
+ids kept do not grow with the harvests.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CUBE_DIR_NAME = "cube"
+
+# Dimensions of the cube and the category of the offers they come from
+DIMENSIONS = {
+    "romeCode": "romeCode",
+    "departement": "departement",
+    "typeContrat": "typeContrat",
+    "semaine": "dateCreation",
+}
+COMPANY = "entreprise.nom"
+SALARY = "salaire_annuel"
+
+# Bins of the annual salaries, from 5k to 500k Euros (about 4% wide)
+SALARY_BINS = np.geomspace(5_000, 500_000, num=121)
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def get_week(dates: pd.Series) -> pd.Series:
+    """Get the first day (Monday) of the week of each date.
+
+    Args:
+        dates (pd.Series): the dates
+
+    Returns:
+        pd.Series: the weeks, as ISO dates, e.g. '2022-06-27'
+    """
+    dates = pd.to_datetime(dates, utc=True, errors="coerce")
+    weeks = dates.dt.tz_localize(None).dt.normalize() - pd.to_timedelta(
+        dates.dt.weekday, unit="D"
+    )
+    return weeks.dt.strftime("%Y-%m-%d").fillna("")
+
+
+class OfferCube:
+    """Counts, distinct companies and salary histograms per cell."""
+
+    def __init__(self):
+        self.cells = pd.DataFrame(
+            columns=["cell"] + list(DIMENSIONS) + ["nb_offres"]
+        ).astype({"cell": np.int64, "nb_offres": np.int64})
+        self.companies = pd.DataFrame(
+            columns=["cell", "entreprise"]
+        ).astype({"cell": np.int64})
+        self.salaries = pd.DataFrame(
+            columns=["cell", "bin", "nb_offres"]
+        ).astype(np.int64)
+        self.offer_ids = set()
+
+    def __len__(self) -> int:
+        # Number of offers counted, including the ones no longer harvested
+        return int(self.cells["nb_offres"].sum())
+
+    def add_offers(self, dataframe: pd.DataFrame) -> int:
+        """Add the new offers to the cube, skipping the ones already counted.
+
+        Args:
+            dataframe (pd.DataFrame): the cleaned job offers (see
+                `pipeline.clean_offers()`)
+
+        Returns:
+            int: number of offers added
+        """
+        new = ~dataframe["id"].isin(self.offer_ids)
+        dataframe = dataframe[new.to_numpy()]
+        if dataframe.empty:
+            return 0
+        offers = pd.DataFrame(index=dataframe.index)
+        for dimension, category in DIMENSIONS.items():
+            if category not in dataframe:
+                offers[dimension] = ""
+            elif dimension == "semaine":
+                offers[dimension] = get_week(dataframe[category])
+            else:
+                offers[dimension] = (
+                    dataframe[category].astype(str)
+                    .where(dataframe[category].notna(), "")
+                )
+
+        # Number the cells, the new ones after the existing ones
+        dimensions = list(DIMENSIONS)
+        batch_cells = offers.groupby(dimensions).size().rename(
+            "nb_offres"
+        ).reset_index()
+        cells = self.cells.merge(
+            batch_cells, on=dimensions, how="outer", suffixes=("", "_new")
+        )
+        unknown = cells["cell"].isna()
+        cells.loc[unknown, "cell"] = len(self.cells) + np.arange(
+            unknown.sum()
+        )
+        cells["nb_offres"] = (
+            cells["nb_offres"].fillna(0) + cells["nb_offres_new"].fillna(0)
+        )
+        self.cells = cells.drop(columns="nb_offres_new").astype(
+            {"cell": np.int64, "nb_offres": np.int64}
+        ).sort_values("cell", ignore_index=True)
+        offers = offers.merge(
+            self.cells[["cell"] + dimensions], on=dimensions, how="left"
+        ).set_index(dataframe.index)
+
+        if COMPANY in dataframe:
+            companies = pd.DataFrame(
+                {
+                    "cell": offers["cell"],
+                    "entreprise": dataframe[COMPANY],
+                }
+            ).dropna()
+            self.companies = pd.concat(
+                [self.companies, companies], ignore_index=True
+            ).drop_duplicates(ignore_index=True)
+
+        if SALARY in dataframe:
+            salaries = pd.DataFrame(
+                {
+                    "cell": offers["cell"],
+                    "bin": np.digitize(dataframe[SALARY], SALARY_BINS),
+                    "nb_offres": 1,
+                }
+            )[dataframe[SALARY].notna().to_numpy()]
+            self.salaries = (
+                pd.concat([self.salaries, salaries])
+                .groupby(["cell", "bin"], as_index=False)["nb_offres"].sum()
+            )
+
+        self.offer_ids.update(dataframe["id"])
+        return len(dataframe)
+
+    def keep_offers(self, offer_ids: list[str]) -> int:
+        """Forget the ids of the offers no longer harvested.
+
+        The offers stay counted in the cube.
+
+        Args:
+            offer_ids (list[str]): the 'id' of the offers of the harvest
+
+        Returns:
+            int: number of ids forgotten
+        """
+        nb_ids = len(self.offer_ids)
+        self.offer_ids.intersection_update(offer_ids)
+        return nb_ids - len(self.offer_ids)
+
+    def rollup(
+        self,
+        dimensions: list[str] = None,
+        where: dict = None
+    ) -> pd.DataFrame:
+        """Aggregate the cube by some dimensions, within a slice.
+
+        Args:
+            dimensions (list[str], optional): the dimensions kept, e.g.
+                `["departement"]`. Defaults to None, i.e. a grand total.
+            where (dict, optional): the values kept for some dimensions,
+                e.g. `{"typeContrat": ["CDI"], "departement": "33"}`.
+                Defaults to None, i.e. the whole cube.
+
+        Returns:
+            pd.DataFrame: the dimensions and, for each group, the
+                'nb_offres', 'nb_entreprises' and the salary quantiles
+                ('salaire_q25', 'salaire_q50' and 'salaire_q75')
+        """
+        dimensions = list(dimensions or [])
+        cells = self.cells
+        for dimension, values in (where or {}).items():
+            if isinstance(values, str) or not hasattr(values, "__iter__"):
+                values = [values]
+            cells = cells[cells[dimension].isin(list(values))]
+        groups = cells[["cell"] + dimensions].assign(_total="")
+        keys = dimensions or ["_total"]
+
+        result = cells.assign(_total="").groupby(keys)["nb_offres"].sum()
+        companies = self.companies.merge(groups, on="cell")
+        result = result.to_frame().join(
+            companies.groupby(keys)["entreprise"].nunique().rename(
+                "nb_entreprises"
+            )
+        )
+        result["nb_entreprises"] = result["nb_entreprises"].fillna(0).astype(
+            np.int64
+        )
+        salaries = self.salaries.merge(groups, on="cell")
+        salaries = salaries.groupby(keys + ["bin"], as_index=False)[
+            "nb_offres"
+        ].sum()
+        for quantile in QUANTILES:
+            result[f"salaire_q{int(quantile * 100)}"] = get_quantile(
+                salaries, keys, quantile
+            )
+        result = result.reset_index()
+        return result.drop(columns="_total", errors="ignore")
+
+    def save(self, cube_dir: str) -> None:
+        """Save the cube into a directory (parquet files).
+
+        Args:
+            cube_dir (str): the directory of the cube
+        """
+        cube_dir = Path(cube_dir)
+        cube_dir.mkdir(parents=True, exist_ok=True)
+        self.cells.to_parquet(cube_dir / "cells.parquet", index=False)
+        self.companies.to_parquet(cube_dir / "companies.parquet", index=False)
+        self.salaries.to_parquet(cube_dir / "salaries.parquet", index=False)
+        pd.DataFrame({"id": sorted(self.offer_ids)}).to_parquet(
+            cube_dir / "offer_ids.parquet", index=False
+        )
+
+    @classmethod
+    def load(cls, cube_dir: str) -> "OfferCube":
+        """Load a cube saved with `save()`.
+
+        Args:
+            cube_dir (str): the directory of the cube
+
+        Returns:
+            OfferCube: the cube
+        """
+        cube_dir = Path(cube_dir)
+        cube = cls()
+        cube.cells = pd.read_parquet(cube_dir / "cells.parquet")
+        cube.companies = pd.read_parquet(cube_dir / "companies.parquet")
+        cube.salaries = pd.read_parquet(cube_dir / "salaries.parquet")
+        cube.offer_ids = set(
+            pd.read_parquet(cube_dir / "offer_ids.parquet")["id"]
+        )
+        return cube
+
+
+def get_quantile(
+    histograms: pd.DataFrame,
+    keys: list[str],
+    quantile: float
+) -> pd.Series:
+    """Estimate a quantile of the salaries from their histogram.
+
+    The salaries are taken as spread geometrically within each bin.
+
+    Args:
+        histograms (pd.DataFrame): the keys, 'bin' and 'nb_offres'
+        keys (list[str]): the columns identifying each histogram
+        quantile (float): the quantile, between 0 and 1
+
+    Returns:
+        pd.Series: the quantile of each histogram, indexed by the keys
+    """
+    histograms = histograms.sort_values(keys + ["bin"])
+    cumulated = histograms.groupby(keys)["nb_offres"].cumsum()
+    totals = histograms.groupby(keys)["nb_offres"].transform("sum")
+    target = quantile * totals
+    reached = histograms[(cumulated >= target).to_numpy()]
+    first = ~reached.duplicated(keys)
+    reached = reached[first.to_numpy()]
+    previous = (cumulated - histograms["nb_offres"])[reached.index]
+    fraction = ((target[reached.index] - previous) / reached["nb_offres"])
+    # Bin 0 is below the first edge and the last bin above the last edge
+    edges = np.log(SALARY_BINS)
+    lower = edges[np.clip(reached["bin"] - 1, 0, len(edges) - 1)]
+    upper = edges[np.clip(reached["bin"], 0, len(edges) - 1)]
+    values = np.exp(lower + fraction.to_numpy() * (upper - lower))
+    return pd.Series(
+        values,
+        index=pd.MultiIndex.from_frame(reached[keys])
+        if len(keys) > 1 else pd.Index(reached[keys[0]], name=keys[0]),
+        dtype=np.float64,
+    )
+
+
+def get_cube_dir(snapshot_dir: str, name: str = "default") -> Path:
+    """Get the directory of the cube of a search, next to its snapshots.
+
+    Args:
+        snapshot_dir (str): root directory of the snapshots
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        Path: the directory of the cube
+    """
+    return Path(snapshot_dir, name, CUBE_DIR_NAME)
+
+
+def load_cube(cube_dir: str) -> OfferCube:
+    """Load a cube, or create an empty one if none was saved yet.
+
+    Args:
+        cube_dir (str): the directory of the cube
+
+    Returns:
+        OfferCube: the cube
+    """
+    if Path(cube_dir, "cells.parquet").exists():
+        return OfferCube.load(cube_dir)
+    return OfferCube()
+
+
+def update_cube(dataframe: pd.DataFrame, cube_dir: str) -> OfferCube:
+    """Add the new offers of a harvest to the saved cube.
+
+    The ids of the offers no longer harvested are forgotten (see
+    `OfferCube.keep_offers()`).
+
+    Args:
+        dataframe (pd.DataFrame): the cleaned job offers of the harvest
+        cube_dir (str): the directory of the cube
+
+    Returns:
+        OfferCube: the updated cube
+    """
+    cube = load_cube(cube_dir)
+    added = cube.add_offers(dataframe)
+    # An empty harvest (e.g. a failed search) would have the offers counted
+    # again at the next one
+    forgotten = (
+        cube.keep_offers(dataframe["id"]) if not dataframe.empty else 0
+    )
+    if added or forgotten:
+        cube.save(cube_dir)
+    return cube
@@ -1,14 +1,30 @@
-"""Functions used for extracting data from Pole Emploi API."""
+"""Functions used for extracting data from Pole Emploi API.
+
+The data processing itself is done by the `pipeline` module, which is free of
+any Streamlit dependency; the functions below wrap it for the app.
+"""
 
 import streamlit as st
 import pandas as pd
 from st_aggrid import AgGrid
 from st_aggrid.grid_options_builder import GridOptionsBuilder
-import sidetable as stb
 import missingno as msno
 import altair as alt
 from datetime import date  # delete ?
 import datetime
+import batch
+import cooccurrence
+import cube
+import facets
+import geo
+import history
+import pipeline
+import query
+import revalidate
+import similar
+import sketches
+import text_index
+import text_store
 
 
 def check_password() -> bool:
@@ -62,19 +78,325 @@ def check_password() -> bool:
         return True
 
 
-@st.cache
+# The searches are refreshed in the background after 10 minutes, and served
+# stale for up to 1 hour; the referentiels change rarely
+_SEARCHES = revalidate.RevalidatingCache(ttl=600, max_staleness=3600)
+_REFERENTIELS = revalidate.RevalidatingCache(
+    ttl=24 * 3600, max_staleness=7 * 24 * 3600
+)
+
+
 def start_search(api_client=None, params: dict = None) -> dict:
-    # fix type hints for the content of the dict
-    """Search the client's API.
+    """Search the client's API (cached, see `revalidate.py`).
+
+    The cache is keyed on the canonical form of the parameters (see
+    `query.SearchQuery`), and the canonical parameters are sent to the API.
+
+    Args:
+        api_client (offres_emploi.Api, optional): the client of the API.
+            Defaults to None.
+        params (dict | query.SearchQuery, optional): parameters of the
+            search. Defaults to None.
+
+    Returns:
+        dict: the search output, which must not be modified
+    """
+    search_query = query.SearchQuery(params)
+    return _SEARCHES.get(
+        search_query.key, api_client.search, params=search_query.to_params()
+    )
+
+
+def get_search_time(params: dict = None) -> datetime.datetime:
+    """Get the time the API was searched for the results served.
+
+    Args:
+        params (dict | query.SearchQuery, optional): parameters of the
+            search. Defaults to None.
+
+    Returns:
+        datetime.datetime: the time (UTC), or `None` if not searched yet
+    """
+    return _SEARCHES.get_time(query.SearchQuery(params).key)
+
+
+def search_batch(
+    api_client,
+    queries: object
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Run several searches concurrently (cached, see `batch.py`).
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        queries (dict | list): the searches, as a dict of name ->
+            parameters, or a list of parameters
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: the offers of all the searches,
+            tagged by 'requete', and the total number of offers of each
+            search
+    """
+    return batch.search_batch(
+        lambda params: start_search(api_client=api_client, params=params),
+        queries,
+    )
+
+
+def get_referentiel(api_client, referentiel: str) -> list[dict]:
+    """Get a referentiel of the API, e.g. 'metiers' (cached).
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        referentiel (str): name of the referentiel
+
+    Returns:
+        list[dict]: the referentiel, which must not be modified
+    """
+    return _REFERENTIELS.get(
+        referentiel, api_client.referentiel, referentiel
+    )
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_snapshot(name: str = "default") -> tuple[pd.DataFrame, dict]:
+    """Load the latest snapshot harvested by the batch pipeline.
+
+    The snapshot is reloaded every 10 minutes to pick up new harvests.
+    The long texts (e.g. 'description') are left out, see
+    `load_snapshot_texts()`.
 
     Args:
-        params (dict, optional): _description_. Defaults to None.
+        name (str, optional): name of the search. Defaults to "default".
 
     Returns:
-        dict: _description_
+        tuple[pd.DataFrame, dict]: the job offers and the metadata, or
+            `(None, None)` if no snapshot was harvested yet
     """
-    basic_search = api_client.search(params)
-    return basic_search
+    dataframe, metadata = pipeline.load_snapshot(name=name, lazy_texts=True)
+    return dataframe, metadata
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_snapshot_texts(name: str = "default") -> text_store.TextStore:
+    """Load the long texts of the latest snapshot (memory-mapped).
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        text_store.TextStore: the texts, or `None` if there are none
+    """
+    return pipeline.load_snapshot_texts(name=name)
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_text_index(name: str = "default") -> text_index.InvertedIndex:
+    """Load the full-text index of the offers harvested by the batch pipeline.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        text_index.InvertedIndex: the index, or `None` if it was not built yet
+    """
+    index_dir = text_index.get_index_dir(pipeline.DEFAULT_SNAPSHOT_DIR, name)
+    index = text_index.load_index(index_dir)
+    return index if len(index) else None
+
+
+def hash_offers(dataframe: pd.DataFrame) -> int:
+    """Hash the job offers on their 'id', to cache the derived indexes."""
+    return int(pd.util.hash_pandas_object(dataframe["id"], index=False).sum())
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_geo_index(dataframe: pd.DataFrame) -> geo.GeoIndex:
+    """Build the spatial index of the job offers (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        geo.GeoIndex: the index
+    """
+    return geo.GeoIndex(dataframe)
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_cooccurrence_model(
+    dataframe: pd.DataFrame
+) -> cooccurrence.CooccurrenceModel:
+    """Count the competences and qualities asked together (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        cooccurrence.CooccurrenceModel: the co-occurrence counts
+    """
+    return cooccurrence.CooccurrenceModel(dataframe)
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_facet_index(dataframe: pd.DataFrame) -> facets.FacetIndex:
+    """Build the bitmaps of the search filter values (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        facets.FacetIndex: the facet index
+    """
+    return facets.FacetIndex(dataframe)
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_similar_offers(dataframe: pd.DataFrame) -> similar.SimilarOffers:
+    """Build the TF-IDF vectors of the job offers (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        similar.SimilarOffers: the "more like this" model
+    """
+    # The descriptions of the snapshots are read from their text store
+    texts = load_snapshot_texts()
+    if texts is not None and "description" not in dataframe:
+        dataframe = texts.attach(dataframe, columns=["description"])
+    return similar.SimilarOffers(dataframe)
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_cube(name: str = "default") -> cube.OfferCube:
+    """Load the aggregation cube updated by the batch pipeline.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        cube.OfferCube: the cube, or `None` if it was not built yet
+    """
+    offer_cube = cube.load_cube(
+        cube.get_cube_dir(pipeline.DEFAULT_SNAPSHOT_DIR, name)
+    )
+    return offer_cube if len(offer_cube) else None
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_cube(dataframe: pd.DataFrame) -> cube.OfferCube:
+    """Aggregate the job offers into a cube (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the cleaned job offers
+
+    Returns:
+        cube.OfferCube: the cube
+    """
+    offer_cube = cube.OfferCube()
+    offer_cube.add_offers(dataframe)
+    return offer_cube
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_sketches(name: str = "default") -> sketches.SketchStore:
+    """Load the sketches updated by the batch pipeline.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        sketches.SketchStore: the sketches, or `None` if they were not built
+            yet
+    """
+    store = sketches.load_sketches(
+        sketches.get_sketches_file(pipeline.DEFAULT_SNAPSHOT_DIR, name)
+    )
+    return store if store.partitions else None
+
+
+@st.cache(
+    allow_output_mutation=True,
+    hash_funcs={pd.DataFrame: hash_offers},
+)
+def build_sketches(dataframe: pd.DataFrame) -> sketches.SketchStore:
+    """Summarize the job offers into sketches (cached).
+
+    Args:
+        dataframe (pd.DataFrame): the cleaned job offers
+
+    Returns:
+        sketches.SketchStore: the sketches
+    """
+    store = sketches.SketchStore()
+    store.add_offers(dataframe)
+    return store
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_offer_history(name: str = "default", days: int = 30) -> pd.DataFrame:
+    """Load the daily number of job offers of the last days.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+        days (int, optional): number of days. Defaults to 30.
+
+    Returns:
+        pd.DataFrame: the 'harvested_at' and 'max_results' of the last
+            harvest of each day
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return history.get_history(
+        history.get_history_file(pipeline.DEFAULT_SNAPSHOT_DIR),
+        query=name,
+        start=now - datetime.timedelta(days=days),
+        daily=True,
+    )
+
+
+@st.cache(allow_output_mutation=True, ttl=600)
+def load_previous_counts(
+    name: str = "default",
+    days: int = 7,
+    distinct: bool = False,
+) -> tuple[int, pd.DataFrame]:
+    """Load the number of job offers harvested some days ago.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+        days (int, optional): number of days ago. Defaults to 7.
+        distinct (bool, optional): whether to load the numbers of distinct
+            offers of each filter value, as counted by
+            `pipeline.count_filters()`, rather than those of the API.
+            Defaults to False.
+
+    Returns:
+        tuple[int, pd.DataFrame]: the total number of offers and the number
+            of offers of each filter value, or `(None, None)` if nothing was
+            harvested before
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return history.get_count_at(
+        history.get_history_file(pipeline.DEFAULT_SNAPSHOT_DIR),
+        moment=now - datetime.timedelta(days=days),
+        query=name,
+        distinct=distinct,
+    )
 
 
 @st.cache
@@ -129,7 +451,8 @@ def convert_search_results_to_dataframe(
     Returns:
         _type_: _description_
     """
-    dataframe = pd.json_normalize(search_results)
+    # Every field of the search is displayed, even if unknown to the schema
+    dataframe = pipeline.normalize_offers(search_results, keep_unknown=True)
     return dataframe
 
 
@@ -223,7 +546,7 @@ def flatten_category(
     Returns:
         pd.DataFrame: _description_
     """
-    dataframe = dataframe[category].apply(pd.Series)
+    dataframe = pipeline.flatten_category(dataframe, category)
     # dataframe = dataframe.drop(category, axis=1)  # NOT working
     return dataframe
 
@@ -307,7 +630,7 @@ def create_missing_data_table(dataframe: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: _description_
     """
-    nan_table = dataframe.stb.missing(clip_0=False)
+    nan_table = pipeline.profile_offers(dataframe)
     return nan_table
 
 
@@ -326,9 +649,9 @@ def detect_low_occurrence_categories(
     Returns:
         _type_: _description_
     """
-    low_category_list = dataframe.loc[
-        dataframe["percent"] > threshold
-    ].index.to_list()
+    low_category_list = pipeline.detect_sparse_categories(
+        dataframe, threshold
+    )
     return low_category_list
 
 
@@ -382,7 +705,7 @@ def filter_categories(
     Returns:
         pd.DataFrame: _description_
     """
-    dataframe = dataframe[dataframe["filtre"] == filter_name]
+    dataframe = pipeline.select_filter(dataframe, filter_name)
     return dataframe
 
 
@@ -390,29 +713,88 @@ def create_barplot(data: pd.DataFrame) -> object:
     # fix type hints for the content of the 'object'
     """Plot 'barplots' for each category filter.
 
+    The change since the previous week ('nb_resultats_delta', see
+    `history.add_filter_deltas()`) is written above each bar, if known.
+
     Args:
         variable (pd.DataFrame): _description_
 
     Returns:
         object: _description_
     """
-    barplot = (
-        alt.Chart(data, title="Total Number of Job Offers")
+    if "nb_resultats_delta" in data:
+        data = data.assign(
+            nb_resultats_delta=pd.to_numeric(
+                data["nb_resultats_delta"], errors="coerce"
+            ).astype(float)
+        )
+    base = alt.Chart(data, title="Total Number of Job Offers").encode(
+        x=alt.X(
+            "valeur_possible",
+            axis=alt.Axis(title=f"{data.iloc[0, 0]}"),
+        ),
+        y=alt.Y(
+            "nb_resultats",
+            axis=alt.Axis(title="Number of Job Offers"),
+        ),
+    )
+    barplot = base.mark_bar()
+    if "nb_resultats_delta" in data:
+        barplot = barplot.encode(
+            tooltip=["valeur_possible", "nb_resultats", "nb_resultats_delta"]
+        ) + (
+            base.mark_text(dy=-8)
+            .encode(text=alt.Text("nb_resultats_delta:Q", format="+d"))
+            .transform_filter("isValid(datum.nb_resultats_delta)")
+        )
+    return barplot.configure_view(strokeWidth=0).interactive()
+
+
+def create_sparkline(daily_offers: pd.DataFrame) -> object:
+    """Plot the trend of the number of job offers as a small line chart.
+
+    Args:
+        daily_offers (pd.DataFrame): the 'harvested_at' and 'max_results'
+
+    Returns:
+        object: the Altair chart
+    """
+    sparkline = (
+        alt.Chart(daily_offers, height=60)
+        .mark_line()
+        .encode(
+            x=alt.X("harvested_at:T", axis=None),
+            y=alt.Y("max_results:Q", axis=None,
+                    scale=alt.Scale(zero=False)),
+            tooltip=["harvested_at:T", "max_results:Q"],
+        )
+        .configure_view(strokeWidth=0)
+    )
+    return sparkline
+
+
+def create_histogram(data: pd.DataFrame, column: str) -> object:
+    """Plot the distribution of a numeric category, e.g. 'salaire_annuel'.
+
+    Args:
+        data (pd.DataFrame): the job offers
+        column (str): the numeric category
+
+    Returns:
+        object: the Altair chart
+    """
+    histogram = (
+        alt.Chart(data[[column]].dropna())
         .mark_bar()
         .encode(
-            x=alt.X(
-                "valeur_possible",
-                axis=alt.Axis(title=f"{data.iloc[0, 0]}"),
-            ),
-            y=alt.Y(
-                "nb_resultats",
-                axis=alt.Axis(title="Number of Job Offers"),
-            ),
+            x=alt.X(f"{column}:Q", bin=alt.Bin(maxbins=30),
+                    axis=alt.Axis(title=column)),
+            y=alt.Y("count()", axis=alt.Axis(title="Number of Job Offers")),
         )
         .configure_view(strokeWidth=0)
         .interactive()
     )
-    return barplot
+    return histogram
 
 
 def convert_to_datetime_format(date_var: str) -> object:
@@ -457,7 +839,8 @@ def save_output_file(dataframe: pd.DataFrame, file_name: str) -> object:
     """
     save_output = st.download_button(
         label="Save results",
-        data=dataframe.to_csv().encode("utf-8"),
+        # The index is kept, as in the files saved so far
+        data=pipeline.export_offers(dataframe, file_format="csv", index=True),
         file_name=file_name,
         mime="text/csv",
         help="The file will be saved in your default directory",
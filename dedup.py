@@ -0,0 +1,330 @@
+"""Detection of the near-duplicate job offers.
+
+The same job is often posted several times, e.g. by several agencies or by
+the partners of Pole Emploi ('origineOffre'). Comparing every pair of offers
+is out of reach for hundreds of thousands of offers, hence:
+- the 'intitule', 'description' and 'entreprise.nom' of each offer are cut
+    into shingles (sequences of consecutive words)
+- a MinHash signature is computed for each offer, in numpy batches; two
+    signatures agree on a position with a probability equal to the Jaccard
+    similarity of the shingles of the two offers
+- the signatures are cut into bands and the offers sharing a band are
+    candidate duplicates (locality-sensitive hashing), which are confirmed
+    with the similarity estimated from their whole signatures
+
+The confirmed duplicates are then grouped into clusters, named after the
+smallest offer id of each cluster.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+import text_index
+
+TEXT_CATEGORIES = ("intitule", "description", "entreprise.nom")
+
+SHINGLE_SIZE = 3
+NB_PERMUTATIONS = 128
+NB_BANDS = 16
+# Minimum (estimated) Jaccard similarity of two duplicates
+SIMILARITY_THRESHOLD = 0.8
+# Number of following texts of its bucket each text is paired with
+BUCKET_WINDOW = 8
+# Number of shingles hashed at once (bounds the memory used)
+BATCH_SIZE = 2**15
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Odd multipliers used to combine the words of a shingle
+_SHINGLE_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9],
+    dtype=np.uint64,
+)
+_EMPTY = np.iinfo(np.uint32).max
+
+
+def build_offer_texts(dataframe: pd.DataFrame) -> list[str]:
+    """Gather the text compared between the offers.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        list[str]: the text of each offer
+    """
+    texts = pd.Series("", index=dataframe.index)
+    for column in TEXT_CATEGORIES:
+        if column in dataframe:
+            texts = texts + " " + dataframe[column].fillna("").astype(str)
+    return texts.tolist()
+
+
+def get_shingles(
+    texts: list[str],
+    shingle_size: int = SHINGLE_SIZE
+) -> tuple[np.ndarray, np.ndarray]:
+    """Hash the shingles of each text.
+
+    The shingles are sequences of `shingle_size` consecutive words; a text
+    shorter than that is cut into single words.
+
+    Args:
+        texts (list[str]): the texts
+        shingle_size (int, optional): number of words per shingle.
+            Defaults to SHINGLE_SIZE.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the hashes of the shingles (uint64) of
+            all texts, one after the other, and the offsets of each text
+            (the shingles of text `i` are `hashes[offsets[i]:offsets[i+1]]`)
+    """
+    vocabulary = {}
+    word_lists = [
+        [
+            vocabulary.setdefault(word, len(vocabulary))
+            for word in _WORD_PATTERN.findall(text_index.fold_accents(text))
+        ]
+        for text in texts
+    ]
+    lengths = np.fromiter(map(len, word_lists), dtype=np.int64,
+                          count=len(word_lists))
+    words = np.fromiter(
+        (word for word_list in word_lists for word in word_list),
+        dtype=np.uint64,
+        count=int(lengths.sum()),
+    )
+    # Scramble the word numbers (splitmix64 finalizer)
+    words = (words + np.uint64(0x9E3779B97F4A7C15)) * np.uint64(
+        0xBF58476D1CE4E5B9
+    )
+    words ^= words >> np.uint64(31)
+
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    size = min(shingle_size, len(_SHINGLE_MULTIPLIERS))
+    # Number of shingles of each text
+    nb_shingles = np.where(lengths >= size, lengths - size + 1, lengths)
+    offsets = np.concatenate(([0], np.cumsum(nb_shingles)))
+    # Position of the first word of each shingle
+    first_words = np.arange(offsets[-1]) - np.repeat(
+        offsets[:-1] - starts, nb_shingles
+    )
+    short = np.repeat(lengths < size, nb_shingles)
+    hashes = words[first_words] * _SHINGLE_MULTIPLIERS[0]
+    for shift in range(1, size):
+        following = np.minimum(first_words + shift, len(words) - 1)
+        hashes = np.where(
+            short,
+            hashes,
+            hashes + words[following] * _SHINGLE_MULTIPLIERS[shift],
+        )
+    return hashes, offsets
+
+
+def compute_signatures(
+    hashes: np.ndarray,
+    offsets: np.ndarray,
+    nb_permutations: int = NB_PERMUTATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """Compute the MinHash signature of each text.
+
+    Each permutation is a multiply-shift hash of the shingles; the signature
+    holds the minimum hash of the shingles of the text for each permutation.
+
+    Args:
+        hashes (np.ndarray): the hashes of the shingles, see `get_shingles()`
+        offsets (np.ndarray): the offsets of each text
+        nb_permutations (int, optional): length of the signatures.
+            Defaults to NB_PERMUTATIONS.
+        seed (int, optional): seed of the permutations. Defaults to 0.
+
+    Returns:
+        np.ndarray: the signatures (uint32), one row per text; the rows of
+            the texts without any word are filled with the maximum value
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(
+        1, 2**63, size=nb_permutations, dtype=np.uint64
+    ) * np.uint64(2) + np.uint64(1)
+    increments = rng.integers(0, 2**63, size=nb_permutations, dtype=np.uint64)
+
+    nb_texts = len(offsets) - 1
+    signatures = np.full((nb_texts, nb_permutations), _EMPTY, dtype=np.uint32)
+    non_empty = np.flatnonzero(offsets[1:] > offsets[:-1])
+    first_text = 0
+    while first_text < len(non_empty):
+        # Take as many texts as fit in a batch (at least one)
+        start = offsets[non_empty[first_text]]
+        last_text = max(
+            np.searchsorted(
+                offsets[non_empty + 1], start + BATCH_SIZE, side="right"
+            ),
+            first_text + 1,
+        )
+        batch = non_empty[first_text:last_text]
+        end = offsets[batch[-1] + 1]
+        permuted = (
+            hashes[start:end, None] * multipliers + increments
+        ) >> np.uint64(32)
+        signatures[batch] = np.minimum.reduceat(
+            permuted, offsets[batch] - start, axis=0
+        )
+        first_text = last_text
+    return signatures
+
+
+def find_candidate_pairs(
+    signatures: np.ndarray,
+    nb_bands: int = NB_BANDS,
+    window: int = BUCKET_WINDOW,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find the pairs of texts sharing at least one band of their signature.
+
+    Each text is paired with the first text of its bucket and with the
+    `window` texts following it in the bucket, so that the number of pairs
+    grows linearly with the number of texts, even for large buckets. The
+    duplicates are then linked through the confirmed pairs (see
+    `cluster_duplicates()`), and a text unlike the first one of its bucket
+    is still paired with its neighbours.
+
+    Args:
+        signatures (np.ndarray): the MinHash signatures
+        nb_bands (int, optional): number of bands. Defaults to NB_BANDS.
+        window (int, optional): number of following texts of the bucket
+            paired with each text. Defaults to BUCKET_WINDOW.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the positions of the texts of each
+            pair, the first one being the lower
+    """
+    nb_texts, nb_permutations = signatures.shape
+    rows = nb_permutations // nb_bands
+    valid = np.flatnonzero(signatures[:, 0] != _EMPTY)
+    rng = np.random.default_rng(nb_bands)
+    band_multipliers = rng.integers(
+        1, 2**63, size=rows, dtype=np.uint64
+    ) * np.uint64(2) + np.uint64(1)
+
+    left, right = [], []
+    for band in range(nb_bands):
+        band_values = signatures[valid, band * rows:(band + 1) * rows]
+        keys = (band_values.astype(np.uint64) * band_multipliers).sum(
+            axis=1, dtype=np.uint64
+        )
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bucket_starts = np.flatnonzero(
+            np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        )
+        bucket_sizes = np.diff(np.append(bucket_starts, len(order)))
+        heads = np.repeat(bucket_starts, bucket_sizes)
+        ends = heads + np.repeat(bucket_sizes, bucket_sizes)
+        positions = np.arange(len(order))
+        # Pair each text with the first text of its bucket
+        paired = heads != positions
+        left.append(valid[order[heads[paired]]])
+        right.append(valid[order[positions[paired]]])
+        # and with the texts following it in its bucket
+        for shift in range(1, window + 1):
+            paired = np.flatnonzero(positions + shift < ends)
+            if not len(paired):
+                break
+            left.append(valid[order[paired]])
+            right.append(valid[order[paired + shift]])
+    if not left:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    left = np.concatenate(left).astype(np.int64)
+    right = np.concatenate(right).astype(np.int64)
+    pairs = np.unique(
+        np.minimum(left, right) * nb_texts + np.maximum(left, right)
+    )
+    return pairs // nb_texts, pairs % nb_texts
+
+
+def cluster_duplicates(
+    signatures: np.ndarray,
+    nb_bands: int = NB_BANDS,
+    threshold: float = SIMILARITY_THRESHOLD,
+) -> np.ndarray:
+    """Group the texts whose estimated similarity reaches a threshold.
+
+    Args:
+        signatures (np.ndarray): the MinHash signatures
+        nb_bands (int, optional): number of bands. Defaults to NB_BANDS.
+        threshold (float, optional): minimum estimated Jaccard similarity.
+            Defaults to SIMILARITY_THRESHOLD.
+
+    Returns:
+        np.ndarray: the cluster number of each text
+    """
+    # The texts with the same signature (e.g. the same offer posted twice)
+    # are duplicates: only one of them is paired with the other texts.
+    # The texts without any word are not duplicates: each one is alone
+    empty = signatures[:, 0] == _EMPTY
+    signatures, inverse = np.unique(
+        signatures[~empty], axis=0, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    nb_texts = len(signatures)
+    left, right = find_candidate_pairs(signatures, nb_bands=nb_bands)
+    # Confirm the candidates, in batches
+    confirmed = np.zeros(len(left), dtype=bool)
+    step = max(BATCH_SIZE * 8 // signatures.shape[1], 1)
+    for start in range(0, len(left), step):
+        pairs = slice(start, start + step)
+        similarity = (
+            signatures[left[pairs]] == signatures[right[pairs]]
+        ).mean(axis=1)
+        confirmed[pairs] = similarity >= threshold
+    graph = coo_matrix(
+        (
+            np.ones(confirmed.sum(), dtype=np.int8),
+            (left[confirmed], right[confirmed]),
+        ),
+        shape=(nb_texts, nb_texts),
+    )
+    nb_clusters, labels = connected_components(graph, directed=False)
+    all_labels = np.empty(len(empty), dtype=labels.dtype)
+    all_labels[~empty] = labels[inverse]
+    all_labels[empty] = nb_clusters + np.arange(empty.sum())
+    return all_labels
+
+
+def flag_duplicates(
+    dataframe: pd.DataFrame,
+    threshold: float = SIMILARITY_THRESHOLD,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Flag the near-duplicate job offers.
+
+    Two columns are added:
+    - 'cluster_id', shared by the offers describing the same job: the
+        smallest 'id' of the offers of the cluster, hence the same from one
+        run to the next whatever the order of the offers
+    - 'is_duplicate', True for every offer of a cluster but the one whose
+        'id' is the 'cluster_id'
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        threshold (float, optional): minimum estimated Jaccard similarity
+            of the shingles of two duplicates.
+            Defaults to SIMILARITY_THRESHOLD.
+        seed (int, optional): seed of the MinHash permutations.
+            Defaults to 0.
+
+    Returns:
+        pd.DataFrame: the job offers with the 2 new columns
+    """
+    hashes, offsets = get_shingles(build_offer_texts(dataframe))
+    signatures = compute_signatures(hashes, offsets, seed=seed)
+    labels = cluster_duplicates(signatures, threshold=threshold)
+    dataframe = dataframe.copy()
+    offer_ids = dataframe["id"].astype(str).to_numpy()
+    dataframe["cluster_id"] = (
+        pd.Series(offer_ids).groupby(labels).transform("min").to_numpy()
+    )
+    dataframe["is_duplicate"] = dataframe["cluster_id"].to_numpy() != offer_ids
+    return dataframe
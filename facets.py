@@ -0,0 +1,151 @@
+"""Facet counts of the local job offers, as the `filtresPossibles` of the API.
+
+For each facet ('typeContrat', 'experience', 'qualification' and
+'natureContrat') and each of its values, the offers having that value are
+stored as a bitmap (numpy bits packed in 64-bit words). The offers matching
+a selection are the bitwise AND, across the facets, of the bitwise OR of the
+selected values of each facet, and the counts are popcounts of these
+bitmaps; hence drilling down through the facets does not need any new
+search of the API.
+
+As in most faceted searches, the counts of a facet ignore the values
+selected within that facet, so that its other values remain visible.
+"""
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+# Number of bits set in each byte
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)],
+                     dtype=np.uint8)
+
+
+def pack_bitmaps(masks: np.ndarray) -> np.ndarray:
+    """Pack boolean masks into bitmaps of 64-bit words.
+
+    Args:
+        masks (np.ndarray): the masks, one row per bitmap
+
+    Returns:
+        np.ndarray: the bitmaps (uint64), one row per mask
+    """
+    masks = np.atleast_2d(masks)
+    nb_bytes = -(-masks.shape[1] // 8)
+    nb_words = -(-nb_bytes // 8)
+    # The last word is padded with zeros
+    packed = np.zeros((masks.shape[0], nb_words * 8), dtype=np.uint8)
+    packed[:, :nb_bytes] = np.packbits(masks, axis=1)
+    return packed.view(np.uint64)
+
+
+def popcount(bitmaps: np.ndarray) -> np.ndarray:
+    """Count the bits set in each bitmap.
+
+    Args:
+        bitmaps (np.ndarray): the bitmaps (uint64), one per row
+
+    Returns:
+        np.ndarray: the number of bits set in each row
+    """
+    bitmaps = np.atleast_2d(bitmaps)
+    return _POPCOUNT[bitmaps.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+class FacetIndex:
+    """Bitmaps of the offers having each value of each facet.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        facets (dict[str, str], optional): the facets and the category of
+            the offers holding their value.
+            Defaults to `pipeline.FILTER_CATEGORIES`.
+    """
+
+    def __init__(self, dataframe: pd.DataFrame, facets: dict = None):
+        if facets is None:
+            facets = pipeline.FILTER_CATEGORIES
+        self.nb_offers = len(dataframe)
+        self.all_offers = pack_bitmaps(np.ones(self.nb_offers, dtype=bool))[0]
+        self.values = {}
+        self.bitmaps = {}
+        for facet, category in facets.items():
+            if category not in dataframe:
+                continue
+            column = dataframe[category]
+            codes, values = pd.factorize(
+                column.where(column.isna(), column.astype(str)), sort=True
+            )
+            self.values[facet] = list(values)
+            self.bitmaps[facet] = pack_bitmaps(
+                codes[None, :] == np.arange(len(values))[:, None]
+            )
+
+    def match(self, selection: dict, exclude: str = None) -> np.ndarray:
+        """Get the bitmap of the offers matching a selection.
+
+        Args:
+            selection (dict): the selected values of each facet, e.g.
+                `{"typeContrat": ["CDI", "CDD"], "experience": ["D"]}`;
+                a facet without any selected value is not filtered
+            exclude (str, optional): a facet whose selection is ignored.
+                Defaults to None.
+
+        Returns:
+            np.ndarray: the bitmap of the matching offers
+        """
+        matched = self.all_offers.copy()
+        for facet, selected_values in (selection or {}).items():
+            if facet == exclude or not selected_values:
+                continue
+            positions = [
+                self.values[facet].index(value)
+                for value in selected_values
+                if value in self.values.get(facet, [])
+            ]
+            if not positions:
+                return np.zeros_like(matched)
+            matched &= np.bitwise_or.reduce(
+                self.bitmaps[facet][positions], axis=0
+            )
+        return matched
+
+    def select(self, selection: dict) -> np.ndarray:
+        """Get the positions of the offers matching a selection.
+
+        Args:
+            selection (dict): the selected values of each facet
+
+        Returns:
+            np.ndarray: the positions of the offers, for `dataframe.iloc`
+        """
+        bits = np.unpackbits(self.match(selection).view(np.uint8))
+        return np.flatnonzero(bits[:self.nb_offers])
+
+    def count(self, selection: dict = None) -> pd.DataFrame:
+        """Count the offers of each facet value within a selection.
+
+        Args:
+            selection (dict, optional): the selected values of each facet.
+                Defaults to None, i.e. all the offers.
+
+        Returns:
+            pd.DataFrame: the 'filtre', 'valeur_possible' and 'nb_resultats',
+                as `pipeline.filters_to_frame()`
+        """
+        counts = []
+        for facet, bitmaps in self.bitmaps.items():
+            matched = self.match(selection, exclude=facet)
+            counts.append(
+                pd.DataFrame(
+                    {
+                        "filtre": facet,
+                        "valeur_possible": self.values[facet],
+                        "nb_resultats": popcount(bitmaps & matched),
+                    }
+                )
+            )
+        if not counts:
+            return pipeline.filters_to_frame([])
+        return pd.concat(counts, ignore_index=True)
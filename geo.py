@@ -0,0 +1,316 @@
+"""Spatial index of the job offers, on the coordinates of their 'lieuTravail'.
+
+The coordinates are kept as float arrays and indexed in a KD-tree (scipy)
+over their position on the unit sphere, so that a straight-line (chord)
+distance matches a great-circle distance. Hence:
+- the offers within a radius of a point, e.g. 30 km around Bordeaux
+- the offers within a bounding box
+- the communes nearest to a point
+are answered without scanning every offer.
+
+The map of the offers is aggregated into hexagonal bins before being sent to
+the browser (see `aggregate_hexbins()` and `create_hexbin_layer()`).
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+import text_index
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of one degree of latitude
+KM_PER_DEGREE = 111.195
+
+LATITUDE = "lieuTravail.latitude"
+LONGITUDE = "lieuTravail.longitude"
+COMMUNE = "lieuTravail.commune"
+
+
+def to_cartesian(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Project coordinates (in degrees) onto the unit sphere.
+
+    Args:
+        latitudes (np.ndarray): the latitudes
+        longitudes (np.ndarray): the longitudes
+
+    Returns:
+        np.ndarray: the (x, y, z) position of each point
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack(
+        (
+            cos_latitudes * np.cos(longitudes),
+            cos_latitudes * np.sin(longitudes),
+            np.sin(latitudes),
+        )
+    )
+
+
+def km_to_chord(distance_km: float) -> float:
+    """Convert a great-circle distance into a chord on the unit sphere."""
+    return 2 * np.sin(min(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Convert chords on the unit sphere into great-circle distances."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+class GeoIndex:
+    """Spatial index of the job offers with coordinates.
+
+    The query methods return the positions of the offers in the dataframe
+    the index was built from, for use with `dataframe.iloc`.
+    """
+
+    def __init__(self, dataframe: pd.DataFrame):
+        if LATITUDE in dataframe and LONGITUDE in dataframe:
+            latitudes = pd.to_numeric(dataframe[LATITUDE], errors="coerce")
+            longitudes = pd.to_numeric(dataframe[LONGITUDE], errors="coerce")
+        else:
+            latitudes = longitudes = pd.Series(np.nan, index=dataframe.index)
+        located = (latitudes.notna() & longitudes.notna()).to_numpy()
+        # Positions of the offers with coordinates
+        self.positions = np.flatnonzero(located)
+        self.latitudes = latitudes.to_numpy(dtype=np.float64)[located]
+        self.longitudes = longitudes.to_numpy(dtype=np.float64)[located]
+        self.tree = cKDTree(to_cartesian(self.latitudes, self.longitudes))
+        # Latitudes sorted for the bounding-box queries
+        self._latitude_order = np.argsort(self.latitudes, kind="stable")
+        self._sorted_latitudes = self.latitudes[self._latitude_order]
+        self.communes = get_communes(dataframe, located)
+        self._commune_tree = cKDTree(
+            to_cartesian(
+                self.communes["latitude"], self.communes["longitude"]
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def within_radius(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float
+    ) -> np.ndarray:
+        """Find the offers within a distance of a point.
+
+        Args:
+            latitude (float): latitude of the point
+            longitude (float): longitude of the point
+            radius_km (float): the distance, in kilometres
+
+        Returns:
+            np.ndarray: the positions of the offers, sorted
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        matches = self.tree.query_ball_point(
+            to_cartesian([latitude], [longitude])[0], km_to_chord(radius_km)
+        )
+        return np.sort(self.positions[np.asarray(matches, dtype=np.int64)])
+
+    def within_bbox(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float
+    ) -> np.ndarray:
+        """Find the offers within a bounding box.
+
+        The latitudes are bisected, then the longitudes of that band are
+        compared. A box crossing the antimeridian has `west > east`.
+
+        Args:
+            south (float): minimum latitude
+            west (float): minimum longitude
+            north (float): maximum latitude
+            east (float): maximum longitude
+
+        Returns:
+            np.ndarray: the positions of the offers, sorted
+        """
+        first = np.searchsorted(self._sorted_latitudes, south, side="left")
+        last = np.searchsorted(self._sorted_latitudes, north, side="right")
+        band = self._latitude_order[first:last]
+        longitudes = self.longitudes[band]
+        if west <= east:
+            inside = (longitudes >= west) & (longitudes <= east)
+        else:
+            inside = (longitudes >= west) | (longitudes <= east)
+        return np.sort(self.positions[band[inside]])
+
+    def nearest_communes(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int = 5
+    ) -> pd.DataFrame:
+        """Find the communes with offers nearest to a point.
+
+        Args:
+            latitude (float): latitude of the point
+            longitude (float): longitude of the point
+            k (int, optional): number of communes. Defaults to 5.
+
+        Returns:
+            pd.DataFrame: the communes and their 'distance_km', nearest first
+        """
+        k = min(k, len(self.communes))
+        if not k:
+            return self.communes.assign(distance_km=np.nan)
+        chords, indices = self._commune_tree.query(
+            to_cartesian([latitude], [longitude])[0], k=k
+        )
+        nearest = self.communes.iloc[np.atleast_1d(indices)].copy()
+        nearest["distance_km"] = chord_to_km(np.atleast_1d(chords))
+        return nearest.reset_index(drop=True)
+
+    def locate(self, place: str) -> tuple[float, float]:
+        """Find the coordinates of a commune from its name or code.
+
+        The names are compared without accents nor case, e.g. 'bordeaux'.
+
+        Args:
+            place (str): name ('ville') or code of the commune
+
+        Returns:
+            tuple[float, float]: the latitude and longitude, or `None` if the
+                commune has no offer with coordinates
+        """
+        folded = text_index.fold_accents(place.strip())
+        matches = self.communes[
+            (self.communes["commune"] == place.strip())
+            | (self.communes["ville"].map(text_index.fold_accents) == folded)
+        ]
+        if matches.empty:
+            return None
+        best = matches.sort_values("nb_offres", ascending=False).iloc[0]
+        return float(best["latitude"]), float(best["longitude"])
+
+
+def get_communes(
+    dataframe: pd.DataFrame,
+    located: np.ndarray
+) -> pd.DataFrame:
+    """Average the coordinates of the offers of each commune.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        located (np.ndarray): mask of the offers with coordinates
+
+    Returns:
+        pd.DataFrame: the 'commune', 'ville', 'latitude', 'longitude' and
+            'nb_offres' of each commune
+    """
+    columns = ["commune", "ville", "latitude", "longitude", "nb_offres"]
+    if not located.any():
+        return pd.DataFrame(columns=columns)
+    offers = pd.DataFrame(
+        {
+            "commune": dataframe[COMMUNE].to_numpy()[located]
+            if COMMUNE in dataframe else None,
+            "ville": dataframe["ville"].to_numpy()[located]
+            if "ville" in dataframe else None,
+            "latitude": pd.to_numeric(
+                dataframe[LATITUDE], errors="coerce"
+            ).to_numpy()[located],
+            "longitude": pd.to_numeric(
+                dataframe[LONGITUDE], errors="coerce"
+            ).to_numpy()[located],
+        }
+    )
+    keys = ["commune", "ville"]
+    offers[keys] = offers[keys].fillna("")
+    communes = offers.groupby(keys, sort=False).agg(
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+        nb_offres=("latitude", "size"),
+    )
+    return communes.reset_index()[columns]
+
+
+def aggregate_hexbins(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    radius_km: float = 10.0
+) -> pd.DataFrame:
+    """Count the points within each hexagon of a regular grid.
+
+    The points are projected on a plane (equirectangular projection around
+    their mean latitude), where the hexagons have a `radius_km` radius.
+
+    Args:
+        latitudes (np.ndarray): the latitudes
+        longitudes (np.ndarray): the longitudes
+        radius_km (float, optional): radius of the hexagons.
+            Defaults to 10.0.
+
+    Returns:
+        pd.DataFrame: the 'latitude' and 'longitude' of the centre of each
+            non-empty hexagon, and its number of points 'nb_offres'
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if not len(latitudes):
+        return pd.DataFrame(columns=["latitude", "longitude", "nb_offres"])
+    km_per_longitude = KM_PER_DEGREE * np.cos(np.radians(latitudes.mean()))
+    x = longitudes * km_per_longitude / radius_km
+    y = latitudes * KM_PER_DEGREE / radius_km
+
+    # Axial coordinates of pointy-top hexagons, rounded in cube coordinates
+    q = np.sqrt(3) / 3 * x - y / 3
+    r = 2 / 3 * y
+    cube_x, cube_z = np.round(q), np.round(r)
+    cube_y = np.round(-q - r)
+    dx, dy, dz = (
+        np.abs(cube_x - q), np.abs(cube_y + q + r), np.abs(cube_z - r)
+    )
+    fix_x = (dx > dy) & (dx > dz)
+    fix_z = ~fix_x & (dz >= dy)
+    cube_x = np.where(fix_x, -cube_y - cube_z, cube_x)
+    cube_z = np.where(fix_z, -cube_x - cube_y, cube_z)
+
+    bins = pd.DataFrame({"q": cube_x, "r": cube_z})
+    counts = bins.groupby(["q", "r"]).size().rename("nb_offres").reset_index()
+    centre_x = np.sqrt(3) * (counts["q"] + counts["r"] / 2) * radius_km
+    centre_y = 1.5 * counts["r"] * radius_km
+    return pd.DataFrame(
+        {
+            "latitude": centre_y / KM_PER_DEGREE,
+            "longitude": centre_x / km_per_longitude,
+            "nb_offres": counts["nb_offres"],
+        }
+    )
+
+
+def create_hexbin_layer(hexbins: pd.DataFrame, radius_km: float) -> object:
+    """Draw the hexagonal bins as hexagonal columns with pydeck.
+
+    Args:
+        hexbins (pd.DataFrame): output of `aggregate_hexbins()`
+        radius_km (float): radius of the hexagons
+
+    Returns:
+        pydeck.Layer: the layer of the map
+    """
+    import pydeck as pdk
+
+    return pdk.Layer(
+        "ColumnLayer",
+        data=hexbins,
+        get_position=["longitude", "latitude"],
+        get_elevation="nb_offres",
+        elevation_scale=radius_km * 50,
+        radius=radius_km * 1000,
+        disk_resolution=6,
+        angle=90,
+        get_fill_color=[255, 140, 0, 180],
+        pickable=True,
+        extruded=True,
+    )
@@ -0,0 +1,334 @@
+"""History of the number of job offers, recorded at each harvest.
+
+For each query and each harvest, the total number of offers (the
+'max_results' of the `Content-Range`) and the number of offers for each value
+of the search filters (`filtresPossibles`) are stored in a SQLite database,
+next to the snapshots. The numbers of distinct offers (the duplicates
+removed) for each filter value, counted from the offers themselves, are
+stored apart, so that the counts compared are always of the same source.
+The trends and week-over-week deltas of the app are then read from this
+history instead of extra searches of the API.
+
+The timestamps are stored as ISO 8601 UTC strings, which sort in time order,
+so that a range query is a range scan of the primary key.
+"""
+
+import datetime
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+HISTORY_FILE_NAME = "history.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS harvests (
+    query TEXT NOT NULL,
+    harvested_at TEXT NOT NULL,
+    max_results INTEGER NOT NULL,
+    PRIMARY KEY (query, harvested_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS filter_counts (
+    query TEXT NOT NULL,
+    harvested_at TEXT NOT NULL,
+    filtre TEXT NOT NULL,
+    valeur_possible TEXT NOT NULL,
+    nb_resultats INTEGER NOT NULL,
+    PRIMARY KEY (query, harvested_at, filtre, valeur_possible)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS offer_counts (
+    query TEXT NOT NULL,
+    harvested_at TEXT NOT NULL,
+    filtre TEXT NOT NULL,
+    valeur_possible TEXT NOT NULL,
+    nb_resultats INTEGER NOT NULL,
+    PRIMARY KEY (query, harvested_at, filtre, valeur_possible)
+) WITHOUT ROWID;
+"""
+
+
+def get_history_file(snapshot_dir: str) -> Path:
+    """Get the history database stored next to the snapshots.
+
+    Args:
+        snapshot_dir (str): root directory of the snapshots
+
+    Returns:
+        Path: the SQLite file
+    """
+    return Path(snapshot_dir, HISTORY_FILE_NAME)
+
+
+def to_timestamp(moment: object) -> str:
+    """Format a date or datetime as stored in the history.
+
+    Args:
+        moment (object): a datetime (naive ones are taken as UTC), a date
+            (taken at midnight UTC) or an ISO 8601 string
+
+    Returns:
+        str: the UTC timestamp, e.g. '2022-06-30T08:00:00.000000Z'
+    """
+    timestamp = pd.Timestamp(moment)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def connect(history_file: str) -> sqlite3.Connection:
+    """Open the history database, creating it if needed.
+
+    Args:
+        history_file (str): the SQLite file
+
+    Returns:
+        sqlite3.Connection: the connection
+    """
+    Path(history_file).parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(history_file, timeout=30)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def record_harvest(
+    history_file: str,
+    query: str,
+    content_range: dict,
+    filters: list[dict],
+    harvested_at: object = None,
+    offer_counts: pd.DataFrame = None,
+) -> str:
+    """Record the number of offers of a harvest.
+
+    Args:
+        history_file (str): the SQLite file
+        query (str): name of the query
+        content_range (dict): the `Content-Range` of the search
+        filters (list[dict]): the `filtresPossibles` of the search
+        harvested_at (object, optional): time of the harvest.
+            Defaults to None, i.e. now.
+        offer_counts (pd.DataFrame, optional): the number of distinct
+            offers of each filter value (see `pipeline.count_filters()`).
+            Defaults to None, i.e. not recorded.
+
+    Returns:
+        str: the timestamp of the record
+    """
+    if harvested_at is None:
+        harvested_at = datetime.datetime.now(datetime.timezone.utc)
+    timestamp = to_timestamp(harvested_at)
+    filter_rows = [
+        (
+            query,
+            timestamp,
+            search_filter["filtre"],
+            str(aggregate["valeurPossible"]),
+            int(aggregate["nbResultats"]),
+        )
+        for search_filter in filters or []
+        for aggregate in search_filter["agregation"]
+    ]
+    offer_rows = [] if offer_counts is None else [
+        (query, timestamp, filter_name, str(value), int(nb_results))
+        for filter_name, value, nb_results in offer_counts[
+            ["filtre", "valeur_possible", "nb_resultats"]
+        ].itertuples(index=False)
+    ]
+    connection = connect(history_file)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO harvests VALUES (?, ?, ?)",
+                (query, timestamp, int(content_range["max_results"])),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO filter_counts VALUES (?, ?, ?, ?, ?)",
+                filter_rows,
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO offer_counts VALUES (?, ?, ?, ?, ?)",
+                offer_rows,
+            )
+    finally:
+        connection.close()
+    return timestamp
+
+
+def _read(history_file: str, sql: str, params: tuple) -> pd.DataFrame:
+    """Run a query on the history, if it exists."""
+    if not Path(history_file).exists():
+        return None
+    connection = connect(history_file)
+    try:
+        return pd.read_sql_query(sql, connection, params=params)
+    finally:
+        connection.close()
+
+
+def get_history(
+    history_file: str,
+    query: str = "default",
+    start: object = None,
+    end: object = None,
+    daily: bool = False,
+) -> pd.DataFrame:
+    """Get the total number of offers of a query over a period.
+
+    Args:
+        history_file (str): the SQLite file
+        query (str, optional): name of the query. Defaults to "default".
+        start (object, optional): start of the period (included).
+            Defaults to None, i.e. since the first harvest.
+        end (object, optional): end of the period (included).
+            Defaults to None, i.e. until the last harvest.
+        daily (bool, optional): whether to keep the last harvest of each day
+            only. Defaults to False.
+
+    Returns:
+        pd.DataFrame: the 'harvested_at' (datetime) and 'max_results' of
+            each harvest, in time order
+    """
+    start = to_timestamp(start) if start is not None else ""
+    end = to_timestamp(end) if end is not None else "~"
+    if daily:
+        # SQLite takes the bare columns from the row of the MAX()
+        sql = (
+            "SELECT MAX(harvested_at) AS harvested_at, max_results "
+            "FROM harvests WHERE query = ? AND harvested_at BETWEEN ? AND ? "
+            "GROUP BY substr(harvested_at, 1, 10) ORDER BY harvested_at"
+        )
+    else:
+        sql = (
+            "SELECT harvested_at, max_results FROM harvests "
+            "WHERE query = ? AND harvested_at BETWEEN ? AND ? "
+            "ORDER BY harvested_at"
+        )
+    history = _read(history_file, sql, (query, start, end))
+    if history is None:
+        history = pd.DataFrame(columns=["harvested_at", "max_results"])
+    history["harvested_at"] = pd.to_datetime(history["harvested_at"],
+                                             utc=True)
+    return history
+
+
+def get_filter_history(
+    history_file: str,
+    query: str = "default",
+    start: object = None,
+    end: object = None,
+    filter_name: str = None,
+) -> pd.DataFrame:
+    """Get the number of offers of each filter value over a period.
+
+    Args:
+        history_file (str): the SQLite file
+        query (str, optional): name of the query. Defaults to "default".
+        start (object, optional): start of the period (included).
+            Defaults to None, i.e. since the first harvest.
+        end (object, optional): end of the period (included).
+            Defaults to None, i.e. until the last harvest.
+        filter_name (str, optional): e.g. 'typeContrat'.
+            Defaults to None, i.e. every filter.
+
+    Returns:
+        pd.DataFrame: the 'harvested_at', 'filtre', 'valeur_possible' and
+            'nb_resultats', in time order
+    """
+    sql = (
+        "SELECT harvested_at, filtre, valeur_possible, nb_resultats "
+        "FROM filter_counts WHERE query = ? AND harvested_at BETWEEN ? AND ? "
+    )
+    params = (
+        query,
+        to_timestamp(start) if start is not None else "",
+        to_timestamp(end) if end is not None else "~",
+    )
+    if filter_name is not None:
+        sql += "AND filtre = ? "
+        params += (filter_name,)
+    history = _read(history_file, sql + "ORDER BY harvested_at", params)
+    if history is None:
+        history = pd.DataFrame(
+            columns=[
+                "harvested_at", "filtre", "valeur_possible", "nb_resultats"
+            ]
+        )
+    history["harvested_at"] = pd.to_datetime(history["harvested_at"],
+                                             utc=True)
+    return history
+
+
+def get_count_at(
+    history_file: str,
+    moment: object,
+    query: str = "default",
+    distinct: bool = False,
+) -> tuple[int, pd.DataFrame]:
+    """Get the numbers of offers of the last harvest at a given time.
+
+    Args:
+        history_file (str): the SQLite file
+        moment (object): the time, e.g. one week ago
+        query (str, optional): name of the query. Defaults to "default".
+        distinct (bool, optional): whether to get the numbers of distinct
+            offers of each filter value rather than those of the API.
+            Defaults to False.
+
+    Returns:
+        tuple[int, pd.DataFrame]: the total number of offers and the number
+            of offers of each filter value ('filtre', 'valeur_possible' and
+            'nb_resultats'), or `(None, None)` if no harvest was recorded
+            before that time
+    """
+    last_harvest = _read(
+        history_file,
+        "SELECT harvested_at, max_results FROM harvests "
+        "WHERE query = ? AND harvested_at <= ? "
+        "ORDER BY harvested_at DESC LIMIT 1",
+        (query, to_timestamp(moment)),
+    )
+    if last_harvest is None or last_harvest.empty:
+        return None, None
+    harvested_at, max_results = last_harvest.iloc[0]
+    table = "offer_counts" if distinct else "filter_counts"
+    filter_counts = _read(
+        history_file,
+        f"SELECT filtre, valeur_possible, nb_resultats FROM {table} "
+        "WHERE query = ? AND harvested_at = ?",
+        (query, harvested_at),
+    )
+    return int(max_results), filter_counts
+
+
+def add_filter_deltas(
+    filters_df: pd.DataFrame,
+    previous_counts: pd.DataFrame
+) -> pd.DataFrame:
+    """Add the change in the number of offers of each filter value.
+
+    Both counts must be of the same source: the API or the distinct
+    offers (see `get_count_at()`).
+
+    Args:
+        filters_df (pd.DataFrame): the current counts ('filtre',
+            'valeur_possible' and 'nb_resultats')
+        previous_counts (pd.DataFrame): the previous counts, same layout
+
+    Returns:
+        pd.DataFrame: the current counts with a 'nb_resultats_delta' column
+            (empty for the values not counted previously)
+    """
+    keys = ["filtre", "valeur_possible"]
+    if previous_counts is None:
+        return filters_df.assign(nb_resultats_delta=pd.NA)
+    previous = previous_counts.rename(
+        columns={"nb_resultats": "previous_nb_resultats"}
+    )
+    merged = filters_df.assign(
+        valeur_possible=filters_df["valeur_possible"].astype(str)
+    ).merge(previous, on=keys, how="left")
+    filters_df = filters_df.copy()
+    filters_df["nb_resultats_delta"] = (
+        merged["nb_resultats"] - merged["previous_nb_resultats"]
+    ).to_numpy()
+    return filters_df
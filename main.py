@@ -0,0 +1,201 @@
+"""Headless harvest of job offers from the Pole Emploi API.
+
+Run the pipeline (search, normalize, clean, store) as a batch job, e.g. from
+cron or a systemd timer, without Streamlit. The web app then only reads the
+prepared snapshots (see `pipeline.load_snapshot()`).
+
+The API credentials are read from the `API_PE_CLIENT` and `API_PE_SECRET`
+environment variables, else from the '.streamlit/secrets.toml' file.
+
+Each query is given as 'NAME' or 'NAME:PARAMETERS', the parameters being
+formatted as an URL query string (a '+' is kept as is, e.g. in 'Bac+5'),
+e.g.:
+
+    python main.py --query default \
+        --query "bordeaux_bi:motsCles=BI,Bac+5&departement=33" \
+        --workers 4 --format arrow
+
+Queries can also be read from a JSON file mapping names to parameters:
+
+    python main.py --queries-file queries.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import cassette
+import pipeline
+
+SECRETS_FILE = "./.streamlit/secrets.toml"
+
+logger = logging.getLogger("harvest")
+
+
+def parse_query(query: str) -> tuple[str, dict]:
+    """Parse a query given on the command line.
+
+    The parameters are percent-decoded, but a '+' is not taken for a space
+    (unlike `urllib.parse.parse_qsl()`), since it appears in the keywords,
+    e.g. 'motsCles=BI,Bac+5'.
+
+    Args:
+        query (str): 'NAME' or 'NAME:PARAMETERS', e.g.
+            'bordeaux:departement=33&typeContrat=CDI'
+
+    Returns:
+        tuple[str, dict]: the name and the parameters of the search
+    """
+    name, _, query_string = query.partition(":")
+    params = {}
+    for parameter in query_string.split("&"):
+        key, _, value = parameter.partition("=")
+        if key:
+            params[unquote(key)] = unquote(value)
+    return name, params
+
+
+def load_queries(arguments: argparse.Namespace) -> dict[str, dict]:
+    """Gather the queries from the command line and the queries file.
+
+    Args:
+        arguments (argparse.Namespace): the command-line arguments
+
+    Returns:
+        dict[str, dict]: the search parameters of each query name
+    """
+    queries = {}
+    if arguments.queries_file:
+        with open(arguments.queries_file, encoding="utf-8") as input_file:
+            queries.update(json.load(input_file))
+    for query in arguments.query or []:
+        name, params = parse_query(query)
+        queries[name] = params
+    return queries or {"default": {}}
+
+
+def get_credentials() -> tuple[str, str]:
+    """Get the API credentials from the environment or the secrets file.
+
+    Raises:
+        RuntimeError: no credentials were found
+
+    Returns:
+        tuple[str, str]: the client ID and secret
+    """
+    client_id = os.environ.get("API_PE_CLIENT")
+    client_secret = os.environ.get("API_PE_SECRET")
+    if (not client_id or not client_secret) and os.path.exists(SECRETS_FILE):
+        import toml
+
+        passwords = toml.load(SECRETS_FILE).get("passwords", {})
+        client_id = passwords.get("API_PE_CLIENT")
+        client_secret = passwords.get("API_PE_SECRET")
+    if not client_id or not client_secret:
+        raise RuntimeError(
+            "Set the API_PE_CLIENT and API_PE_SECRET environment variables"
+        )
+    return client_id, client_secret
+
+
+def create_client() -> object:
+    """Create the API client (or its cassette replacement)."""
+    if cassette.get_cassette_mode() == "replay":
+        return cassette.wrap_client()
+    from offres_emploi import Api
+
+    client_id, client_secret = get_credentials()
+    return cassette.wrap_client(
+        Api(client_id=client_id, client_secret=client_secret)
+    )
+
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    """Parse the command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument(
+        "--query", action="append",
+        help="query 'NAME[:PARAMETERS]', can be repeated",
+    )
+    parser.add_argument(
+        "--queries-file", help="JSON file mapping query names to parameters"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4,
+        help="number of pages fetched concurrently for each query",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="number of processes normalizing the pages, one per CPU if unset",
+    )
+    parser.add_argument(
+        "--parallel-queries", type=int, default=1,
+        help="number of queries run concurrently",
+    )
+    parser.add_argument(
+        "--max-offers", type=int, default=None,
+        help="maximum number of offers fetched for each query",
+    )
+    parser.add_argument(
+        "--format", choices=pipeline.SNAPSHOT_FORMATS, default="arrow",
+        help="format of the snapshots, 'arrow' being memory-mapped by the app",
+    )
+    parser.add_argument(
+        "--output-dir", default=pipeline.DEFAULT_SNAPSHOT_DIR,
+        help="root directory of the snapshots",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    """Harvest the job offers of every query.
+
+    Args:
+        argv (list[str], optional): command-line arguments.
+            Defaults to None, i.e. `sys.argv`.
+
+    Returns:
+        int: exit code, 1 if any query failed
+    """
+    arguments = parse_arguments(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if arguments.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    queries = load_queries(arguments)
+    client = create_client()
+
+    def harvest(name: str) -> bool:
+        try:
+            output_dir = pipeline.run_harvest(
+                client,
+                params=queries[name],
+                name=name,
+                max_offers=arguments.max_offers,
+                max_workers=arguments.workers,
+                snapshot_dir=arguments.output_dir,
+                file_format=arguments.format,
+                max_processes=arguments.processes,
+            )
+        except Exception:
+            logger.exception("Query '%s' failed", name)
+            return False
+        logger.info("Query '%s' saved to %s", name, output_dir)
+        return True
+
+    with ThreadPoolExecutor(max_workers=arguments.parallel_queries) as pool:
+        succeeded = list(pool.map(harvest, queries))
+    return 0 if all(succeeded) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,480 @@
+"""Synthetic job offers shaped like the Pole Emploi API search output.
+
+The generated payloads mimic what `api_client.search()` returns for the
+'Offres d'emploi v2' API, i.e. a dictionary with the `resultats`, the
+`filtresPossibles` and the `Content-Range`, so the data pipeline can be run
+(and benchmarked) without any API credentials.
+
+Nested categories ('lieuTravail', 'entreprise', 'salaire', 'competences',
+'langues', 'formations', 'permis', etc.) are generated with null rates close
+to the ones observed in real searches, e.g. 'salaire' or 'langues' are NOT
+always present.
+"""
+
+import random
+import datetime
+
+# Share of offers WITHOUT the given category (observed on real searches)
+NULL_RATES = {
+    "salaire": 0.35,
+    "langues": 0.75,
+    "permis": 0.70,
+    "formations": 0.45,
+    "competences": 0.15,
+    "qualitesProfessionnelles": 0.30,
+    "contact": 0.40,
+    "agence": 0.55,
+    "entreprise.nom": 0.25,
+    "entreprise.description": 0.60,
+    "lieuTravail.coordinates": 0.08,
+    "romeCode": 0.02,
+    "secteurActivite": 0.10,
+    "complementExercice": 0.85,
+}
+
+# (departement, ville, latitude, longitude, code commune)
+LOCATIONS = [
+    ("75", "PARIS 08", 48.8727, 2.3125, "75108"),
+    ("75", "PARIS 15", 48.8421, 2.2926, "75115"),
+    ("69", "LYON 03", 45.7597, 4.8422, "69383"),
+    ("13", "MARSEILLE 01", 43.2999, 5.3841, "13201"),
+    ("33", "BORDEAUX", 44.8378, -0.5792, "33063"),
+    ("33", "MERIGNAC", 44.8386, -0.6436, "33281"),
+    ("31", "TOULOUSE", 43.6045, 1.4440, "31555"),
+    ("44", "NANTES", 47.2184, -1.5536, "44109"),
+    ("59", "LILLE", 50.6292, 3.0573, "59350"),
+    ("67", "STRASBOURG", 48.5734, 7.7521, "67482"),
+    ("34", "MONTPELLIER", 43.6108, 3.8767, "34172"),
+    ("35", "RENNES", 48.1173, -1.6778, "35238"),
+    ("06", "NICE", 43.7102, 7.2620, "06088"),
+    ("38", "GRENOBLE", 45.1885, 5.7245, "38185"),
+    ("64", "PAU", 43.2951, -0.3708, "64445"),
+    ("29", "BREST", 48.3904, -4.4861, "29019"),
+    ("21", "DIJON", 47.3220, 5.0415, "21231"),
+    ("974", "SAINT DENIS", -20.8821, 55.4507, "97411"),
+]
+
+# (romeCode, romeLibelle, appellation, secteur NAF, secteur libelle)
+JOBS = [
+    ("M1805", "Études et développement informatique",
+     "Développeur / Développeuse web", "62", "Programmation informatique"),
+    ("M1403", "Études et prospectives socio-économiques",
+     "Data analyst", "73", "Études de marché et sondages"),
+    ("M1801", "Administration de systèmes d'information",
+     "Administrateur / Administratrice systèmes", "62",
+     "Conseil en systèmes et logiciels informatiques"),
+    ("K2204", "Nettoyage de locaux", "Agent / Agente de propreté", "81",
+     "Nettoyage courant des bâtiments"),
+    ("G1603", "Personnel polyvalent en restauration",
+     "Employé polyvalent / Employée polyvalente de restauration", "56",
+     "Restauration traditionnelle"),
+    ("N1103", "Magasinage et préparation de commandes",
+     "Préparateur / Préparatrice de commandes", "52",
+     "Entreposage et stockage non frigorifique"),
+    ("J1506", "Soins infirmiers généralistes", "Infirmier / Infirmière", "86",
+     "Activités hospitalières"),
+    ("D1106", "Vente en alimentation", "Vendeur / Vendeuse en boulangerie",
+     "10", "Boulangerie et boulangerie-pâtisserie"),
+    ("H2913", "Soudage manuel", "Soudeur / Soudeuse", "25",
+     "Mécanique industrielle"),
+    ("M1607", "Secrétariat", "Secrétaire", "78",
+     "Activités des agences de travail temporaire"),
+]
+
+CONTRACT_TYPES = [
+    ("CDI", "Contrat à durée indéterminée", 0.55),
+    ("CDD", "Contrat à durée déterminée - 6 Mois", 0.25),
+    ("MIS", "Mission intérimaire - 3 Mois", 0.15),
+    ("SAI", "Travail saisonnier - 2 Mois", 0.03),
+    ("LIB", "Profession libérale", 0.02),
+]
+
+CONTRACT_NATURES = [
+    ("E1", "Contrat travail", 0.85),
+    ("E2", "Contrat apprentissage", 0.05),
+    ("FS", "Cont. professionnalisation", 0.04),
+    ("FT", "CUI - Parcours Emploi Compétences", 0.03),
+    ("I1", "Insertion par l'activ.éco.", 0.03),
+]
+
+EXPERIENCES = [
+    ("D", "Débutant accepté", 0.45),
+    ("E", "1 an - expérience exigée", 0.35),
+    ("S", "2 ans - expérience souhaitée", 0.20),
+]
+
+QUALIFICATIONS = [
+    ("1", "Manoeuvre", 0.05),
+    ("3", "Ouvrier qualifié (P1,P2)", 0.10),
+    ("5", "Employé non qualifié", 0.20),
+    ("6", "Employé qualifié", 0.35),
+    ("7", "Technicien", 0.10),
+    ("8", "Agent de maîtrise", 0.05),
+    ("9", "Cadre", 0.15),
+]
+
+COMPETENCES = [
+    ("100007", "Analyser des données statistiques"),
+    ("104233", "Concevoir une application web"),
+    ("121837", "Développer une application en lien avec une base de données"),
+    ("103998", "Utiliser un logiciel de Business Intelligence"),
+    ("117510", "Élaborer des tableaux de bord"),
+    ("120611", "Nettoyer des locaux"),
+    ("122286", "Préparer les commandes"),
+    ("104544", "Accueillir une clientèle"),
+    ("106556", "Réaliser des soudures"),
+    ("113994", "Réaliser un soin infirmier"),
+    ("111813", "Rédiger un compte-rendu"),
+    ("124183", "Gérer un planning"),
+    ("101832", "Encaisser le montant d'une vente"),
+    ("107946", "Contrôler la conformité des données"),
+]
+
+QUALITES = [
+    ("Autonomie", "Capacité à prendre en charge son activité"),
+    ("Travail en équipe", "Capacité à travailler avec d'autres personnes"),
+    ("Rigueur", "Capacité à respecter les règles et les procédures"),
+    ("Sens de la communication", "Capacité à transmettre des informations"),
+    ("Ouverture d'esprit", "Capacité à accepter d'autres points de vue"),
+    ("Capacité d'adaptation", "Capacité à s'adapter à des situations"),
+    ("Sens de l'organisation", "Capacité à planifier et prioriser"),
+    ("Force de proposition", "Capacité à proposer de nouvelles idées"),
+]
+
+LANGUES = ["Anglais", "Espagnol", "Allemand", "Italien"]
+PERMIS = ["B - Véhicule léger", "C - Poids lourd", "CE - PL + remorque"]
+FORMATIONS = [
+    ("31054", "Informatique", "Bac+5 et plus ou équivalents"),
+    ("31023", "Statistique", "Bac+3, Bac+4 ou équivalents"),
+    ("42054", "Hôtellerie restauration", "CAP, BEP et équivalents"),
+    ("43448", "Soins infirmiers", "Bac+2 ou équivalents"),
+    ("23054", "Soudage", "Bac ou équivalent"),
+]
+
+COMPANIES = [
+    "EPSILON", "ACME CONSEIL", "DATA SOLUTIONS", "BOULANGERIE DUPONT",
+    "CLINIQUE DU PARC", "LOGISTIQUE OUEST", "NETTOYAGE PRO", "INTERIM PLUS",
+    "RESTAURANT LE PORT", "METALLERIE DU SUD", "CABINET MARTIN",
+    "SOFT INGENIERIE",
+]
+
+DESCRIPTIONS = [
+    "Vous intégrerez une équipe de {n} personnes et participerez à "
+    "l'ensemble des projets de l'entreprise. Vos missions : analyse des "
+    "besoins, réalisation, tests et suivi de la mise en production. "
+    "Poste à pourvoir rapidement.",
+    "Au sein de notre établissement, vous serez en charge des tâches "
+    "quotidiennes du service. Horaires en journée, du lundi au vendredi. "
+    "Une première expérience sur un poste similaire est appréciée.",
+    "Rattaché(e) au responsable d'équipe, vous assurez la bonne exécution "
+    "des opérations dans le respect des règles d'hygiène et de sécurité. "
+    "Travail possible le week-end. Mutuelle et tickets restaurant.",
+    "Notre client, acteur reconnu de son secteur, recherche un(e) "
+    "collaborateur(trice) motivé(e). Vous êtes rigoureux(se), autonome et "
+    "avez le sens du service. Rejoignez une structure à taille humaine !",
+]
+
+# Salary 'libelle' formats returned by the API
+SALARY_FORMATS = [
+    ("Mensuel de {low:.2f} Euros à {high:.2f} Euros sur {months} mois", 0.45),
+    ("Mensuel de {low:.2f} Euros sur {months} mois", 0.20),
+    ("Annuel de {low_y:.2f} Euros à {high_y:.2f} Euros sur {months} mois",
+     0.20),
+    ("Horaire de {hourly:.2f} Euros sur 12 mois", 0.12),
+    ("Autre", 0.03),
+]
+
+
+def _weighted_choice(rng: random.Random, choices: list[tuple]) -> tuple:
+    """Pick an item from a list of tuples whose last element is a weight.
+
+    Args:
+        rng (random.Random): random generator
+        choices (list): tuples ending with their probability
+
+    Returns:
+        tuple: the chosen tuple
+    """
+    return rng.choices(choices, weights=[item[-1] for item in choices])[0]
+
+
+def _is_missing(rng: random.Random, field: str) -> bool:
+    """Draw whether a field is absent from an offer.
+
+    Args:
+        rng (random.Random): random generator
+        field (str): key of the `NULL_RATES` dictionary
+
+    Returns:
+        bool: `True` if the field must be left out
+    """
+    return rng.random() < NULL_RATES[field]
+
+
+def _generate_salary(rng: random.Random) -> dict:
+    """Generate the 'salaire' category of an offer.
+
+    Args:
+        rng (random.Random): random generator
+
+    Returns:
+        dict: the 'salaire' category
+    """
+    salary_format = _weighted_choice(rng, SALARY_FORMATS)[0]
+    low = round(rng.uniform(1700, 4000), -1)
+    high = low + round(rng.uniform(100, 1500), -1)
+    months = rng.choice([12, 12, 12, 13, 13.5])
+    salary = {
+        "libelle": salary_format.format(
+            low=low,
+            high=high,
+            low_y=low * 12,
+            high_y=high * 12,
+            hourly=rng.uniform(11.07, 25),
+            months=months,
+        )
+    }
+    if rng.random() < 0.3:
+        salary["complement1"] = "Mutuelle"
+    if rng.random() < 0.1:
+        salary["commentaire"] = "selon profil"
+    return salary
+
+
+def _generate_offer(rng: random.Random, index: int,
+                    now: datetime.datetime) -> dict:
+    """Generate a single job offer as found in the search `resultats`.
+
+    Args:
+        rng (random.Random): random generator
+        index (int): index of the offer, used to build a unique 'id'
+        now (datetime.datetime): most recent creation date
+
+    Returns:
+        dict: the job offer
+    """
+    departement, ville, latitude, longitude, commune = rng.choice(LOCATIONS)
+    rome_code, rome_libelle, appellation, secteur, secteur_libelle = (
+        rng.choice(JOBS)
+    )
+    contract_type, contract_libelle, _ = _weighted_choice(rng, CONTRACT_TYPES)
+    contract_nature, nature_libelle, _ = _weighted_choice(
+        rng, CONTRACT_NATURES
+    )
+    experience, experience_libelle, _ = _weighted_choice(rng, EXPERIENCES)
+    qualification, qualification_libelle, _ = _weighted_choice(
+        rng, QUALIFICATIONS
+    )
+    created = now - datetime.timedelta(seconds=rng.randrange(0, 60 * 86400))
+    created_iso = created.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    lieu_travail = {
+        "libelle": f"{departement} - {ville}",
+        "codePostal": commune if departement != "974" else "97400",
+        "commune": commune,
+    }
+    if not _is_missing(rng, "lieuTravail.coordinates"):
+        # Jitter the coordinates within the commune
+        lieu_travail["latitude"] = round(
+            latitude + rng.uniform(-0.05, 0.05), 6
+        )
+        lieu_travail["longitude"] = round(
+            longitude + rng.uniform(-0.05, 0.05), 6
+        )
+
+    entreprise = {"entrepriseAdaptee": rng.random() < 0.02}
+    if not _is_missing(rng, "entreprise.nom"):
+        entreprise["nom"] = rng.choice(COMPANIES)
+    if not _is_missing(rng, "entreprise.description"):
+        entreprise["description"] = (
+            "Entreprise de {} salariés implantée en région.".format(
+                rng.choice(["10 à 19", "50 à 99", "250 à 499"])
+            )
+        )
+
+    offer = {
+        "id": f"{100 + index % 900}{chr(65 + index % 26)}{index:07d}",
+        "intitule": appellation,
+        "description": rng.choice(DESCRIPTIONS).format(n=rng.randint(2, 40)),
+        "dateCreation": created_iso,
+        "dateActualisation": created_iso,
+        "lieuTravail": lieu_travail,
+        "appellationlibelle": appellation,
+        "entreprise": entreprise,
+        "typeContrat": contract_type,
+        "typeContratLibelle": contract_libelle,
+        "natureContrat": nature_libelle,
+        "experienceExige": experience,
+        "experienceLibelle": experience_libelle,
+        "dureeTravailLibelle": "35H Horaires normaux",
+        "dureeTravailLibelleConverti": rng.choice(
+            ["Temps plein", "Temps plein", "Temps partiel"]
+        ),
+        "alternance": contract_nature in ("E2", "FS"),
+        "nombrePostes": rng.choice([1, 1, 1, 2, 3]),
+        "accessibleTH": rng.random() < 0.1,
+        "qualificationCode": qualification,
+        "qualificationLibelle": qualification_libelle,
+        "origineOffre": {
+            "origine": rng.choice(["1", "1", "2"]),
+            "urlOrigine": (
+                "https://candidat.pole-emploi.fr/offres/recherche/detail/"
+                f"{index}"
+            ),
+        },
+        "offresManqueCandidats": rng.random() < 0.2,
+    }
+    if not _is_missing(rng, "romeCode"):
+        offer["romeCode"] = rome_code
+        offer["romeLibelle"] = rome_libelle
+    if not _is_missing(rng, "secteurActivite"):
+        offer["secteurActivite"] = secteur
+        offer["secteurActiviteLibelle"] = secteur_libelle
+    if not _is_missing(rng, "complementExercice"):
+        offer["complementExercice"] = "Travail le samedi"
+    if offer["origineOffre"]["origine"] == "2":
+        offer["origineOffre"]["partenaires"] = [
+            {
+                "nom": rng.choice(["INDEED", "HELLOWORK", "MEETEMPLOI"]),
+                "url": "https://www.example.org/offre",
+                "logo": "https://www.example.org/logo.png",
+            }
+        ]
+    if not _is_missing(rng, "salaire"):
+        offer["salaire"] = _generate_salary(rng)
+    else:
+        # The API often sends an empty 'salaire' category
+        offer["salaire"] = {}
+    if not _is_missing(rng, "competences"):
+        offer["competences"] = [
+            {"code": code, "libelle": libelle,
+             "exigence": rng.choice(["E", "S"])}
+            for code, libelle in rng.sample(COMPETENCES, rng.randint(1, 6))
+        ]
+    if not _is_missing(rng, "qualitesProfessionnelles"):
+        offer["qualitesProfessionnelles"] = [
+            {"libelle": libelle, "description": description}
+            for libelle, description in rng.sample(QUALITES, 3)
+        ]
+    if not _is_missing(rng, "langues"):
+        offer["langues"] = [
+            {"libelle": libelle, "exigence": rng.choice(["E", "S"])}
+            for libelle in rng.sample(LANGUES, rng.randint(1, 2))
+        ]
+    if not _is_missing(rng, "permis"):
+        offer["permis"] = [
+            {"libelle": rng.choice(PERMIS), "exigence": rng.choice(["E", "S"])}
+        ]
+    if not _is_missing(rng, "formations"):
+        code, domaine, niveau = rng.choice(FORMATIONS)
+        offer["formations"] = [
+            {
+                "codeFormation": code,
+                "domaineLibelle": domaine,
+                "niveauLibelle": niveau,
+                "exigence": rng.choice(["E", "S"]),
+            }
+        ]
+    if not _is_missing(rng, "contact"):
+        offer["contact"] = {
+            "nom": offer["entreprise"].get("nom", "Pôle Emploi"),
+            "coordonnees1": "https://www.example.org/postuler",
+            "urlPostulation": "https://www.example.org/postuler",
+        }
+    if not _is_missing(rng, "agence"):
+        offer["agence"] = {"courriel": "Pour postuler, utiliser le lien"}
+    return offer
+
+
+def generate_offers(
+    nb_offers: int,
+    seed: int = 0,
+    now: datetime.datetime = None
+) -> list[dict]:
+    """Generate a list of job offers, as in the `resultats` of a search.
+
+    The output is reproducible for a given seed.
+
+    Args:
+        nb_offers (int): number of offers to generate
+        seed (int, optional): seed of the random generator. Defaults to 0.
+        now (datetime.datetime, optional): most recent creation date.
+            Defaults to a fixed date so that outputs are reproducible.
+
+    Returns:
+        list[dict]: the job offers
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = datetime.datetime(2022, 7, 15, 12, 0, 0)
+    return [_generate_offer(rng, index, now) for index in range(nb_offers)]
+
+
+def build_filters(offers: list[dict]) -> list[dict]:
+    """Count the offers for each value of the 4 search filters.
+
+    Mimic the `filtresPossibles` of the API, i.e. the aggregates for
+    'typeContrat', 'experience', 'qualification' and 'natureContrat'.
+
+    Args:
+        offers (list[dict]): the job offers
+
+    Returns:
+        list[dict]: the filters with their 'agregation' counts
+    """
+    filter_keys = {
+        "typeContrat": "typeContrat",
+        "experience": "experienceExige",
+        "qualification": "qualificationCode",
+        "natureContrat": "natureContrat",
+    }
+    nature_codes = {libelle: code for code, libelle, _ in CONTRACT_NATURES}
+    filters = []
+    for filter_name, offer_key in filter_keys.items():
+        counts = {}
+        for offer in offers:
+            value = offer.get(offer_key)
+            if filter_name == "natureContrat":
+                value = nature_codes.get(value, value)
+            if value is not None:
+                counts[value] = counts.get(value, 0) + 1
+        filters.append(
+            {
+                "filtre": filter_name,
+                "agregation": [
+                    {"valeurPossible": value, "nbResultats": count}
+                    for value, count in sorted(counts.items())
+                ],
+            }
+        )
+    return filters
+
+
+def generate_search_output(
+    nb_offers: int,
+    seed: int = 0,
+    max_results: int = None
+) -> dict:
+    """Generate the full output of `api_client.search()`.
+
+    Args:
+        nb_offers (int): number of offers in the `resultats`
+        seed (int, optional): seed of the random generator. Defaults to 0.
+        max_results (int, optional): total number of hits reported in the
+            `Content-Range`. Defaults to `nb_offers`.
+
+    Returns:
+        dict: the `resultats`, `filtresPossibles` and `Content-Range`
+    """
+    results = generate_offers(nb_offers, seed=seed)
+    if max_results is None:
+        max_results = nb_offers
+    return {
+        "resultats": results,
+        "filtresPossibles": build_filters(results),
+        "Content-Range": {
+            "first_index": "0",
+            "last_index": str(max(nb_offers - 1, 0)),
+            "max_results": str(max_results),
+        },
+    }
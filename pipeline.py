@@ -0,0 +1,1167 @@
+"""Data pipeline of the job offers, free of any Streamlit dependency.
+
+This module holds the single implementation of the fetch/flatten/clean logic
+formerly copied across 'api_pe_v1.py' to 'api_pe_v6.py'. Its stable API is:
+- fetch: fetch ALL the pages of a search (not only the first 150 hits)
+- normalize: convert the job offers into a flat dataframe, one page per
+    worker process
+- profile: count the missing values of each category
+- filter: drop the sparse categories and select offers by value
+- export: serialize the offers (csv, parquet, arrow, feather or json)
+
+The batch harvest (see `main.py`) chains these steps and stores the result
+as a snapshot, which the app then reads.
+"""
+
+import datetime
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import cube
+import dedup
+import history
+import schema
+import sketches
+import text_index
+import text_store
+from query import SearchQuery
+
+# Limits of the 'range' parameter of the search
+PAGE_SIZE = 150
+MAX_FIRST_INDEX = 3000
+# Minimum number of pages normalized by each worker process
+MIN_PAGES_PER_PROCESS = 4
+
+DEFAULT_SNAPSHOT_DIR = "./files/snapshots"
+# 'arrow' is an uncompressed Arrow IPC (Feather v2) file, memory-mapped when
+# read, while 'feather' is compressed
+SNAPSHOT_FORMATS = ("parquet", "arrow", "feather", "csv", "json")
+# Text columns converted from Arrow, kept in their Arrow buffers
+_ARROW_STRING_TYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+}
+LATEST_FILE = "LATEST"
+
+# Nested list categories and the key holding the value of their items
+LIST_CATEGORIES = {
+    "langues": "libelle",
+    "qualitesProfessionnelles": "libelle",
+    "competences": "libelle",
+    "permis": "libelle",
+    "formations": "domaineLibelle",
+}
+
+# Search filters (`filtresPossibles`) displayed in the app
+FILTER_NAMES = ["typeContrat", "experience", "qualification", "natureContrat"]
+# Category of the offers matching each search filter
+FILTER_CATEGORIES = {
+    "typeContrat": "typeContrat",
+    "experience": "experienceExige",
+    "qualification": "qualificationCode",
+    "natureContrat": "natureContrat",
+}
+
+
+# Salary libelle, e.g. "Mensuel de 2000.00 Euros à 2500.00 Euros sur 12 mois"
+SALARY_PATTERN = re.compile(
+    r"^\s*(?P<periode>[A-Za-zé]+)\s+de\s+"
+    r"(?P<salaire_min>\d+(?:[.,]\d+)?)\s*Euros?"
+    r"(?:\s+à\s+(?P<salaire_max>\d+(?:[.,]\d+)?)\s*Euros?)?"
+    r"(?:\s+sur\s+(?P<nb_mois>\d+(?:[.,]\d+)?)\s*mois)?",
+    flags=re.IGNORECASE,
+)
+# Number of periods in a month, to annualize the salaries
+# (the hourly salaries are based on the legal 35-hour week)
+PERIODS_PER_MONTH = {
+    "Horaire": 151.67,
+    "Journalier": 21.67,
+    "Hebdomadaire": 52 / 12,
+    "Mensuel": 1.0,
+}
+MONTHS_PER_YEAR = 12
+
+
+def get_page_ranges(
+    max_results: int,
+    first_index: int = 0,
+    page_size: int = PAGE_SIZE
+) -> list[str]:
+    """List the 'range' parameters needed to fetch all the hits of a search.
+
+    The API cannot return hits beyond the index `MAX_FIRST_INDEX` plus one
+    page, so the list is truncated there.
+
+    Args:
+        max_results (int): total number of hits of the search
+        first_index (int, optional): index of the first hit to fetch.
+            Defaults to 0.
+        page_size (int, optional): number of hits per page.
+            Defaults to PAGE_SIZE.
+
+    Returns:
+        list[str]: the ranges, e.g. ['0-149', '150-299']
+    """
+    return [
+        f"{start}-{min(start + page_size, max_results) - 1}"
+        for start in range(first_index, max_results, page_size)
+        if start <= MAX_FIRST_INDEX
+    ]
+
+
+def fetch_page(api_client, params: dict = None, page_range: str = None):
+    """Fetch one page of a search.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        params (dict, optional): parameters of the search. Defaults to None.
+        page_range (str, optional): the 'range' parameter, e.g. '150-299'.
+            Defaults to None, i.e. the first page.
+
+    Returns:
+        dict: the `resultats`, `filtresPossibles` and `Content-Range`, or
+            None if the search has no hit
+    """
+    # The canonical parameters are sent, e.g. the keywords joined by commas
+    page_params = SearchQuery(params).replace(range=page_range).to_params()
+    try:
+        return api_client.search(params=page_params)
+    except KeyError:
+        # No 'Content-Range' header, i.e. no job offer found (HTTP 204)
+        return None
+
+
+def fetch_offers(
+    api_client,
+    params: dict = None,
+    max_offers: int = None,
+    max_workers: int = 4
+) -> dict:
+    """Fetch all the pages of a search.
+
+    The first page gives the total number of hits, then the other pages are
+    fetched concurrently.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        params (dict, optional): parameters of the search. Defaults to None.
+        max_offers (int, optional): maximum number of offers to fetch.
+            Defaults to None, i.e. as many as the API allows.
+        max_workers (int, optional): number of pages fetched concurrently.
+            Defaults to 4.
+
+    Returns:
+        dict: the `resultats` of all pages, the `filtresPossibles` and the
+            `Content-Range` of the first page
+    """
+    first_page = fetch_page(api_client, params, f"0-{PAGE_SIZE - 1}")
+    if first_page is None:
+        return {
+            "resultats": [],
+            "filtresPossibles": [],
+            "Content-Range": {
+                "first_index": "0", "last_index": "0", "max_results": "0"
+            },
+        }
+    max_results = int(first_page["Content-Range"]["max_results"])
+    if max_offers is not None:
+        max_results = min(max_results, max_offers)
+    page_ranges = get_page_ranges(max_results, first_index=PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = list(
+            executor.map(
+                lambda page_range: fetch_page(api_client, params, page_range),
+                page_ranges,
+            )
+        )
+    results = list(first_page["resultats"])
+    for page in pages:
+        if page is not None:
+            results.extend(page["resultats"])
+    return {
+        "resultats": results[:max_results],
+        "filtresPossibles": first_page["filtresPossibles"],
+        "Content-Range": first_page["Content-Range"],
+    }
+
+
+def normalize_offers(
+    results: list[dict],
+    keep_unknown: bool = False
+) -> pd.DataFrame:
+    """Convert the job offers into a dataframe.
+
+    The nested dictionaries (e.g. 'lieuTravail', 'entreprise', 'salaire',
+    'contact' and 'origineOffre') are flattened into dotted columns (e.g.
+    'lieuTravail.libelle') in a single pass, the lists are kept as they are
+    (see `flatten_list_categories()`). The columns and their dtypes are those
+    of the fixed schema of the offers, whatever the fields of the payloads
+    (see `schema.conform_offers()`).
+
+    Args:
+        results (list[dict]): the `resultats` of a search
+        keep_unknown (bool, optional): whether to keep the fields unknown
+            to the schema, after its fields. Defaults to False.
+
+    Returns:
+        pd.DataFrame: one row per job offer
+    """
+    return schema.conform_offers(results, keep_unknown=keep_unknown)
+
+
+def _is_list(value: object) -> bool:
+    """Check whether a cell holds a list (or an array once reloaded)."""
+    return isinstance(value, (list, tuple, np.ndarray))
+
+
+def flatten_category(
+    dataframe: pd.DataFrame,
+    category: str
+) -> pd.DataFrame:
+    """Expand a category of dictionaries or lists into one column per item.
+
+    Same output as `dataframe[category].apply(pd.Series)`, but built in one
+    go rather than one `pd.Series` per row.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        category (str): the category to expand
+
+    Returns:
+        pd.DataFrame: the expanded category, with the index of `dataframe`
+    """
+    values = dataframe[category].tolist()
+    if any(isinstance(value, dict) for value in values):
+        flattened = pd.DataFrame.from_records(
+            [value if isinstance(value, dict) else {} for value in values]
+        )
+    else:
+        flattened = pd.DataFrame(
+            [list(value) if _is_list(value) else [] for value in values]
+        )
+    flattened.index = dataframe.index
+    return flattened
+
+
+def flatten_list_category(
+    dataframe: pd.DataFrame,
+    category: str,
+    key: str = "libelle",
+    max_items: int = None,
+) -> pd.DataFrame:
+    """Expand a list category into one column per item, e.g. 'langues_0'.
+
+    Only the `key` of each item is kept (e.g. the 'libelle' of a
+    'competence'), so the columns hold plain strings.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        category (str): the list category, e.g. 'competences'
+        key (str, optional): key of the items to keep. Defaults to "libelle".
+        max_items (int, optional): maximum number of items to keep.
+            Defaults to None, i.e. all of them.
+
+    Returns:
+        pd.DataFrame: the expanded category, with the index of `dataframe`
+    """
+    values = [
+        [
+            item.get(key) if isinstance(item, dict) else item
+            for item in items[:max_items]
+        ]
+        if _is_list(items) else []
+        for items in dataframe[category].tolist()
+    ]
+    width = max(map(len, values), default=0)
+    return pd.DataFrame(
+        values,
+        index=dataframe.index,
+        columns=[f"{category}_{index}" for index in range(width)],
+    )
+
+
+def flatten_list_categories(
+    dataframe: pd.DataFrame,
+    categories: dict[str, str] = None,
+    max_items: dict[str, int] = None,
+) -> pd.DataFrame:
+    """Replace the list categories by their expanded columns.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        categories (dict[str, str], optional): the list categories and the
+            key of their items. Defaults to LIST_CATEGORIES.
+        max_items (dict[str, int], optional): maximum number of items kept
+            per category, e.g. `{"competences": 3}`. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the job offers, without any list category
+    """
+    categories = LIST_CATEGORIES if categories is None else categories
+    max_items = max_items or {}
+    present = [category for category in categories if category in dataframe]
+    flattened = [
+        flatten_list_category(
+            dataframe,
+            category,
+            key=categories[category],
+            max_items=max_items.get(category),
+        )
+        for category in present
+    ]
+    return pd.concat([dataframe.drop(columns=present), *flattened], axis=1)
+
+
+def split_location(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Split 'lieuTravail.libelle' into 'departement' and 'ville'.
+
+    The 'libelle' looks like '33 - BORDEAUX', but may hold the region only.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        pd.DataFrame: the job offers with the two new columns
+    """
+    if "lieuTravail.libelle" not in dataframe:
+        return dataframe
+    location = dataframe["lieuTravail.libelle"].str.split(
+        " - ", n=1, expand=True
+    ).reindex(columns=[0, 1])
+    dataframe = dataframe.drop(columns="lieuTravail.libelle")
+    dataframe["departement"] = location[0]
+    dataframe["ville"] = location[1]
+    return dataframe
+
+
+def clean_offers(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Clean the job offers.
+
+    Split the linked categories, convert the dates and parse the salaries.
+    The empty categories are kept, so that the columns do not depend on the
+    search (see `schema.py`).
+
+    Args:
+        dataframe (pd.DataFrame): the normalized job offers
+
+    Returns:
+        pd.DataFrame: the cleaned job offers
+    """
+    dataframe = split_location(dataframe)
+    for column in ("dateCreation", "dateActualisation"):
+        if column in dataframe:
+            dataframe[column] = pd.to_datetime(
+                dataframe[column], utc=True, errors="coerce"
+            )
+    return parse_salaries(dataframe)
+
+
+def parse_salaries(
+    dataframe: pd.DataFrame,
+    column: str = "salaire.libelle"
+) -> pd.DataFrame:
+    """Convert the salary libelles into numeric categories.
+
+    The following categories are added:
+    - 'periode', e.g. 'Mensuel', 'Annuel' or 'Horaire'
+    - 'salaire_min' and 'salaire_max', for that period ('salaire_max' being
+        'salaire_min' when no range is given)
+    - 'nb_mois', the number of paid months (12 if not given)
+    - 'salaire_annuel', the middle of the range over a year
+
+    Each distinct libelle is only parsed once. The libelles without any
+    amount (e.g. 'Autre') are left empty.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        column (str, optional): the salary libelles.
+            Defaults to "salaire.libelle".
+
+    Returns:
+        pd.DataFrame: the job offers with the salary categories
+    """
+    if column not in dataframe:
+        return dataframe
+    codes, libelles = pd.factorize(dataframe[column])
+    parsed = pd.Series(libelles, dtype=object).str.extract(SALARY_PATTERN)
+    parsed["periode"] = parsed["periode"].str.capitalize()
+    for amount in ("salaire_min", "salaire_max", "nb_mois"):
+        parsed[amount] = pd.to_numeric(
+            parsed[amount].str.replace(",", ".", regex=False)
+        )
+    parsed["salaire_max"] = parsed["salaire_max"].fillna(
+        parsed["salaire_min"]
+    )
+    parsed["nb_mois"] = parsed["nb_mois"].where(
+        parsed["salaire_min"].isna(),
+        parsed["nb_mois"].fillna(MONTHS_PER_YEAR),
+    )
+    middle = (parsed["salaire_min"] + parsed["salaire_max"]) / 2
+    parsed["salaire_annuel"] = middle.where(
+        parsed["periode"] == "Annuel",
+        middle * parsed["periode"].map(PERIODS_PER_MONTH)
+        * parsed["nb_mois"],
+    )
+    # Spread the parsed libelles back onto the offers (-1 for no libelle)
+    parsed = parsed.reindex(codes)
+    dataframe = dataframe.copy()
+    for category in parsed:
+        dataframe[category] = parsed[category].to_numpy()
+    return dataframe
+
+
+def normalize_chunk(results: list[dict]) -> pa.Table:
+    """Normalize and clean a chunk of job offers into an Arrow table.
+
+    Run in the worker processes of `normalize_pages()`: the table is sent
+    back as Arrow buffers rather than as pickled Python objects.
+
+    Args:
+        results (list[dict]): the `resultats` of some consecutive pages
+
+    Returns:
+        pa.Table: the cleaned job offers, without pandas metadata
+    """
+    dataframe = clean_offers(normalize_offers(results))
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    return table.replace_schema_metadata(None)
+
+
+def concat_tables(tables: list[pa.Table]) -> pa.Table:
+    """Concatenate tables of job offers, whose columns may differ.
+
+    The missing columns of a table (e.g. no 'salaire.libelle' at all) are
+    added as typed nulls, then the record batches of the tables are chained
+    without copying them. If a column has conflicting types across the
+    tables (e.g. integers and floats), they are concatenated by pandas
+    instead.
+
+    Args:
+        tables (list[pa.Table]): the tables, e.g. one per chunk of pages
+
+    Returns:
+        pa.Table: all the job offers
+    """
+    try:
+        unified = pa.unify_schemas([table.schema for table in tables])
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.Table.from_pandas(
+            pd.concat(
+                [table.to_pandas() for table in tables], ignore_index=True
+            ),
+            preserve_index=False,
+        )
+    aligned = []
+    for table in tables:
+        columns = [
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(table.num_rows, type=field.type)
+            for field in unified
+        ]
+        aligned.append(pa.table(columns, schema=unified))
+    return pa.concat_tables(aligned)
+
+
+def normalize_pages(
+    results: list[dict],
+    max_processes: int = None,
+    page_size: int = PAGE_SIZE,
+) -> pd.DataFrame:
+    """Normalize and clean the job offers, spreading the pages on processes.
+
+    Same output as `clean_offers(normalize_offers(results))`, but the
+    CPU-bound flattening, location split and salary parsing run on all the
+    cores: each process turns a chunk of consecutive pages (at least
+    `MIN_PAGES_PER_PROCESS`, as each chunk has a fixed cost) into an Arrow
+    table (see `normalize_chunk()`), and the tables are concatenated without
+    copying (see `concat_tables()`). The text columns stay in Arrow memory
+    (as 'string[pyarrow]', like the snapshots read by `read_arrow_offers()`).
+
+    Args:
+        results (list[dict]): the `resultats` of a search
+        max_processes (int, optional): number of worker processes, 1 to
+            normalize in the current process. Defaults to None, i.e. one per
+            CPU.
+        page_size (int, optional): number of offers per page.
+            Defaults to PAGE_SIZE.
+
+    Returns:
+        pd.DataFrame: the cleaned job offers
+    """
+    nb_pages = -(-len(results) // page_size)
+    max_processes = min(
+        max_processes or os.cpu_count() or 1,
+        max(nb_pages // MIN_PAGES_PER_PROCESS, 1),
+    )
+    if max_processes == 1:
+        return clean_offers(normalize_offers(results))
+    chunk_size = -(-nb_pages // max_processes) * page_size
+    chunks = [
+        results[start:start + chunk_size]
+        for start in range(0, len(results), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        tables = list(executor.map(normalize_chunk, chunks))
+    return concat_tables(tables).to_pandas(
+        split_blocks=True, types_mapper=_ARROW_STRING_TYPES.get
+    )
+
+
+def _to_profile(missing: pd.Series, total: int) -> pd.DataFrame:
+    """Lay out the numbers of missing values as a missing table."""
+    profile = pd.DataFrame(
+        {
+            "missing": missing,
+            "total": total,
+            "percent": missing / max(total, 1) * 100,
+        }
+    )
+    return profile.sort_values("percent", ascending=False)
+
+
+def profile_offers(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Count the missing values of each category.
+
+    Same layout as the `sidetable` missing table, i.e. the 'missing',
+    'total' and 'percent' columns, sorted by decreasing 'percent'.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        pd.DataFrame: one row per category
+    """
+    return _to_profile(dataframe.isna().sum(), len(dataframe))
+
+
+def _get_sizes(values: pd.Series) -> np.ndarray:
+    """Get the size of the lists and dicts of a column, -1 for the others."""
+    return np.fromiter(
+        (
+            len(value) if _is_list(value) or isinstance(value, dict) else -1
+            for value in values.tolist()
+        ),
+        dtype=np.int64,
+        count=len(values),
+    )
+
+
+def profile_fields(
+    dataframe: pd.DataFrame,
+    categories: dict[str, str] = None,
+    max_items: dict[str, int] = None,
+) -> pd.DataFrame:
+    """Count the missing values of each category, before any flattening.
+
+    Same table as `profile_offers()` on the output of
+    `flatten_list_categories()`, i.e. one row per item of the list
+    categories (e.g. 'langues_0', 'langues_1'), but computed in one pass
+    over the job offers: the typed categories are counted by `notna()`, the
+    list categories from the number of items of each offer (the offers with
+    at least `k + 1` items have an item 'langues_k'). An empty list or dict
+    counts as missing.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their list categories
+        categories (dict[str, str], optional): the list categories and the
+            key of their items. Defaults to LIST_CATEGORIES.
+        max_items (dict[str, int], optional): maximum number of items kept
+            per category, e.g. `{"competences": 3}`. Defaults to None.
+
+    Returns:
+        pd.DataFrame: one row per category, or item of a list category
+    """
+    categories = LIST_CATEGORIES if categories is None else categories
+    max_items = max_items or {}
+    present = dataframe.notna().sum()
+    item_counts = {}
+    for column in dataframe.columns[dataframe.dtypes == object]:
+        sizes = _get_sizes(dataframe[column])
+        if column in categories:
+            # Number of offers with at least 1, 2, ... items
+            at_least = np.bincount(np.maximum(sizes, 0))[::-1].cumsum()[::-1]
+            for position, count in enumerate(
+                at_least[1:][:max_items.get(column)]
+            ):
+                item_counts[f"{column}_{position}"] = count
+        else:
+            present[column] -= np.count_nonzero(sizes == 0)
+    present = pd.concat(
+        [
+            present.drop(
+                [column for column in categories if column in present]
+            ),
+            pd.Series(item_counts, index=list(item_counts), dtype=np.int64),
+        ]
+    )
+    return _to_profile(len(dataframe) - present, len(dataframe))
+
+
+def get_field_family(category: str) -> str:
+    """Get the family of a category, e.g. 'contact' for 'contact.nom'.
+
+    Args:
+        category (str): the category, or item of a list category (e.g.
+            'langues_1', of the 'langues' family)
+
+    Returns:
+        str: the family
+    """
+    return re.sub(r"_\d+$", "", category.split(".", 1)[0])
+
+
+def detect_sparse_categories(
+    profile: pd.DataFrame,
+    threshold: float = 50,
+    thresholds: dict[str, float] = None,
+) -> list[str]:
+    """List the categories with more than `threshold` % missing values.
+
+    Args:
+        profile (pd.DataFrame): output of `profile_offers()` or
+            `profile_fields()`
+        threshold (float, optional): maximum percentage of missing values.
+            Defaults to 50.
+        thresholds (dict[str, float], optional): the maximum percentage of
+            some families of categories (see `get_field_family()`), e.g.
+            `{"salaire": 80, "langues": 90}`. Defaults to None, i.e.
+            `threshold` for all.
+
+    Returns:
+        list[str]: the sparse categories
+    """
+    limits = threshold
+    if thresholds:
+        limits = np.array(
+            [
+                thresholds.get(get_field_family(category), threshold)
+                for category in profile.index
+            ]
+        )
+    return profile.index[profile["percent"].to_numpy() > limits].to_list()
+
+
+def prune_sparse_categories(
+    dataframe: pd.DataFrame,
+    threshold: float = 50
+) -> pd.DataFrame:
+    """Drop the categories with more than `threshold` % missing values.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        threshold (float, optional): maximum percentage of missing values.
+            Defaults to 50.
+
+    Returns:
+        pd.DataFrame: the job offers without the sparse categories
+    """
+    sparse_categories = detect_sparse_categories(
+        profile_offers(dataframe), threshold
+    )
+    return dataframe.drop(columns=sparse_categories)
+
+
+def prune_sparse_fields(
+    dataframe: pd.DataFrame,
+    threshold: float = 50,
+    thresholds: dict[str, float] = None,
+    max_items: dict[str, int] = None,
+    profile: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """Drop the sparse categories, then expand the list categories left.
+
+    Same output as `flatten_list_categories()` followed by
+    `prune_sparse_categories()`, but the sparse categories are dropped
+    before the flattening: the list categories are only expanded up to
+    their last item present often enough, and not at all if their first
+    item is sparse.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their list categories
+        threshold (float, optional): maximum percentage of missing values.
+            Defaults to 50.
+        thresholds (dict[str, float], optional): the maximum percentage of
+            some families of categories (see `detect_sparse_categories()`).
+            Defaults to None.
+        max_items (dict[str, int], optional): maximum number of items kept
+            per list category, e.g. `{"competences": 3}`. Defaults to None.
+        profile (pd.DataFrame, optional): output of `profile_fields()` with
+            the same `max_items`, if already computed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the job offers, without any sparse or list category
+    """
+    if profile is None:
+        profile = profile_fields(dataframe, max_items=max_items)
+    sparse_categories = set(
+        detect_sparse_categories(profile, threshold, thresholds)
+    )
+    # The items of a list are less and less frequent, hence the items kept
+    # are the first ones
+    widths = {
+        category: sum(
+            1 for item in profile.index
+            if get_field_family(item) == category
+            and item not in sparse_categories
+        )
+        for category in LIST_CATEGORIES
+        if category in dataframe
+    }
+    dataframe = dataframe.drop(
+        columns=[
+            category for category in dataframe
+            if category in sparse_categories or widths.get(category) == 0
+        ]
+    )
+    return flatten_list_categories(
+        dataframe,
+        {
+            category: key for category, key in LIST_CATEGORIES.items()
+            if widths.get(category)
+        },
+        max_items=widths,
+    )
+
+
+def filter_offers(
+    dataframe: pd.DataFrame,
+    conditions: dict[str, object]
+) -> pd.DataFrame:
+    """Select the offers matching all the conditions.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        conditions (dict[str, object]): the accepted value (or list of
+            values) of each category, e.g. `{"departement": "33",
+            "typeContrat": ["CDI", "CDD"]}`
+
+    Returns:
+        pd.DataFrame: the matching offers
+    """
+    mask = np.ones(len(dataframe), dtype=bool)
+    for category, values in conditions.items():
+        if not _is_list(values) and not isinstance(values, (set, frozenset)):
+            values = [values]
+        mask &= dataframe[category].isin(list(values)).to_numpy()
+    return dataframe[mask]
+
+
+def filters_to_frame(filters: list[dict]) -> pd.DataFrame:
+    """Convert the search filters (`filtresPossibles`) into a dataframe.
+
+    Args:
+        filters (list[dict]): the `filtresPossibles` of a search
+
+    Returns:
+        pd.DataFrame: the 'filtre', 'valeur_possible' and 'nb_resultats'
+    """
+    return pd.DataFrame(
+        [
+            {
+                "filtre": search_filter["filtre"],
+                "valeur_possible": aggregate["valeurPossible"],
+                "nb_resultats": aggregate["nbResultats"],
+            }
+            for search_filter in filters
+            for aggregate in search_filter["agregation"]
+        ],
+        columns=["filtre", "valeur_possible", "nb_resultats"],
+    )
+
+
+def count_filters(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Count the job offers for each value of the search filters.
+
+    Same layout as `filters_to_frame()`, but computed from the offers
+    themselves, e.g. once the duplicates are removed.
+    The 'natureContrat' values are the libelles of the offers, not the codes.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+
+    Returns:
+        pd.DataFrame: the 'filtre', 'valeur_possible' and 'nb_resultats'
+    """
+    counts = []
+    for filter_name, category in FILTER_CATEGORIES.items():
+        if category not in dataframe:
+            continue
+        value_counts = dataframe[category].value_counts().sort_index()
+        counts.append(
+            pd.DataFrame(
+                {
+                    "filtre": filter_name,
+                    "valeur_possible": value_counts.index.astype(str),
+                    "nb_resultats": value_counts.to_numpy(),
+                }
+            )
+        )
+    if not counts:
+        return filters_to_frame([])
+    return pd.concat(counts, ignore_index=True)
+
+
+def select_filter(filters_df: pd.DataFrame, filter_name: str) -> pd.DataFrame:
+    """Select the values of one search filter, e.g. 'typeContrat'.
+
+    Args:
+        filters_df (pd.DataFrame): output of `filters_to_frame()`
+        filter_name (str): name of the filter
+
+    Returns:
+        pd.DataFrame: the values of the filter
+    """
+    return filters_df[filters_df["filtre"] == filter_name]
+
+
+def extract_salary_by_enterprise(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Select the enterprise name and the salary of each offer.
+
+    Args:
+        dataframe (pd.DataFrame): the normalized job offers
+
+    Returns:
+        pd.DataFrame: the 'id', 'entreprise' and 'salaire' columns, and the
+            numeric salary categories (see `parse_salaries()`)
+    """
+    columns = {
+        "id": "id",
+        "entreprise.nom": "entreprise",
+        "salaire.libelle": "salaire",
+    }
+    salary_categories = [
+        "periode", "salaire_min", "salaire_max", "nb_mois", "salaire_annuel"
+    ]
+    if "salaire.libelle" in dataframe and "periode" not in dataframe:
+        dataframe = parse_salaries(dataframe)
+    return (
+        dataframe.reindex(
+            columns=list(columns) + [
+                category for category in salary_categories
+                if category in dataframe
+            ]
+        )
+        .rename(columns=columns)
+    )
+
+
+def _write_offers(
+    dataframe: pd.DataFrame,
+    target: object,
+    file_format: str,
+    index: bool = False,
+) -> None:
+    """Write the job offers to a file name or a binary buffer."""
+    if file_format not in SNAPSHOT_FORMATS:
+        raise ValueError(
+            f"Unknown format '{file_format}', expected one of "
+            f"{SNAPSHOT_FORMATS}"
+        )
+    if index and file_format != "csv":
+        dataframe = dataframe.reset_index()
+    if file_format == "parquet":
+        dataframe.to_parquet(target, index=False)
+    elif file_format == "feather":
+        dataframe.reset_index(drop=True).to_feather(target)
+    elif file_format == "arrow":
+        # Uncompressed, so that the buffers can be memory-mapped
+        dataframe.reset_index(drop=True).to_feather(
+            target, compression="uncompressed"
+        )
+    else:
+        if file_format == "csv":
+            text = dataframe.to_csv(index=index)
+        else:
+            text = dataframe.to_json(
+                orient="records", lines=True, date_format="iso"
+            )
+        if isinstance(target, (str, Path)):
+            Path(target).write_text(text, encoding="utf-8")
+        else:
+            target.write(text.encode("utf-8"))
+
+
+def export_offers(
+    dataframe: pd.DataFrame,
+    file_format: str = "csv",
+    index: bool = False,
+) -> bytes:
+    """Serialize the job offers, e.g. for a download.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers
+        file_format (str, optional): one of SNAPSHOT_FORMATS.
+            Defaults to "csv".
+        index (bool, optional): whether to write the index of the
+            dataframe (as a first column). Defaults to False.
+
+    Raises:
+        ValueError: the file format is unknown
+
+    Returns:
+        bytes: the content of the file
+    """
+    buffer = io.BytesIO()
+    _write_offers(dataframe, buffer, file_format, index=index)
+    return buffer.getvalue()
+
+
+def save_snapshot(
+    dataframe: pd.DataFrame,
+    metadata: dict,
+    name: str = "default",
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    file_format: str = "parquet",
+) -> Path:
+    """Save the job offers of a search as a new snapshot.
+
+    Each snapshot is saved into its own time-stamped directory, with a
+    'metadata.json' file (search parameters, filters, content range) and the
+    long texts stored apart (see `text_store.py`), then the `LATEST` file is
+    updated to point to it, so readers never see a snapshot being written.
+
+    Args:
+        dataframe (pd.DataFrame): the cleaned job offers
+        metadata (dict): the search parameters, filters and content range
+        name (str, optional): name of the search. Defaults to "default".
+        snapshot_dir (str, optional): root directory of the snapshots.
+            Defaults to DEFAULT_SNAPSHOT_DIR.
+        file_format (str, optional): one of SNAPSHOT_FORMATS.
+            Defaults to "parquet".
+
+    Raises:
+        ValueError: the file format is unknown
+
+    Returns:
+        Path: directory of the snapshot
+    """
+    harvested_at = datetime.datetime.now(datetime.timezone.utc)
+    search_dir = Path(snapshot_dir, name)
+    output_dir = search_dir / harvested_at.strftime("%Y%m%dT%H%M%S%fZ")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # The long texts are stored apart, to be read lazily
+    text_columns = text_store.save_texts(
+        dataframe, output_dir / text_store.TEXT_DIR_NAME
+    )
+    _write_offers(
+        dataframe.drop(columns=text_columns),
+        output_dir / f"offers.{file_format}",
+        file_format,
+    )
+
+    metadata = {
+        **metadata,
+        "name": name,
+        "format": file_format,
+        "nb_offers": len(dataframe),
+        "text_columns": text_columns,
+        "harvested_at": harvested_at.isoformat(),
+    }
+    with open(output_dir / "metadata.json", "w", encoding="utf-8") as output:
+        json.dump(metadata, output, ensure_ascii=False, indent=2)
+
+    temporary_file = search_dir / f"{LATEST_FILE}.tmp"
+    temporary_file.write_text(output_dir.name, encoding="utf-8")
+    os.replace(temporary_file, search_dir / LATEST_FILE)
+    return output_dir
+
+
+def read_arrow_offers(file_name: str) -> pd.DataFrame:
+    """Memory-map the job offers saved as an uncompressed Arrow IPC file.
+
+    The file is mapped read-only, hence its pages are read on demand and
+    shared by the processes reading the same snapshot (OS page cache). The
+    numeric columns without missing values and the text columns (backed by
+    Arrow, as 'string[pyarrow]') point into the mapping instead of being
+    copied; the nested columns (lists of dicts) are converted to Python
+    objects.
+
+    Args:
+        file_name (str): the Arrow file
+
+    Returns:
+        pd.DataFrame: the job offers
+    """
+    source = pa.memory_map(str(file_name), "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(
+        split_blocks=True, types_mapper=_ARROW_STRING_TYPES.get
+    )
+
+
+def get_latest_snapshot_dir(
+    name: str = "default",
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR
+) -> Path:
+    """Get the directory of the latest snapshot of a search.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+        snapshot_dir (str, optional): root directory of the snapshots.
+            Defaults to DEFAULT_SNAPSHOT_DIR.
+
+    Returns:
+        Path: the directory, or `None` if no snapshot was harvested yet
+    """
+    search_dir = Path(snapshot_dir, name)
+    latest_file = search_dir / LATEST_FILE
+    if not latest_file.exists():
+        return None
+    return search_dir / latest_file.read_text(encoding="utf-8").strip()
+
+
+def load_snapshot(
+    name: str = "default",
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    lazy_texts: bool = False,
+) -> tuple[pd.DataFrame, dict]:
+    """Load the latest snapshot of a search.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+        snapshot_dir (str, optional): root directory of the snapshots.
+            Defaults to DEFAULT_SNAPSHOT_DIR.
+        lazy_texts (bool, optional): whether to leave out the long texts
+            (e.g. 'description'), to be read on demand with
+            `load_snapshot_texts()`. Defaults to False.
+
+    Returns:
+        tuple[pd.DataFrame, dict]: the job offers and the metadata, or
+            `(None, None)` if no snapshot was harvested yet
+    """
+    input_dir = get_latest_snapshot_dir(name, snapshot_dir)
+    if input_dir is None:
+        return None, None
+    with open(input_dir / "metadata.json", encoding="utf-8") as input_file:
+        metadata = json.load(input_file)
+
+    file_format = metadata["format"]
+    file_name = input_dir / f"offers.{file_format}"
+    if file_format == "parquet":
+        dataframe = pd.read_parquet(file_name)
+    elif file_format == "arrow":
+        dataframe = read_arrow_offers(file_name)
+    elif file_format == "feather":
+        dataframe = pd.read_feather(file_name)
+    elif file_format == "csv":
+        dataframe = pd.read_csv(file_name)
+    else:
+        dataframe = pd.read_json(file_name, orient="records", lines=True)
+    if metadata.get("text_columns") and not lazy_texts:
+        dataframe = text_store.TextStore(
+            input_dir / text_store.TEXT_DIR_NAME
+        ).attach(dataframe)
+    return dataframe, metadata
+
+
+def load_snapshot_texts(
+    name: str = "default",
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR
+) -> text_store.TextStore:
+    """Load the long texts of the latest snapshot of a search.
+
+    Args:
+        name (str, optional): name of the search. Defaults to "default".
+        snapshot_dir (str, optional): root directory of the snapshots.
+            Defaults to DEFAULT_SNAPSHOT_DIR.
+
+    Returns:
+        text_store.TextStore: the texts, or `None` if there are none
+    """
+    input_dir = get_latest_snapshot_dir(name, snapshot_dir)
+    if input_dir is None:
+        return None
+    return text_store.load_texts(input_dir / text_store.TEXT_DIR_NAME)
+
+
+def run_harvest(
+    api_client,
+    params: dict = None,
+    name: str = "default",
+    max_offers: int = None,
+    max_workers: int = 4,
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    file_format: str = "arrow",
+    max_processes: int = None,
+) -> Path:
+    """Run the full pipeline for one search: search, normalize, clean, store.
+
+    The fields of the offers are recorded, and their changes since the
+    previous harvest reported in the metadata of the snapshot (see
+    `schema.py`). The near-duplicate offers are flagged (see `dedup.py`),
+    the new offers are added to the full-text index (see `text_index.py`),
+    to the aggregation cube (see `cube.py`) and to the sketches (see
+    `sketches.py`) of the search, and the numbers of offers are recorded in
+    the history (see `history.py`), next to the snapshots.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        params (dict, optional): parameters of the search. Defaults to None.
+        name (str, optional): name of the search. Defaults to "default".
+        max_offers (int, optional): maximum number of offers to fetch.
+            Defaults to None.
+        max_workers (int, optional): number of pages fetched concurrently.
+            Defaults to 4.
+        snapshot_dir (str, optional): root directory of the snapshots.
+            Defaults to DEFAULT_SNAPSHOT_DIR.
+        file_format (str, optional): one of SNAPSHOT_FORMATS.
+            Defaults to "arrow".
+        max_processes (int, optional): number of processes normalizing the
+            pages (see `normalize_pages()`). Defaults to None, i.e. one per
+            CPU.
+
+    Returns:
+        Path: directory of the snapshot
+    """
+    search_output = fetch_offers(
+        api_client, params, max_offers=max_offers, max_workers=max_workers
+    )
+    results_df = normalize_pages(
+        search_output["resultats"], max_processes=max_processes
+    )
+    results_df = dedup.flag_duplicates(results_df)
+    schema_drift = schema.record_schema(
+        schema.get_schema_file(snapshot_dir, name),
+        search_output["resultats"],
+    )
+    metadata = {
+        "params": params or {},
+        "filtresPossibles": search_output["filtresPossibles"],
+        "Content-Range": search_output["Content-Range"],
+        "schema_drift": schema_drift,
+    }
+    output_dir = save_snapshot(
+        results_df,
+        metadata,
+        name=name,
+        snapshot_dir=snapshot_dir,
+        file_format=file_format,
+    )
+    text_index.update_index(
+        results_df, text_index.get_index_dir(snapshot_dir, name)
+    )
+    cube.update_cube(
+        results_df[~results_df["is_duplicate"]],
+        cube.get_cube_dir(snapshot_dir, name),
+    )
+    sketches.update_sketches(
+        results_df[~results_df["is_duplicate"]],
+        sketches.get_sketches_file(snapshot_dir, name),
+    )
+    history.record_harvest(
+        history.get_history_file(snapshot_dir),
+        query=name,
+        content_range=search_output["Content-Range"],
+        filters=search_output["filtresPossibles"],
+        offer_counts=count_filters(results_df[~results_df["is_duplicate"]]),
+    )
+    return output_dir
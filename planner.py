@@ -0,0 +1,273 @@
+"""Decide whether a search is served from the harvested offers or the API.
+
+The latest snapshot of the batch harvest (see `pipeline.run_harvest()`)
+holds every offer of its search active at the time of the harvest, as long
+as the harvest was complete (all the hits of the search fetched). A search
+can then be served:
+- locally, when it only filters on fields harvested (see `LOCAL_FIELDS`),
+    is at least as narrow as the harvested search, and ends before the day
+    of the harvest
+- remotely (API), when the snapshot cannot answer it, e.g. it filters on a
+    field not harvested, the harvest was truncated, or it starts after the
+    harvest
+- in hybrid mode otherwise: the days before the harvest are served locally,
+    and only the days since the day of the harvest are searched in the API;
+    both parts are merged on the offer ids (the API results win)
+
+The dates are whole days (see `query.SearchQuery`). As in the API, the
+offers served locally hold all the keywords (see `text_index.py`).
+"""
+
+import pandas as pd
+
+import dedup
+import pipeline
+import text_index
+from query import DATE_FORMAT, SearchQuery, normalize_date
+
+# Search parameters evaluated on the harvested offers, and their category
+# ('qualification', 'experience' and 'natureContrat' are not coded as in the
+# offers, hence they are searched in the API)
+LOCAL_FIELDS = {
+    "departement": "departement",
+    "commune": "lieuTravail.commune",
+    "codeROME": "romeCode",
+    "typeContrat": "typeContrat",
+}
+# Parameters handled apart: keywords (full-text index), dates and pages
+SPECIAL_PARAMS = ("motsCles", "minCreationDate", "maxCreationDate", "range")
+PLAN_MODES = ("local", "remote", "hybrid")
+
+
+class QueryPlan:
+    """How a search is executed.
+
+    Args:
+        mode (str): one of PLAN_MODES
+        search_query (SearchQuery): the search
+        reason (str): why this mode was chosen
+        local_query (SearchQuery, optional): the part of the search served
+            by the snapshot. Defaults to None.
+        remote_query (SearchQuery, optional): the part of the search sent
+            to the API. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        search_query: SearchQuery,
+        reason: str,
+        local_query: SearchQuery = None,
+        remote_query: SearchQuery = None,
+    ):
+        if mode not in PLAN_MODES:
+            raise ValueError(
+                f"Unknown mode '{mode}', expected one of {PLAN_MODES}"
+            )
+        self.mode = mode
+        self.search_query = search_query
+        self.reason = reason
+        self.local_query = local_query
+        self.remote_query = remote_query
+
+    def __repr__(self) -> str:
+        return f"QueryPlan({self.mode}: {self.reason})"
+
+
+def get_harvest_day(metadata: dict) -> pd.Timestamp:
+    """Get the day (UTC midnight) of the harvest of a snapshot.
+
+    Args:
+        metadata (dict): the metadata of the snapshot
+
+    Returns:
+        pd.Timestamp: the day of the harvest
+    """
+    return pd.Timestamp(metadata["harvested_at"]).tz_convert("UTC").floor("D")
+
+
+def is_complete(metadata: dict) -> bool:
+    """Whether a harvest fetched all the hits of its search.
+
+    Args:
+        metadata (dict): the metadata of the snapshot
+
+    Returns:
+        bool: `True` if the snapshot holds all the offers of the search
+    """
+    max_results = int(metadata["Content-Range"]["max_results"])
+    return int(metadata.get("nb_offers", 0)) >= max_results
+
+
+def plan_query(
+    params: object,
+    metadata: dict = None,
+    has_index: bool = False
+) -> QueryPlan:
+    """Pick local, remote or hybrid execution for a search.
+
+    Args:
+        params (dict | SearchQuery): parameters of the search
+        metadata (dict, optional): the metadata of the latest snapshot.
+            Defaults to None, i.e. no snapshot.
+        has_index (bool, optional): whether the full-text index of the
+            snapshot is available, to search the keywords.
+            Defaults to False.
+
+    Returns:
+        QueryPlan: the plan
+    """
+    search_query = SearchQuery(params)
+    query_params = search_query.to_params()
+
+    def remote(reason: str) -> QueryPlan:
+        return QueryPlan(
+            "remote", search_query, reason, remote_query=search_query
+        )
+
+    if metadata is None:
+        return remote("no harvested offers")
+    if not is_complete(metadata):
+        return remote(
+            f"the harvest holds {metadata.get('nb_offers', 0)} of the "
+            f"{metadata['Content-Range']['max_results']} offers"
+        )
+    unknown = sorted(
+        set(query_params) - set(LOCAL_FIELDS) - set(SPECIAL_PARAMS)
+    )
+    if unknown:
+        return remote(f"{', '.join(unknown)} not harvested")
+    if "motsCles" in query_params and not has_index:
+        return remote("no full-text index of the harvested offers")
+    harvest_params = SearchQuery(metadata.get("params")).to_params()
+    harvest_params.pop("range", None)
+    narrower = all(
+        query_params.get(name) == value
+        for name, value in harvest_params.items()
+    )
+    if not narrower:
+        return remote("the harvested search is narrower than this one")
+
+    harvest_day = get_harvest_day(metadata)
+    start = query_params.get("minCreationDate")
+    end = query_params.get("maxCreationDate")
+    if start is not None and pd.Timestamp(start) >= harvest_day:
+        return remote("created after the harvest")
+    if end is not None and pd.Timestamp(end) <= harvest_day:
+        return QueryPlan(
+            "local", search_query, "harvested", local_query=search_query
+        )
+    split_date = harvest_day.strftime(DATE_FORMAT)
+    return QueryPlan(
+        "hybrid",
+        search_query,
+        f"created since {harvest_day:%Y-%m-%d} not harvested",
+        local_query=search_query.replace(maxCreationDate=split_date),
+        # The API expects both dates of the period
+        remote_query=search_query.replace(
+            minCreationDate=split_date,
+            maxCreationDate=end or normalize_date(
+                pd.Timestamp.now(tz="UTC"), upper=True
+            ),
+        ),
+    )
+
+
+def select_offers(
+    dataframe: pd.DataFrame,
+    search_query: SearchQuery,
+    index: text_index.InvertedIndex = None,
+) -> pd.DataFrame:
+    """Select the harvested offers matching a search.
+
+    Args:
+        dataframe (pd.DataFrame): the harvested (cleaned) job offers
+        search_query (SearchQuery): the search
+        index (text_index.InvertedIndex, optional): the full-text index of
+            the offers, needed to search keywords. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the matching offers
+    """
+    params = search_query.to_params()
+    conditions = {
+        LOCAL_FIELDS[name]: value.split(",")
+        for name, value in params.items()
+        if name in LOCAL_FIELDS
+    }
+    missing = [
+        category for category in conditions if category not in dataframe
+    ]
+    if missing:
+        return dataframe.iloc[:0]
+    offers = pipeline.filter_offers(dataframe, conditions)
+    if "minCreationDate" in params or "maxCreationDate" in params:
+        created = offers["dateCreation"]
+        in_period = created.notna()
+        if "minCreationDate" in params:
+            in_period &= created >= pd.Timestamp(params["minCreationDate"])
+        if "maxCreationDate" in params:
+            in_period &= created < pd.Timestamp(params["maxCreationDate"])
+        offers = offers[in_period]
+    if "motsCles" in params:
+        offers = text_index.search_offers(
+            dataframe=offers,
+            index=index,
+            query=params["motsCles"].replace(",", " "),
+            top_k=len(offers),
+            # All the keywords are required, as in the API
+            match_all=True,
+        )
+    return offers
+
+
+def execute_plan(
+    plan: QueryPlan,
+    dataframe: pd.DataFrame = None,
+    index: text_index.InvertedIndex = None,
+    search=None,
+) -> pd.DataFrame:
+    """Get the offers of a search according to its plan.
+
+    Args:
+        plan (QueryPlan): the plan
+        dataframe (pd.DataFrame, optional): the harvested (cleaned) job
+            offers, for the local and hybrid plans. Defaults to None.
+        index (text_index.InvertedIndex, optional): their full-text index.
+            Defaults to None.
+        search (callable, optional): the function searching the API, called
+            with the parameters of a search, for the remote and hybrid
+            plans; it must return all the hits, not only the first page
+            (see `pipeline.fetch_offers()`). Defaults to None.
+
+    Returns:
+        pd.DataFrame: the cleaned job offers, without duplicated ids, and
+            their duplicates flagged (see `dedup.flag_duplicates()`)
+    """
+    parts = []
+    if plan.remote_query is not None:
+        try:
+            output = search(plan.remote_query.to_params())
+        except KeyError:
+            # No 'Content-Range' header, i.e. no job offer found (HTTP 204)
+            output = None
+        if output and output["resultats"]:
+            parts.append(
+                pipeline.clean_offers(
+                    pipeline.normalize_offers(output["resultats"])
+                )
+            )
+    if plan.local_query is not None:
+        parts.append(select_offers(dataframe, plan.local_query, index))
+    if not parts:
+        return pd.DataFrame(columns=["id"])
+    offers = pd.concat(parts, ignore_index=True)
+    offers = offers.drop_duplicates(subset="id", ignore_index=True)
+    if plan.remote_query is not None:
+        # The offers of the API are not flagged yet, and may duplicate the
+        # harvested ones: the duplicates are flagged again on all the offers
+        offers = dedup.flag_duplicates(
+            offers.drop(columns=["cluster_id", "is_duplicate"],
+                        errors="ignore")
+        )
+    return offers
@@ -0,0 +1,142 @@
+"""Canonical form of the search parameters, used as the key of the caches.
+
+The same search can be written in many ways: `{"motsCles": {"BI", "Bac+5"}}`
+(a set, whose order changes between processes), `{"motsCles": "Bac+5, BI"}`,
+with an empty `"departement": ""`, or with dates at any time of the day. A
+`SearchQuery` turns them into a single canonical form:
+- the empty parameters are dropped
+- the list parameters (e.g. the keywords or the departements) are split on
+    commas, stripped, deduplicated, sorted and joined by commas, as expected
+    by the API
+- the creation dates are rounded to whole days (UTC), outwards, so that the
+    searched period is never shortened: 'minCreationDate' to the start of
+    its day and 'maxCreationDate' to the start of the next day (unless it is
+    already midnight)
+- the parameters are sorted by name
+
+Its `key` (SHA-1 of the canonical parameters) is stable across processes,
+hence it names the searches recorded in the cassettes (see `cassette.py`),
+and it keys the in-memory caches of the app, without hashing the API client
+nor the original parameters.
+"""
+
+import hashlib
+import json
+
+import pandas as pd
+
+# Parameters holding a comma-separated list of values
+LIST_PARAMS = (
+    "motsCles",
+    "departement",
+    "commune",
+    "region",
+    "codeROME",
+    "appellation",
+    "typeContrat",
+    "natureContrat",
+)
+DATE_PARAMS = ("minCreationDate", "maxCreationDate")
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def normalize_date(value: object, upper: bool = False) -> str:
+    """Round a date to a whole day (UTC) and format it for the API.
+
+    Args:
+        value (object): a date, a datetime (naive ones are taken as UTC) or
+            an ISO 8601 string
+        upper (bool, optional): whether the date ends the period, i.e. is
+            rounded up to the next midnight. Defaults to False.
+
+    Returns:
+        str: the date, e.g. '2022-07-01T00:00:00Z'
+    """
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    timestamp = timestamp.tz_convert("UTC")
+    day = timestamp.floor("D")
+    if upper and day != timestamp:
+        day += pd.Timedelta(days=1)
+    return day.strftime(DATE_FORMAT)
+
+
+def normalize_value(name: str, value: object) -> str:
+    """Normalize the value of a search parameter.
+
+    Args:
+        name (str): name of the parameter
+        value (object): the value, possibly a collection of values
+
+    Returns:
+        str: the value, empty if the parameter is not set
+    """
+    if value is None:
+        return ""
+    if name in DATE_PARAMS:
+        if isinstance(value, str) and not value.strip():
+            return ""
+        return normalize_date(value, upper=name == "maxCreationDate")
+    if isinstance(value, (set, frozenset, list, tuple)):
+        items = [str(item) for item in value]
+    elif name in LIST_PARAMS:
+        items = str(value).split(",")
+    else:
+        return str(value).strip()
+    return ",".join(sorted({item.strip() for item in items} - {""}))
+
+
+class SearchQuery:
+    """Canonical, hashable form of the parameters of a search.
+
+    Args:
+        params (dict | SearchQuery, optional): parameters of the search.
+            Defaults to None, i.e. all the offers.
+    """
+
+    def __init__(self, params: object = None):
+        if isinstance(params, SearchQuery):
+            self.params = params.params
+            self.key = params.key
+            return
+        normalized = (
+            (name, normalize_value(name, value))
+            for name, value in (params or {}).items()
+        )
+        # Sorted pairs of (name, value), without the empty parameters
+        self.params = tuple(
+            sorted((name, value) for name, value in normalized if value)
+        )
+        serialized = json.dumps(dict(self.params), ensure_ascii=False)
+        self.key = hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SearchQuery):
+            return NotImplemented
+        return self.params == other.params
+
+    def __hash__(self) -> int:
+        return hash(self.params)
+
+    def __repr__(self) -> str:
+        return f"SearchQuery({self.to_params()})"
+
+    def to_params(self) -> dict[str, str]:
+        """Get the parameters, as sent to the API.
+
+        Returns:
+            dict[str, str]: the canonical parameters
+        """
+        return dict(self.params)
+
+    def replace(self, **params) -> "SearchQuery":
+        """Get a copy of the query with some parameters changed.
+
+        Args:
+            **params: the parameters changed, `None` to remove one
+
+        Returns:
+            SearchQuery: the new query
+        """
+        return SearchQuery({**self.to_params(), **params})
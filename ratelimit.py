@@ -0,0 +1,84 @@
+"""Client-side rate limiting of the requests to the Pole Emploi API.
+
+The API answers 429 ('Too Many Requests') beyond a number of requests per
+second. The `RateLimiter` below is a token bucket shared by the threads of
+the process: each request takes a token, and waits for one when the bucket
+is empty, so that concurrent searches are spread out instead of rejected.
+"""
+
+import threading
+import time
+
+# Maximum number of requests per second to the API
+DEFAULT_RATE = 10.0
+
+
+class RateLimiter:
+    """Token bucket, blocking until a token is available.
+
+    Args:
+        rate (float, optional): number of requests per second.
+            Defaults to DEFAULT_RATE.
+        burst (int, optional): number of requests allowed at once.
+            Defaults to None, i.e. one second of requests.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = None):
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+
+    def acquire(self) -> float:
+        """Take a token, waiting for it if needed.
+
+        Returns:
+            float: the time waited, in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._last_refill) * self.rate,
+            )
+            self._last_refill = now
+            # The token is reserved now, the wait happens outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+# Shared by all the sessions (threads) of the app
+_LIMITER = RateLimiter()
+
+
+class RateLimitedClient:
+    """Wait for the rate limiter before each request to an API client.
+
+    Args:
+        api_client (offres_emploi.Api): the client of the API
+        limiter (RateLimiter, optional): the rate limiter.
+            Defaults to the limiter shared by the whole process.
+    """
+
+    def __init__(self, api_client, limiter: RateLimiter = None):
+        self.api_client = api_client
+        self.limiter = _LIMITER if limiter is None else limiter
+
+    def search(self, params: dict = None,
+               silent_http_errors: bool = False) -> dict:
+        """Search the API once a token is available."""
+        self.limiter.acquire()
+        return self.api_client.search(
+            params=params, silent_http_errors=silent_http_errors
+        )
+
+    def referentiel(self, referentiel: str) -> list[dict]:
+        """Get a referentiel once a token is available."""
+        self.limiter.acquire()
+        return self.api_client.referentiel(referentiel)
@@ -0,0 +1,137 @@
+"""Stale-while-revalidate cache of the responses of the Pole Emploi API.
+
+With a plain TTL cache, the first request after the expiry of an entry waits
+for the whole API call. Here, an entry has 3 ages:
+- fresh (younger than `ttl`): served from the cache
+- stale (younger than `max_staleness`): served from the cache at once, while
+    a background thread refreshes it for the next requests
+- too old: the API is called and the caller waits, as for a missing entry
+
+A single refresh of an entry runs at a time, and the identical calls of the
+API sent while an entry is missing are coalesced (see `coalesce.py`). If a
+background refresh fails, the stale entry is kept until `max_staleness`.
+
+The time of the API call of each entry is kept, to show the date of the data
+served.
+"""
+
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from coalesce import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Number of threads refreshing the stale entries
+MAX_REFRESH_WORKERS = 2
+
+
+class RevalidatingCache:
+    """Serve stale entries while they are refreshed in the background.
+
+    Args:
+        ttl (float): age in seconds after which an entry is refreshed
+        max_staleness (float): age in seconds after which an entry is not
+            served any more
+        max_entries (int, optional): number of entries kept, the least
+            recently used ones being dropped first. Defaults to 256.
+    """
+
+    def __init__(self, ttl: float, max_staleness: float,
+                 max_entries: int = 256):
+        if max_staleness < ttl:
+            raise ValueError("max_staleness must not be shorter than ttl")
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (value, time of the call); in least recently used order
+        self._entries = {}
+        self._refreshing = set()
+        self._calls = SingleFlight()
+        self._executor = ThreadPoolExecutor(
+            max_workers=MAX_REFRESH_WORKERS,
+            thread_name_prefix="revalidate",
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _now(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def _store(self, key: str, value: object) -> None:
+        """Save an entry, dropping the least recently used ones."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self._now())
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def _call(self, key: str, function, args: tuple, kwargs: dict) -> object:
+        """Call the function (once for concurrent callers) and save."""
+        def call_and_store():
+            value = function(*args, **kwargs)
+            self._store(key, value)
+            return value
+        return self._calls.do(key, call_and_store)
+
+    def _refresh(self, key: str, function, args: tuple, kwargs: dict) -> None:
+        """Refresh an entry in the background."""
+        try:
+            self._call(key, function, args, kwargs)
+        except Exception:
+            logger.exception("The refresh of '%s' failed", key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key: str, function, *args, **kwargs) -> object:
+        """Get an entry, calling the function if it is missing or too old.
+
+        Args:
+            key (str): the key of the entry, e.g. the normalized parameters
+                of a search
+            function (callable): the function computing the entry, called
+                with `args` and `kwargs`
+
+        Returns:
+            object: the entry (it must not be modified)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, called_at = entry
+                age = (self._now() - called_at).total_seconds()
+                if age < self.max_staleness:
+                    # Mark the entry as recently used
+                    self._entries[key] = self._entries.pop(key)
+                    if age >= self.ttl and key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(
+                            self._refresh, key, function, args, kwargs
+                        )
+                    return value
+        return self._call(key, function, args, kwargs)
+
+    def get_time(self, key: str) -> datetime.datetime:
+        """Get the time of the API call of an entry.
+
+        Args:
+            key (str): the key of the entry
+
+        Returns:
+            datetime.datetime: the time (UTC), or `None` if the entry is
+                missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def clear(self) -> None:
+        """Drop all the entries."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,367 @@
+"""Fixed schema of the job offers, and registry of the fields of each harvest.
+
+The fields of the API payloads come and go: 'salaire', 'agence' or 'langues'
+are not always present, hence the columns of `pd.json_normalize()` change
+from one search to the next, and their dtypes are re-inferred each time
+(e.g. 'nombrePostes' is a float when one offer lacks it, a column of missing
+values is an object column).
+
+`OFFER_FIELDS` is the superset of the (flattened) fields of the offers and
+of their kind. `conform_offers()` maps every payload onto it: all the
+fields are present, in the same order, with the same dtype, the missing
+values being typed nulls (`pd.NA` for the strings, integers and booleans,
+`NaN` for the numbers, `None` for the lists).
+
+The fields actually observed (and their kinds) at the latest harvest are
+kept in a registry, next to the snapshots of the query ('schema.json'),
+with the drift of the last `MAX_HARVESTS` harvests. The fields appearing or
+disappearing since the previous harvest, the fields unknown to
+`OFFER_FIELDS` (dropped by `conform_offers()`, unless kept for display) and
+the fields of another kind are reported as the drift of the harvest.
+"""
+
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+SCHEMA_FILE_NAME = "schema.json"
+# Number of harvests whose drift is kept in the registry
+MAX_HARVESTS = 500
+
+# Flattened fields of the job offers and their kind (the lists are kept
+# whole, see `pipeline.flatten_list_categories()`)
+OFFER_FIELDS = {
+    "id": "string",
+    "intitule": "string",
+    "description": "string",
+    "dateCreation": "string",
+    "dateActualisation": "string",
+    "lieuTravail.libelle": "string",
+    "lieuTravail.latitude": "number",
+    "lieuTravail.longitude": "number",
+    "lieuTravail.codePostal": "string",
+    "lieuTravail.commune": "string",
+    "romeCode": "string",
+    "romeLibelle": "string",
+    "appellationlibelle": "string",
+    "entreprise.nom": "string",
+    "entreprise.description": "string",
+    "entreprise.logo": "string",
+    "entreprise.url": "string",
+    "entreprise.entrepriseAdaptee": "boolean",
+    "typeContrat": "string",
+    "typeContratLibelle": "string",
+    "natureContrat": "string",
+    "experienceExige": "string",
+    "experienceLibelle": "string",
+    "experienceCommentaire": "string",
+    "formations": "list",
+    "langues": "list",
+    "permis": "list",
+    "competences": "list",
+    "salaire.libelle": "string",
+    "salaire.commentaire": "string",
+    "salaire.complement1": "string",
+    "salaire.complement2": "string",
+    "dureeTravailLibelle": "string",
+    "dureeTravailLibelleConverti": "string",
+    "complementExercice": "string",
+    "conditionExercice": "string",
+    "alternance": "boolean",
+    "contact.nom": "string",
+    "contact.coordonnees1": "string",
+    "contact.coordonnees2": "string",
+    "contact.coordonnees3": "string",
+    "contact.telephone": "string",
+    "contact.courriel": "string",
+    "contact.commentaire": "string",
+    "contact.urlRecruteur": "string",
+    "contact.urlPostulation": "string",
+    "agence.telephone": "string",
+    "agence.courriel": "string",
+    "nombrePostes": "integer",
+    "accessibleTH": "boolean",
+    "deplacementCode": "string",
+    "deplacementLibelle": "string",
+    "qualificationCode": "string",
+    "qualificationLibelle": "string",
+    "codeNAF": "string",
+    "secteurActivite": "string",
+    "secteurActiviteLibelle": "string",
+    "qualitesProfessionnelles": "list",
+    "trancheEffectifEtab": "string",
+    "origineOffre.origine": "string",
+    "origineOffre.urlOrigine": "string",
+    "origineOffre.partenaires": "list",
+    "offresManqueCandidats": "boolean",
+    "contexteTravail.horaires": "list",
+    "contexteTravail.conditionsExercice": "list",
+}
+# dtype of each kind of field (the strings are backed by Arrow, as in the
+# Arrow snapshots)
+KIND_DTYPES = {
+    "string": pd.StringDtype("pyarrow"),
+    "integer": pd.Int64Dtype(),
+    "number": "float64",
+    "boolean": pd.BooleanDtype(),
+    "list": object,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def get_kind(value: object) -> str:
+    """Get the kind of a value of the payloads, as in `OFFER_FIELDS`.
+
+    Args:
+        value (object): a decoded JSON value
+
+    Returns:
+        str: the kind, 'object' for a dict, or `None` for a null
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "list"
+    return "string"
+
+
+def observe_fields(results: list[dict]) -> dict[str, dict]:
+    """List the fields of the job offers, as flattened by `conform_offers()`.
+
+    Args:
+        results (list[dict]): the `resultats` of a search
+
+    Returns:
+        dict[str, dict]: the 'kinds' of each field and its 'count' (number
+            of offers where it is not null), sorted by field
+    """
+    fields = {}
+
+    def observe(item: dict, prefix: str) -> None:
+        for key, value in item.items():
+            kind = get_kind(value)
+            if kind == "object":
+                observe(value, f"{prefix}{key}.")
+            elif kind is not None:
+                field = fields.setdefault(
+                    f"{prefix}{key}", {"kinds": set(), "count": 0}
+                )
+                field["kinds"].add(kind)
+                field["count"] += 1
+
+    for offer in results:
+        observe(offer, "")
+    return {
+        name: {"kinds": sorted(field["kinds"]), "count": field["count"]}
+        for name, field in sorted(fields.items())
+    }
+
+
+def detect_drift(
+    observed: dict[str, dict],
+    previous: dict[str, dict] = None,
+    fields: dict[str, str] = None,
+) -> dict[str, list]:
+    """Compare the fields of a harvest with the previous one and the schema.
+
+    Args:
+        observed (dict[str, dict]): output of `observe_fields()`
+        previous (dict[str, dict], optional): the fields of the previous
+            harvest. Defaults to None, i.e. no previous harvest.
+        fields (dict[str, str], optional): the kind of each field.
+            Defaults to OFFER_FIELDS.
+
+    Returns:
+        dict[str, list]: the fields 'new' and 'missing' since the previous
+            harvest, the fields 'unknown' to the schema, and the fields
+            'retyped', i.e. of another kind than in the schema
+    """
+    fields = OFFER_FIELDS if fields is None else fields
+    drift = {
+        "new": sorted(set(observed) - set(previous)) if previous else [],
+        "missing": sorted(set(previous) - set(observed)) if previous else [],
+        "unknown": sorted(set(observed) - set(fields)),
+        "retyped": [],
+    }
+    for name, field in observed.items():
+        kind = fields.get(name)
+        # The integers are valid numbers (e.g. a latitude of 45)
+        allowed = {kind, "integer"} if kind == "number" else {kind}
+        if kind is not None and set(field["kinds"]) - allowed:
+            drift["retyped"].append(name)
+    return drift
+
+
+def _convert_field(values: pd.Series, kind: str) -> pd.Series:
+    """Convert the values of a field to the dtype of its kind.
+
+    The values of another kind (e.g. a string where a number is expected)
+    are converted if possible, else missing; a list or a dictionary where a
+    scalar is expected is missing.
+    """
+    if kind == "list":
+        return pd.Series(
+            [value if isinstance(value, list) else None for value in values],
+            index=values.index,
+            dtype=object,
+        )
+    if kind == "boolean":
+        return pd.Series(
+            [value if isinstance(value, bool) else None for value in values],
+            index=values.index,
+            dtype=KIND_DTYPES[kind],
+        )
+    values = pd.Series(
+        [
+            None if isinstance(value, (list, tuple, dict)) else value
+            for value in values
+        ],
+        index=values.index,
+        dtype=object,
+    )
+    if kind in ("integer", "number"):
+        numbers = pd.to_numeric(values, errors="coerce")
+        if kind == "integer":
+            numbers = numbers.where(numbers.round() == numbers)
+        return numbers.astype(KIND_DTYPES[kind])
+    return values.astype(KIND_DTYPES[kind])
+
+
+def conform_offers(
+    results: list[dict],
+    fields: dict[str, str] = None,
+    keep_unknown: bool = False,
+) -> pd.DataFrame:
+    """Map the job offers onto the fixed schema.
+
+    The nested dictionaries are flattened into dotted columns (e.g.
+    'lieuTravail.libelle'), the fields missing from the payloads are added
+    as typed nulls and the fields unknown to the schema are dropped (see
+    `detect_drift()` to report them), or kept as they are after the fields
+    of the schema.
+
+    Args:
+        results (list[dict]): the `resultats` of a search
+        fields (dict[str, str], optional): the kind of each field.
+            Defaults to OFFER_FIELDS.
+        keep_unknown (bool, optional): whether to keep the fields unknown
+            to the schema, e.g. to display every field of a live search.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: one row per job offer, one column per field
+    """
+    fields = OFFER_FIELDS if fields is None else fields
+    normalized = pd.json_normalize(results)
+    unknown = [
+        name for name in normalized.columns.difference(list(fields))
+        if normalized[name].notna().any()
+    ]
+    if unknown and not keep_unknown:
+        logger.warning("Fields dropped: %s", ", ".join(unknown))
+    known = normalized.reindex(columns=list(fields))
+    conformed = pd.DataFrame(
+        {
+            name: _convert_field(known[name], kind)
+            for name, kind in fields.items()
+        },
+        index=normalized.index,
+    )
+    if keep_unknown and unknown:
+        conformed = pd.concat([conformed, normalized[unknown]], axis=1)
+    return conformed
+
+
+def get_schema_file(snapshot_dir: str, name: str = "default") -> Path:
+    """Get the registry of the fields of the harvests of a query.
+
+    Args:
+        snapshot_dir (str): root directory of the snapshots
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        Path: the JSON file
+    """
+    return Path(snapshot_dir, name, SCHEMA_FILE_NAME)
+
+
+def load_schema_history(schema_file: str) -> dict:
+    """Load the registry of the fields of a query.
+
+    Args:
+        schema_file (str): the JSON file
+
+    Returns:
+        dict: the 'fields' of the latest harvest (see `observe_fields()`),
+            empty if none, and the 'harvested_at', 'nb_offers' and 'drift'
+            (see `detect_drift()`) of the last harvests, oldest first
+    """
+    if not Path(schema_file).exists():
+        return {"fields": {}, "harvests": []}
+    with open(schema_file, encoding="utf-8") as input_file:
+        registry = json.load(input_file)
+    if isinstance(registry, list):
+        # Former layout: the fields of every harvest
+        registry = {
+            "fields": registry[-1]["fields"] if registry else {},
+            "harvests": [
+                {key: value for key, value in record.items()
+                 if key != "fields"}
+                for record in registry
+            ],
+        }
+    return registry
+
+
+def record_schema(
+    schema_file: str,
+    results: list[dict],
+    harvested_at: object = None,
+) -> dict[str, list]:
+    """Record the fields of a harvest and detect their drift.
+
+    Args:
+        schema_file (str): the JSON file
+        results (list[dict]): the `resultats` of the search
+        harvested_at (object, optional): time of the harvest.
+            Defaults to None, i.e. now.
+
+    Returns:
+        dict[str, list]: the drift of the fields (see `detect_drift()`)
+    """
+    if harvested_at is None:
+        harvested_at = datetime.datetime.now(datetime.timezone.utc)
+    registry = load_schema_history(schema_file)
+    observed = observe_fields(results)
+    drift = detect_drift(observed, previous=registry["fields"] or None)
+    for change, names in drift.items():
+        if names:
+            logger.warning("Fields %s: %s", change, ", ".join(names))
+    registry["fields"] = observed
+    registry["harvests"] = registry["harvests"][-(MAX_HARVESTS - 1):] + [
+        {
+            "harvested_at": pd.Timestamp(harvested_at).isoformat(),
+            "nb_offers": len(results),
+            "drift": drift,
+        }
+    ]
+    schema_file = Path(schema_file)
+    schema_file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = schema_file.with_suffix(".tmp")
+    with open(temporary_file, "w", encoding="utf-8") as output:
+        json.dump(registry, output, ensure_ascii=False, indent=2)
+    os.replace(temporary_file, schema_file)
+    return drift
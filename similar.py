@@ -0,0 +1,220 @@
+"""Offers similar to a given one ("more like this"), without a new search.
+
+The 'intitule', 'description' and 'competences' of the offers are tokenized
+as for the full-text index (see `text_index.py`) and weighted with TF-IDF:
+
+    weight(t, d) = (1 + log(tf(t, d))) * log((1 + nb_offers) / (1 + df(t)))
+
+Each row of the resulting sparse matrix is L2-normalized, so that the cosine
+similarity of two offers is the dot product of their rows. The matrix is also
+kept transposed (one row per term), so that the scores of all the offers are
+a sparse vector-matrix product touching only the postings of the terms of the
+query. The query keeps its `MAX_QUERY_TERMS` heaviest terms only, which
+bounds the latency on large snapshots at the cost of a slightly approximate
+ranking.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import text_index
+
+# Terms found in more than this share of the offers are ignored
+MAX_DOC_FREQ = 0.5
+# Terms found in fewer offers are ignored (typos, ids...)
+MIN_DOC_COUNT = 2
+MAX_QUERY_TERMS = 30
+
+
+def normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Scale each row of a sparse matrix to a unit L2 norm.
+
+    Args:
+        matrix (sparse.csr_matrix): the matrix
+
+    Returns:
+        sparse.csr_matrix: the scaled matrix (empty rows remain empty)
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+class SimilarOffers:
+    """TF-IDF vectors of the job offers, for cosine nearest neighbours.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their 'id'
+    """
+
+    def __init__(self, dataframe: pd.DataFrame):
+        self.offer_ids = dataframe["id"].astype(str).to_numpy()
+        self._positions = {
+            offer_id: position
+            for position, offer_id in enumerate(self.offer_ids)
+        }
+        counts, terms = self._count_terms(
+            text_index.build_offer_texts(dataframe).tolist()
+        )
+        doc_counts = np.bincount(counts.indices, minlength=len(terms))
+        nb_offers = max(len(dataframe), 1)
+        keep = (doc_counts >= MIN_DOC_COUNT) & (
+            doc_counts <= MAX_DOC_FREQ * nb_offers
+        )
+        self.terms = {
+            term: code
+            for code, term in enumerate(np.asarray(terms, dtype=object)[keep])
+        }
+        self.idf = np.log((1 + nb_offers) / (1 + doc_counts[keep]))
+        self.matrix = self._weigh(counts[:, np.flatnonzero(keep)])
+        # One row per term: the offers holding it and their weight
+        self.postings = self.matrix.T.tocsr()
+
+    def __contains__(self, offer_id: str) -> bool:
+        return str(offer_id) in self._positions
+
+    @staticmethod
+    def _count_terms(texts: list[str]) -> tuple[sparse.csr_matrix, list]:
+        """Count the terms of each text, numbering the terms on the fly."""
+        codes = {}
+        indices, indptr = [], [0]
+        for text in texts:
+            indices.extend(
+                codes.setdefault(term, len(codes))
+                for term in text_index.tokenize(text)
+            )
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), indices, indptr),
+            shape=(len(texts), len(codes)),
+        )
+        # Sum the duplicate terms of each text
+        counts.sum_duplicates()
+        return counts, list(codes)
+
+    def _weigh(self, counts: sparse.csr_matrix) -> sparse.csr_matrix:
+        """Turn term counts into L2-normalized TF-IDF vectors."""
+        counts = sparse.csr_matrix(counts, dtype=np.float64)
+        counts.data = 1 + np.log(counts.data)
+        return normalize_rows(counts @ sparse.diags(self.idf))
+
+    def vectorize(self, texts: list[str]) -> sparse.csr_matrix:
+        """Get the TF-IDF vectors of new texts, with the known terms only.
+
+        Args:
+            texts (list[str]): the texts
+
+        Returns:
+            sparse.csr_matrix: one L2-normalized row per text
+        """
+        indices, indptr = [], [0]
+        for text in texts:
+            indices.extend(
+                self.terms[term]
+                for term in text_index.tokenize(text)
+                if term in self.terms
+            )
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), indices, indptr),
+            shape=(len(texts), len(self.terms)),
+        )
+        counts.sum_duplicates()
+        return self._weigh(counts)
+
+    def _top_k(
+        self,
+        vector: sparse.csr_matrix,
+        k: int,
+        exclude: int = None
+    ) -> pd.DataFrame:
+        """Find the offers closest to a TF-IDF vector."""
+        if vector.nnz > MAX_QUERY_TERMS:
+            heaviest = np.argpartition(-vector.data, MAX_QUERY_TERMS - 1)[
+                :MAX_QUERY_TERMS
+            ]
+            vector = sparse.csr_matrix(
+                (
+                    vector.data[heaviest],
+                    vector.indices[heaviest],
+                    [0, MAX_QUERY_TERMS],
+                ),
+                shape=vector.shape,
+            )
+        scores = (vector @ self.postings).tocsr()
+        positions, similarities = scores.indices, scores.data
+        if exclude is not None:
+            keep = positions != exclude
+            positions, similarities = positions[keep], similarities[keep]
+        if len(similarities) > k:
+            best = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            best = np.arange(len(similarities))
+        best = best[np.argsort(-similarities[best], kind="stable")]
+        return pd.DataFrame(
+            {
+                "id": self.offer_ids[positions[best]],
+                "similarite": similarities[best],
+            }
+        )
+
+    def similar_to(self, offer_id: str, k: int = 10) -> pd.DataFrame:
+        """Find the offers most similar to an indexed offer.
+
+        Args:
+            offer_id (str): the id of the offer
+            k (int, optional): number of offers. Defaults to 10.
+
+        Raises:
+            KeyError: the offer is not indexed
+
+        Returns:
+            pd.DataFrame: the 'id' and cosine 'similarite' of the offers,
+                the most similar first (the offer itself excluded)
+        """
+        position = self._positions[str(offer_id)]
+        return self._top_k(self.matrix[position], k, exclude=position)
+
+    def similar_to_text(self, text: str, k: int = 10) -> pd.DataFrame:
+        """Find the offers most similar to a text, e.g. an offer not indexed.
+
+        Args:
+            text (str): the text
+            k (int, optional): number of offers. Defaults to 10.
+
+        Returns:
+            pd.DataFrame: the 'id' and cosine 'similarite' of the offers,
+                the most similar first
+        """
+        return self._top_k(self.vectorize([text]), k)
+
+
+def recommend_offers(
+    dataframe: pd.DataFrame,
+    model: SimilarOffers,
+    offer: pd.Series,
+    k: int = 10
+) -> pd.DataFrame:
+    """Get the offers most similar to an offer.
+
+    Args:
+        dataframe (pd.DataFrame): the indexed job offers
+        model (SimilarOffers): the model built on these offers
+        offer (pd.Series): the offer, with its 'id' and, if it is not
+            indexed, its 'intitule', 'description' and 'competences'
+        k (int, optional): number of offers. Defaults to 10.
+
+    Returns:
+        pd.DataFrame: the similar offers, with their 'similarite', the most
+            similar first
+    """
+    offer_id = str(offer.get("id"))
+    if offer_id in model:
+        neighbours = model.similar_to(offer_id, k)
+    else:
+        text = text_index.build_offer_texts(offer.to_frame().T).iloc[0]
+        neighbours = model.similar_to_text(text, k)
+        neighbours = neighbours[neighbours["id"] != offer_id].head(k)
+    offers = dataframe.assign(id=dataframe["id"].astype(str))
+    return neighbours.merge(offers, on="id", how="inner")
@@ -0,0 +1,414 @@
+"""Sketches of the job offers per day and departement, for the metrics.
+
+The number of distinct companies and communes and the salary quantiles over
+the whole harvested history would need to scan (and keep) every offer.
+Instead, each partition (day of creation x departement) keeps:
+- a HyperLogLog of the companies ('entreprise.nom') and one of the communes
+    ('lieuTravail.commune'), i.e. 1 KB each, for the distinct counts
+    (about 3% standard error)
+- a DDSketch of the annual salaries, i.e. a histogram on logarithmic buckets,
+    for the quantiles (1% relative error)
+- the number of offers
+
+Both sketches are merged without any loss (maximum of the registers, sum of
+the buckets), so a metric over any date range and set of departements merges
+the sketches of its partitions.
+
+The offers are counted once: the ids of the offers created during the last
+`OPEN_DAYS` days are kept. Once a day gets older than that, it is closed:
+the ids of its offers are forgotten and the offers created on that day are
+ignored by the next harvests. Hence the memory does not grow with the
+history, provided that the harvests are less than `OPEN_DAYS` days apart.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SKETCHES_FILE_NAME = "sketches.npz"
+
+HLL_PRECISION = 10
+SALARY_ACCURACY = 0.01
+# Number of days during which the offers created on a day are added
+OPEN_DAYS = 31
+
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """Hash values into 64-bit integers (stable across runs).
+
+    Args:
+        values (pd.Series): the values
+
+    Returns:
+        np.ndarray: the hashes (uint64)
+    """
+    return pd.util.hash_pandas_object(
+        values.astype(str), index=False
+    ).to_numpy()
+
+
+class HyperLogLog:
+    """Estimate the number of distinct values with 2^precision registers."""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers=None):
+        self.precision = precision
+        if registers is None:
+            registers = np.zeros(2**precision, dtype=np.uint8)
+        self.registers = registers
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        """Add values, given as 64-bit hashes."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        buckets = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # Rank of the first bit set in the remaining bits, computed on their
+        # 52 highest bits (exact as floats)
+        nb_bits = 64 - self.precision
+        shift = max(nb_bits - 52, 0)
+        remaining = (
+            hashes & np.uint64((1 << nb_bits) - 1)
+        ) >> np.uint64(shift)
+        _, bit_lengths = np.frexp(remaining.astype(np.float64))
+        ranks = (nb_bits - shift - bit_lengths + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Get the union of two sketches."""
+        return HyperLogLog(
+            self.precision, np.maximum(self.registers, other.registers)
+        )
+
+    def count(self) -> float:
+        """Estimate the number of distinct values added."""
+        nb_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / nb_registers)
+        estimate = alpha * nb_registers**2 / np.sum(
+            2.0 ** -self.registers.astype(np.float64)
+        )
+        nb_empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * nb_registers and nb_empty:
+            # Linear counting for the small numbers
+            estimate = nb_registers * np.log(nb_registers / nb_empty)
+        return float(estimate)
+
+
+class DDSketch:
+    """Estimate quantiles with logarithmic buckets of bounded relative error.
+
+    Value `x` goes in bucket `ceil(log(x) / log(gamma))`, with
+    `gamma = (1 + accuracy) / (1 - accuracy)`; only positive values are kept.
+    """
+
+    def __init__(
+        self,
+        accuracy: float = SALARY_ACCURACY,
+        keys: np.ndarray = None,
+        counts: np.ndarray = None,
+    ):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else keys
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def _combine(self, keys: np.ndarray, counts: np.ndarray) -> None:
+        """Add bucket counts to the sketch."""
+        keys = np.concatenate((self.keys, keys))
+        counts = np.concatenate((self.counts, counts))
+        self.keys, positions = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(
+            positions.ravel(), weights=counts, minlength=len(self.keys)
+        ).astype(np.int64)
+
+    def add(self, values: np.ndarray) -> None:
+        """Add values."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[values > 0]
+        keys = np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+        self._combine(keys, np.ones(len(keys), dtype=np.int64))
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        """Get the union of two sketches."""
+        merged = DDSketch(self.accuracy, self.keys, self.counts)
+        merged._combine(other.keys, other.counts)
+        return merged
+
+    def quantile(self, quantile: float) -> float:
+        """Estimate a quantile (between 0 and 1) of the values added."""
+        if not len(self):
+            return np.nan
+        cumulated = np.cumsum(self.counts)
+        position = np.searchsorted(
+            cumulated, quantile * (cumulated[-1] - 1), side="right"
+        )
+        key = self.keys[min(position, len(self.keys) - 1)]
+        return float(2 * self.gamma**key / (self.gamma + 1))
+
+
+class SketchStore:
+    """Sketches of the job offers per day of creation and departement."""
+
+    def __init__(self):
+        # (day, departement) -> (companies, communes, salaries, nb_offres)
+        self.partitions = {}
+        # Hashes of the ids of the offers of the open days, and their day
+        self.open_ids = np.zeros(0, dtype=np.uint64)
+        self.open_days = np.zeros(0, dtype=str)
+        self.last_day = None
+        # First day still open: the offers created before are ignored
+        self.first_open_day = ""
+
+    def add_offers(self, dataframe: pd.DataFrame) -> int:
+        """Add the offers not added yet to the sketches of their partition.
+
+        Args:
+            dataframe (pd.DataFrame): the cleaned job offers (see
+                `pipeline.clean_offers()`)
+
+        Returns:
+            int: number of offers added
+        """
+        days = pd.to_datetime(
+            dataframe["dateCreation"], utc=True, errors="coerce"
+        ).dt.strftime("%Y-%m-%d")
+        if days.notna().any():
+            self.last_day = max(
+                filter(None, (self.last_day, days.max()))
+            )
+        if self.last_day is None:
+            return 0
+        ids = hash_values(dataframe["id"])
+        new = (
+            days.notna().to_numpy()
+            & (days.fillna("") >= self.first_open_day).to_numpy()
+            & ~np.isin(ids, self.open_ids)
+        )
+        offers = pd.DataFrame(
+            {
+                "day": days[new].to_numpy(),
+                "departement": (
+                    dataframe["departement"].astype(str).to_numpy()[new]
+                    if "departement" in dataframe else ""
+                ),
+                "row": np.flatnonzero(new),
+            }
+        )
+        for (day, departement), partition in offers.groupby(
+            ["day", "departement"]
+        ):
+            rows = dataframe.iloc[partition["row"].to_numpy()]
+            companies, communes, salaries, nb_offres = self.partitions.get(
+                (day, departement),
+                (HyperLogLog(), HyperLogLog(), DDSketch(), 0),
+            )
+            for sketch, category in (
+                (companies, "entreprise.nom"),
+                (communes, "lieuTravail.commune"),
+            ):
+                if category in rows:
+                    sketch.add_hashes(hash_values(rows[category].dropna()))
+            if "salaire_annuel" in rows:
+                salaries.add(rows["salaire_annuel"].dropna().to_numpy())
+            self.partitions[(day, departement)] = (
+                companies, communes, salaries, nb_offres + len(rows)
+            )
+
+        # Close the days older than OPEN_DAYS and forget their offers
+        self.first_open_day = max(
+            self.first_open_day,
+            (
+                pd.Timestamp(self.last_day)
+                - pd.Timedelta(days=OPEN_DAYS - 1)
+            ).strftime("%Y-%m-%d"),
+        )
+        open_ids = np.concatenate((self.open_ids, ids[new]))
+        open_days = np.concatenate(
+            (self.open_days, days[new].to_numpy().astype(str))
+        )
+        still_open = open_days >= self.first_open_day
+        self.open_ids = open_ids[still_open]
+        self.open_days = open_days[still_open]
+        return int(new.sum())
+
+    def summarize(
+        self,
+        start: str = None,
+        end: str = None,
+        departements: list[str] = None,
+        by: str = None,
+    ) -> pd.DataFrame:
+        """Merge the sketches of the partitions of a period.
+
+        Args:
+            start (str, optional): first day, e.g. '2022-06-01'.
+                Defaults to None, i.e. the first day of the history.
+            end (str, optional): last day (included).
+                Defaults to None, i.e. the last day of the history.
+            departements (list[str], optional): the departements.
+                Defaults to None, i.e. all of them.
+            by (str, optional): 'day' or 'departement', to get one row per
+                day or departement. Defaults to None, i.e. a single row.
+
+        Returns:
+            pd.DataFrame: the 'nb_offres', 'nb_entreprises', 'nb_communes'
+                and the salary quartiles ('salaire_q25', 'salaire_q50' and
+                'salaire_q75')
+        """
+        groups = {}
+        for (day, departement), sketches in self.partitions.items():
+            if (start and day < str(start)) or (end and day > str(end)):
+                continue
+            if departements and departement not in departements:
+                continue
+            key = {"day": day, "departement": departement}.get(by, "")
+            if key in groups:
+                companies, communes, salaries, nb_offres = groups[key]
+                groups[key] = (
+                    companies.merge(sketches[0]),
+                    communes.merge(sketches[1]),
+                    salaries.merge(sketches[2]),
+                    nb_offres + sketches[3],
+                )
+            else:
+                groups[key] = sketches
+        rows = [
+            {
+                **({by: key} if by else {}),
+                "nb_offres": nb_offres,
+                "nb_entreprises": round(companies.count()),
+                "nb_communes": round(communes.count()),
+                "salaire_q25": salaries.quantile(0.25),
+                "salaire_q50": salaries.quantile(0.5),
+                "salaire_q75": salaries.quantile(0.75),
+            }
+            for key, (companies, communes, salaries, nb_offres)
+            in sorted(groups.items())
+        ]
+        columns = ([by] if by else []) + [
+            "nb_offres", "nb_entreprises", "nb_communes",
+            "salaire_q25", "salaire_q50", "salaire_q75",
+        ]
+        return pd.DataFrame(rows, columns=columns)
+
+    def save(self, sketches_file: str) -> None:
+        """Save the sketches into a numpy archive.
+
+        Args:
+            sketches_file (str): the '.npz' file
+        """
+        keys = sorted(self.partitions)
+        salaries = [self.partitions[key][2] for key in keys]
+        Path(sketches_file).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            sketches_file,
+            days=np.array([day for day, _ in keys], dtype=str),
+            departements=np.array(
+                [departement for _, departement in keys], dtype=str
+            ),
+            companies=np.array(
+                [self.partitions[key][0].registers for key in keys],
+                dtype=np.uint8,
+            ).reshape(len(keys), 2**HLL_PRECISION),
+            communes=np.array(
+                [self.partitions[key][1].registers for key in keys],
+                dtype=np.uint8,
+            ).reshape(len(keys), 2**HLL_PRECISION),
+            nb_offres=np.array(
+                [self.partitions[key][3] for key in keys], dtype=np.int64
+            ),
+            salary_offsets=np.cumsum(
+                [0] + [len(sketch.keys) for sketch in salaries]
+            ),
+            salary_keys=np.concatenate(
+                [sketch.keys for sketch in salaries] + [np.zeros(0, int)]
+            ),
+            salary_counts=np.concatenate(
+                [sketch.counts for sketch in salaries] + [np.zeros(0, int)]
+            ),
+            open_ids=self.open_ids,
+            open_days=self.open_days.astype(str),
+            last_day=np.array([self.last_day or ""], dtype=str),
+            first_open_day=np.array([self.first_open_day], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, sketches_file: str) -> "SketchStore":
+        """Load the sketches saved with `save()`.
+
+        Args:
+            sketches_file (str): the '.npz' file
+
+        Returns:
+            SketchStore: the sketches
+        """
+        store = cls()
+        with np.load(sketches_file) as archive:
+            offsets = archive["salary_offsets"]
+            for index, (day, departement) in enumerate(
+                zip(archive["days"], archive["departements"])
+            ):
+                salaries = slice(offsets[index], offsets[index + 1])
+                store.partitions[(str(day), str(departement))] = (
+                    HyperLogLog(registers=archive["companies"][index].copy()),
+                    HyperLogLog(registers=archive["communes"][index].copy()),
+                    DDSketch(
+                        keys=archive["salary_keys"][salaries].astype(np.int64),
+                        counts=archive["salary_counts"][salaries].astype(
+                            np.int64
+                        ),
+                    ),
+                    int(archive["nb_offres"][index]),
+                )
+            store.open_ids = archive["open_ids"]
+            store.open_days = archive["open_days"]
+            store.last_day = str(archive["last_day"][0]) or None
+            store.first_open_day = str(archive["first_open_day"][0])
+        return store
+
+
+def get_sketches_file(snapshot_dir: str, name: str = "default") -> Path:
+    """Get the file of the sketches of a search, next to its snapshots.
+
+    Args:
+        snapshot_dir (str): root directory of the snapshots
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        Path: the '.npz' file
+    """
+    return Path(snapshot_dir, name, SKETCHES_FILE_NAME)
+
+
+def load_sketches(sketches_file: str) -> SketchStore:
+    """Load the sketches, or create empty ones if none were saved yet.
+
+    Args:
+        sketches_file (str): the '.npz' file
+
+    Returns:
+        SketchStore: the sketches
+    """
+    if Path(sketches_file).exists():
+        return SketchStore.load(sketches_file)
+    return SketchStore()
+
+
+def update_sketches(
+    dataframe: pd.DataFrame,
+    sketches_file: str
+) -> SketchStore:
+    """Add the new offers of a harvest to the saved sketches.
+
+    Args:
+        dataframe (pd.DataFrame): the cleaned job offers
+        sketches_file (str): the '.npz' file
+
+    Returns:
+        SketchStore: the updated sketches
+    """
+    store = load_sketches(sketches_file)
+    if store.add_offers(dataframe):
+        store.save(sketches_file)
+    return store
@@ -0,0 +1,606 @@
+"""Local full-text index of the job offers, for keyword search without the API.
+
+The 'intitule', 'description' and 'competences' libelles of the offers are
+indexed in an inverted index:
+- accents are folded and words are reduced to a light French stem, so that
+    'Développeuse' and 'developpeurs' match
+- each posting list holds the delta-encoded offer numbers and the term
+    frequencies as variable-length integers (1 byte for most values), and is
+    decoded with numpy at query time
+- the offers are ranked with BM25
+
+The index is built incrementally (offers already indexed are skipped) as the
+offers are harvested, and saved next to the offer snapshots; the offers
+missing from the latest harvest (e.g. expired) are removed from it.
+
+By default an offer matches any term of the query, and the best offers come
+first. With `match_all`, an offer must hold every term, as the API does with
+the keywords ('motsCles'); the stemming and accent folding may still match a
+few more offers than the API.
+"""
+
+import functools
+import json
+import re
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDEX_DIR_NAME = "text_index"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+FRENCH_STOPWORDS = frozenset(
+    """
+    a afin ai au aux avec avez avons ce ceci cela ces cet cette chez dans de
+    des du elle elles en est et etc etre eux il ils je la le les leur leurs
+    lui ma mais me meme mes moi mon ne nos notre nous on ou par pas pour qu
+    que qui sa sans se ses si son sont sur ta te tes toi ton tu un une vos
+    votre vous y d l s n c j m t
+    """.split()
+)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Stem endings replaced by the light French stemmer (first match only)
+_SUFFIXES = (
+    ("issement", "ir"),
+    ("ement", ""),
+    ("atrice", "ateur"),
+    ("euse", "eur"),
+    ("ienne", "ien"),
+    ("ive", "if"),
+    ("ere", "er"),
+    ("ee", "e"),
+)
+
+
+def _build_folding_table() -> dict:
+    """Map each accented Latin letter to its letters without accents."""
+    table = {"œ": "oe", "æ": "ae", "ß": "ss"}
+    for code in range(0xC0, 0x250):
+        char = chr(code)
+        decomposed = unicodedata.normalize("NFKD", char)
+        folded = "".join(
+            part for part in decomposed if not unicodedata.combining(part)
+        )
+        if folded != char and folded.isascii():
+            table[char] = folded
+    return str.maketrans(table)
+
+
+_FOLDING_TABLE = _build_folding_table()
+
+
+def fold_accents(text: str) -> str:
+    """Lower-case a text and remove its accents, e.g. 'Été' -> 'ete'.
+
+    Args:
+        text (str): the text to fold
+
+    Returns:
+        str: the folded text
+    """
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(_FOLDING_TABLE)
+    if text.isascii():
+        return text
+    # Other scripts and symbols, not covered by the table
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+
+
+@functools.lru_cache(maxsize=2**16)
+def stem(word: str) -> str:
+    """Reduce a (folded) French word to a light stem.
+
+    Only plurals, feminine forms and a few frequent suffixes are removed,
+    which is enough to match the usual variants of job titles and skills.
+
+    Args:
+        word (str): the folded word
+
+    Returns:
+        str: the stem
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("aux") and len(word) > 4:
+        word = word[:-3] + "al"
+    elif word[-1] in "sx":
+        word = word[:-1]
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + replacement
+            break
+    if word.endswith("e") and len(word) > 4:
+        word = word[:-1]
+    if word.endswith("er") and len(word) > 5:
+        word = word[:-2]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into stemmed terms, without the stop words.
+
+    Args:
+        text (str): the text to tokenize
+
+    Returns:
+        list[str]: the terms, in the order of the text
+    """
+    return [
+        stem(token)
+        for token in _TOKEN_PATTERN.findall(fold_accents(text))
+        if token not in FRENCH_STOPWORDS
+    ]
+
+
+def get_varint_sizes(values: np.ndarray) -> np.ndarray:
+    """Count the bytes taken by each integer once encoded as a varint.
+
+    Args:
+        values (np.ndarray): the non-negative integers
+
+    Returns:
+        np.ndarray: the number of bytes of each integer
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nb_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        nb_bytes += values >= np.uint64(1 << shift)
+    return nb_bytes
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Encode non-negative integers as variable-length integers (LEB128).
+
+    Each byte holds 7 bits of the value, the high bit flagging that another
+    byte follows.
+
+    Args:
+        values (np.ndarray): the integers to encode
+
+    Returns:
+        np.ndarray: the encoded bytes (uint8)
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nb_bytes = get_varint_sizes(values)
+    owner = np.repeat(np.arange(len(values)), nb_bytes)
+    position = np.arange(nb_bytes.sum()) - np.repeat(
+        np.cumsum(nb_bytes) - nb_bytes, nb_bytes
+    )
+    encoded = (values[owner] >> (7 * position).astype(np.uint64)) & 0x7F
+    encoded |= (position < nb_bytes[owner] - 1).astype(np.uint64) << 7
+    return encoded.astype(np.uint8)
+
+
+def decode_varints(encoded: np.ndarray) -> np.ndarray:
+    """Decode variable-length integers encoded by `encode_varints()`.
+
+    Args:
+        encoded (np.ndarray): the encoded bytes (uint8)
+
+    Returns:
+        np.ndarray: the integers (uint64)
+    """
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    parts = (encoded & 0x7F).astype(np.uint64) << (
+        7 * position
+    ).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def build_offer_texts(dataframe: pd.DataFrame) -> pd.Series:
+    """Gather the indexed text of each offer.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with the 'intitule',
+            'description' and 'competences' (list) categories
+
+    Returns:
+        pd.Series: the text of each offer
+    """
+    texts = pd.Series("", index=dataframe.index)
+    for column in ("intitule", "description"):
+        if column in dataframe:
+            texts = texts + " " + dataframe[column].fillna("").astype(str)
+    if "competences" in dataframe:
+        texts = texts + " " + pd.Series(
+            [
+                " ".join(
+                    str(item.get("libelle", ""))
+                    for item in items if isinstance(item, dict)
+                )
+                if isinstance(items, (list, tuple, np.ndarray)) else ""
+                for items in dataframe["competences"].tolist()
+            ],
+            index=dataframe.index,
+        )
+    return texts
+
+
+class InvertedIndex:
+    """Inverted index of the job offers, ranked with BM25.
+
+    The offers are numbered in the order they are added; the posting list of
+    each term holds (number delta, term frequency) pairs as varints.
+    """
+
+    def __init__(self):
+        self.offer_ids = []
+        self.doc_lengths = np.zeros(0, dtype=np.uint32)
+        self.terms = {}
+        self.postings = []
+        self.doc_freqs = []
+        self.last_doc = []
+        self._known_ids = set()
+
+    def __len__(self) -> int:
+        return len(self.offer_ids)
+
+    def add_documents(self, offer_ids: list[str], texts: list[str]) -> int:
+        """Add new offers to the index, skipping the ones already indexed.
+
+        Args:
+            offer_ids (list[str]): the 'id' of each offer
+            texts (list[str]): the text of each offer
+
+        Returns:
+            int: number of offers added
+        """
+        new_ids, doc_terms = [], []
+        for offer_id, text in zip(offer_ids, texts):
+            if offer_id in self._known_ids:
+                continue
+            self._known_ids.add(offer_id)
+            new_ids.append(offer_id)
+            doc_terms.append(tokenize(text))
+        if not new_ids:
+            return 0
+
+        first_doc = len(self.offer_ids)
+        lengths = np.fromiter(map(len, doc_terms), dtype=np.int64)
+        # Number the terms of the batch in order of appearance
+        batch_terms = {}
+        term_codes = np.fromiter(
+            (
+                batch_terms.setdefault(term, len(batch_terms))
+                for terms in doc_terms for term in terms
+            ),
+            dtype=np.int64,
+            count=int(lengths.sum()),
+        )
+        unique_terms = list(batch_terms)
+        docs = np.repeat(np.arange(first_doc, first_doc + len(new_ids)),
+                         lengths)
+        # Count the (term, document) pairs, sorted by term then document
+        pairs, frequencies = np.unique(
+            term_codes * (first_doc + len(new_ids)) + docs,
+            return_counts=True,
+        )
+        pair_terms = pairs // (first_doc + len(new_ids))
+        pair_docs = pairs % (first_doc + len(new_ids))
+
+        # Map the terms of the batch to the terms of the index
+        term_numbers = np.empty(len(unique_terms), dtype=np.int64)
+        for code, term in enumerate(unique_terms):
+            number = self.terms.get(term)
+            if number is None:
+                number = len(self.postings)
+                self.terms[term] = number
+                self.postings.append(bytearray())
+                self.doc_freqs.append(0)
+                self.last_doc.append(-1)
+            term_numbers[code] = number
+
+        # Delta-encode the documents within each term
+        group_starts = np.flatnonzero(
+            np.concatenate(([True], pair_terms[1:] != pair_terms[:-1]))
+        )
+        # (the first document of a term follows its last indexed document)
+        previous_docs = np.concatenate(([0], pair_docs[:-1]))
+        previous_docs[group_starts] = [
+            max(self.last_doc[term_numbers[pair_terms[start]]], 0)
+            for start in group_starts
+        ]
+        deltas = pair_docs - previous_docs
+        interleaved = np.empty(2 * len(pairs), dtype=np.int64)
+        interleaved[0::2] = deltas
+        interleaved[1::2] = frequencies
+        encoded = encode_varints(interleaved)
+
+        # Split the encoded bytes back per term
+        nb_bytes = get_varint_sizes(interleaved)
+        pair_bytes = nb_bytes[0::2] + nb_bytes[1::2]
+        group_ends = np.concatenate((group_starts[1:], [len(pairs)]))
+        byte_offsets = np.concatenate(([0], np.cumsum(pair_bytes)))
+        for start, end in zip(group_starts, group_ends):
+            number = term_numbers[pair_terms[start]]
+            self.postings[number] += encoded[
+                byte_offsets[start]:byte_offsets[end]
+            ].tobytes()
+            self.doc_freqs[number] += int(end - start)
+            self.last_doc[number] = int(pair_docs[end - 1])
+
+        self.offer_ids.extend(new_ids)
+        self.doc_lengths = np.concatenate(
+            (self.doc_lengths, lengths.astype(np.uint32))
+        )
+        return len(new_ids)
+
+    def remove_documents(self, offer_ids: list[str]) -> int:
+        """Remove offers from the index, e.g. the expired ones.
+
+        The remaining offers are renumbered, and the posting lists decoded,
+        filtered and encoded again.
+
+        Args:
+            offer_ids (list[str]): the 'id' of the offers to remove
+
+        Returns:
+            int: number of offers removed
+        """
+        removed = self._known_ids.intersection(offer_ids)
+        if not removed:
+            return 0
+        kept = np.array(
+            [offer_id not in removed for offer_id in self.offer_ids],
+            dtype=bool,
+        )
+        # New number of each kept offer
+        new_docs = np.cumsum(kept) - 1
+        for number in range(len(self.postings)):
+            docs, frequencies = self._decode_postings(number)
+            in_index = kept[docs]
+            docs = new_docs[docs[in_index]]
+            frequencies = frequencies[in_index]
+            interleaved = np.empty(2 * len(docs), dtype=np.int64)
+            interleaved[0::2] = np.diff(docs, prepend=0)
+            interleaved[1::2] = frequencies
+            self.postings[number] = bytearray(
+                encode_varints(interleaved).tobytes()
+            )
+            self.doc_freqs[number] = len(docs)
+            self.last_doc[number] = int(docs[-1]) if len(docs) else -1
+        self.offer_ids = [
+            offer_id for offer_id, keep in zip(self.offer_ids, kept) if keep
+        ]
+        self.doc_lengths = self.doc_lengths[kept]
+        self._known_ids -= removed
+        return len(removed)
+
+    def _decode_postings(self, number: int) -> tuple[np.ndarray, np.ndarray]:
+        """Decode the posting list of a term, given its number."""
+        values = decode_varints(
+            np.frombuffer(bytes(self.postings[number]), dtype=np.uint8)
+        ).astype(np.int64)
+        return np.cumsum(values[0::2]), values[1::2]
+
+    def get_postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """Decode the posting list of a (stemmed) term.
+
+        Args:
+            term (str): the term
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: the offer numbers and the term
+                frequencies
+        """
+        number = self.terms.get(term)
+        if number is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return self._decode_postings(number)
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 150,
+        match_all: bool = False
+    ) -> pd.DataFrame:
+        """Rank the offers matching the query with BM25.
+
+        Args:
+            query (str): the keywords, e.g. 'data analyst, BI'
+            top_k (int, optional): maximum number of offers returned.
+                Defaults to 150.
+            match_all (bool, optional): whether an offer must hold every
+                term of the query, as in the API, rather than any of them.
+                Defaults to False.
+
+        Returns:
+            pd.DataFrame: the 'id' and 'score' of the best offers
+        """
+        nb_docs = len(self.offer_ids)
+        scores = np.zeros(nb_docs, dtype=np.float32)
+        # Number of terms of the query held by each offer
+        nb_terms = np.zeros(nb_docs, dtype=np.int64)
+        query_terms = set(tokenize(query))
+        if nb_docs:
+            average_length = max(float(self.doc_lengths.mean()), 1.0)
+            norms = BM25_K1 * (
+                1 - BM25_B + BM25_B * self.doc_lengths / average_length
+            )
+            for term in query_terms:
+                docs, frequencies = self.get_postings(term)
+                if not len(docs):
+                    continue
+                nb_terms[docs] += 1
+                idf = np.log(
+                    1 + (nb_docs - len(docs) + 0.5) / (len(docs) + 0.5)
+                )
+                scores[docs] += idf * frequencies * (BM25_K1 + 1) / (
+                    frequencies + norms[docs]
+                )
+        if match_all:
+            matches = np.flatnonzero(
+                (nb_terms == len(query_terms)) & (nb_terms > 0)
+            )
+        else:
+            matches = np.flatnonzero(nb_terms > 0)
+        if len(matches) > top_k:
+            matches = matches[
+                np.argpartition(scores[matches], -top_k)[-top_k:]
+            ]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return pd.DataFrame(
+            {
+                "id": [self.offer_ids[doc] for doc in matches],
+                "score": scores[matches],
+            }
+        )
+
+    def save(self, index_dir: str) -> None:
+        """Save the index into a directory.
+
+        The posting lists are concatenated into a single 'postings.bin' file,
+        with their offsets in 'offsets.npy'.
+
+        Args:
+            index_dir (str): the directory of the index
+        """
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        sizes = np.fromiter(map(len, self.postings), dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        with open(index_dir / "postings.bin", "wb") as output_file:
+            for posting in self.postings:
+                output_file.write(posting)
+        np.save(index_dir / "offsets.npy", offsets)
+        np.save(index_dir / "doc_freqs.npy", np.array(self.doc_freqs))
+        np.save(index_dir / "last_doc.npy", np.array(self.last_doc))
+        np.save(index_dir / "doc_lengths.npy", self.doc_lengths)
+        (index_dir / "terms.json").write_text(
+            json.dumps(sorted(self.terms, key=self.terms.get)),
+            encoding="utf-8",
+        )
+        (index_dir / "offer_ids.json").write_text(
+            json.dumps(self.offer_ids), encoding="utf-8"
+        )
+
+    @classmethod
+    def load(cls, index_dir: str) -> "InvertedIndex":
+        """Load an index saved with `save()`.
+
+        Args:
+            index_dir (str): the directory of the index
+
+        Returns:
+            InvertedIndex: the index
+        """
+        index_dir = Path(index_dir)
+        index = cls()
+        terms = json.loads(
+            (index_dir / "terms.json").read_text(encoding="utf-8")
+        )
+        index.offer_ids = json.loads(
+            (index_dir / "offer_ids.json").read_text(encoding="utf-8")
+        )
+        offsets = np.load(index_dir / "offsets.npy")
+        blob = (index_dir / "postings.bin").read_bytes()
+        index.terms = {term: number for number, term in enumerate(terms)}
+        index.postings = [
+            bytearray(blob[offsets[number]:offsets[number + 1]])
+            for number in range(len(terms))
+        ]
+        index.doc_freqs = np.load(index_dir / "doc_freqs.npy").tolist()
+        index.last_doc = np.load(index_dir / "last_doc.npy").tolist()
+        index.doc_lengths = np.load(index_dir / "doc_lengths.npy")
+        index._known_ids = set(index.offer_ids)
+        return index
+
+
+def get_index_dir(snapshot_dir: str, name: str = "default") -> Path:
+    """Get the directory of the index of a search, next to its snapshots.
+
+    Args:
+        snapshot_dir (str): root directory of the snapshots
+        name (str, optional): name of the search. Defaults to "default".
+
+    Returns:
+        Path: the directory of the index
+    """
+    return Path(snapshot_dir, name, INDEX_DIR_NAME)
+
+
+def load_index(index_dir: str) -> InvertedIndex:
+    """Load an index, or create an empty one if none was saved yet.
+
+    Args:
+        index_dir (str): the directory of the index
+
+    Returns:
+        InvertedIndex: the index
+    """
+    if Path(index_dir, "terms.json").exists():
+        return InvertedIndex.load(index_dir)
+    return InvertedIndex()
+
+
+def update_index(dataframe: pd.DataFrame, index_dir: str) -> InvertedIndex:
+    """Sync the saved index with the offers of a harvest.
+
+    The offers no longer harvested (e.g. expired) are removed, and the new
+    ones added, so that the index holds the offers of the latest snapshot.
+
+    Args:
+        dataframe (pd.DataFrame): all the job offers of the harvest, with
+            their 'id'
+        index_dir (str): the directory of the index
+
+    Returns:
+        InvertedIndex: the updated index
+    """
+    index = load_index(index_dir)
+    offer_ids = dataframe["id"].tolist()
+    harvested = set(offer_ids)
+    removed = index.remove_documents(
+        [offer_id for offer_id in index.offer_ids if offer_id not in harvested]
+    )
+    added = index.add_documents(
+        offer_ids, build_offer_texts(dataframe).tolist()
+    )
+    if removed or added:
+        index.save(index_dir)
+    return index
+
+
+def search_offers(
+    dataframe: pd.DataFrame,
+    index: InvertedIndex,
+    query: str,
+    top_k: int = 150,
+    match_all: bool = False,
+) -> pd.DataFrame:
+    """Select the offers of a dataframe matching keywords, best first.
+
+    The offers indexed but missing from the dataframe (e.g. no longer
+    published) are left out.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their 'id'
+        index (InvertedIndex): the index of the offers
+        query (str): the keywords
+        top_k (int, optional): maximum number of offers. Defaults to 150.
+        match_all (bool, optional): whether an offer must hold every term
+            of the query (see `InvertedIndex.search()`). Defaults to False.
+
+    Returns:
+        pd.DataFrame: the matching offers, with their BM25 'score'
+    """
+    ranking = index.search(query, top_k=len(index), match_all=match_all)
+    matches = ranking.merge(dataframe, on="id", how="inner")
+    return matches.head(top_k)
@@ -0,0 +1,170 @@
+"""Storage of the long texts of the job offers, read lazily by offer id.
+
+The 'description' and 'entreprise.description' of the offers weigh most of
+the memory of the offer tables (one Python string per offer). Each snapshot
+keeps them apart, in a 'texts' directory:
+- '<column>.bin': the UTF-8 texts, concatenated
+- '<column>.offsets.npy': the offset of each text in the blob (one more
+    than the offers), a missing text being empty and flagged in
+    '<column>.missing.npy'
+- 'offer_ids.json': the ids of the offers, in the order of the texts
+
+The blobs are memory-mapped, so that a text is read from the disk (or the
+page cache shared by the processes) only when it is displayed, e.g. when an
+offer is expanded in the app.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TEXT_DIR_NAME = "texts"
+LONG_TEXT_COLUMNS = ("description", "entreprise.description")
+
+
+def save_texts(
+    dataframe: pd.DataFrame,
+    text_dir: str,
+    columns: tuple = LONG_TEXT_COLUMNS,
+) -> list[str]:
+    """Save the long texts of the job offers into a directory.
+
+    Args:
+        dataframe (pd.DataFrame): the job offers, with their 'id'
+        text_dir (str): the directory of the texts
+        columns (tuple, optional): the text columns.
+            Defaults to LONG_TEXT_COLUMNS.
+
+    Returns:
+        list[str]: the columns saved (those present in the dataframe)
+    """
+    text_dir = Path(text_dir)
+    text_dir.mkdir(parents=True, exist_ok=True)
+    saved_columns = [column for column in columns if column in dataframe]
+    for column in saved_columns:
+        values = dataframe[column]
+        missing = values.isna().to_numpy()
+        encoded = [
+            b"" if is_missing else str(value).encode("utf-8")
+            for value, is_missing in zip(values.tolist(), missing)
+        ]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(
+            np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)),
+            out=offsets[1:],
+        )
+        (text_dir / f"{column}.bin").write_bytes(b"".join(encoded))
+        np.save(text_dir / f"{column}.offsets.npy", offsets)
+        np.save(text_dir / f"{column}.missing.npy", missing)
+    (text_dir / "offer_ids.json").write_text(
+        json.dumps(dataframe["id"].astype(str).tolist()), encoding="utf-8"
+    )
+    return saved_columns
+
+
+class TextStore:
+    """Memory-mapped long texts of the offers of a snapshot.
+
+    Args:
+        text_dir (str): the directory of the texts (see `save_texts()`)
+    """
+
+    def __init__(self, text_dir: str):
+        self.text_dir = Path(text_dir)
+        self.offer_ids = pd.Index(
+            json.loads(
+                (self.text_dir / "offer_ids.json").read_text(encoding="utf-8")
+            )
+        )
+        self.columns = {}
+        for offsets_file in sorted(self.text_dir.glob("*.offsets.npy")):
+            column = offsets_file.name[:-len(".offsets.npy")]
+            blob_file = self.text_dir / f"{column}.bin"
+            # An empty file cannot be memory-mapped
+            blob = (
+                np.memmap(blob_file, dtype=np.uint8, mode="r")
+                if blob_file.stat().st_size else np.zeros(0, dtype=np.uint8)
+            )
+            self.columns[column] = (
+                blob,
+                np.load(offsets_file, mmap_mode="r"),
+                np.load(self.text_dir / f"{column}.missing.npy"),
+            )
+
+    def __len__(self) -> int:
+        return len(self.offer_ids)
+
+    def get_texts(self, column: str, offer_ids: list) -> pd.Series:
+        """Read the texts of some offers.
+
+        Args:
+            column (str): the text column, e.g. 'description'
+            offer_ids (list): the ids of the offers
+
+        Raises:
+            KeyError: the column is not stored
+
+        Returns:
+            pd.Series: the texts, indexed by offer id (missing for the
+                offers not stored)
+        """
+        blob, offsets, missing = self.columns[column]
+        offer_ids = pd.Index(offer_ids).astype(str)
+        positions = self.offer_ids.get_indexer(offer_ids)
+        texts = [
+            None if position < 0 or missing[position]
+            else blob[offsets[position]:offsets[position + 1]]
+            .tobytes().decode("utf-8")
+            for position in positions
+        ]
+        return pd.Series(texts, index=offer_ids, name=column, dtype=object)
+
+    def get_text(self, column: str, offer_id: str) -> str:
+        """Read the text of one offer.
+
+        Args:
+            column (str): the text column, e.g. 'description'
+            offer_id (str): the id of the offer
+
+        Returns:
+            str: the text, or `None` if missing
+        """
+        return self.get_texts(column, [offer_id]).iloc[0]
+
+    def attach(
+        self,
+        dataframe: pd.DataFrame,
+        columns: list[str] = None
+    ) -> pd.DataFrame:
+        """Add the stored texts to the job offers.
+
+        Args:
+            dataframe (pd.DataFrame): the job offers, with their 'id'
+            columns (list[str], optional): the text columns.
+                Defaults to None, i.e. all the stored columns.
+
+        Returns:
+            pd.DataFrame: a copy of the offers, with the text columns
+        """
+        dataframe = dataframe.copy()
+        for column in columns or self.columns:
+            dataframe[column] = self.get_texts(
+                column, dataframe["id"]
+            ).to_numpy()
+        return dataframe
+
+
+def load_texts(text_dir: str) -> TextStore:
+    """Load the texts of a snapshot, if they were stored apart.
+
+    Args:
+        text_dir (str): the directory of the texts
+
+    Returns:
+        TextStore: the texts, or `None` if there are none
+    """
+    if not Path(text_dir, "offer_ids.json").exists():
+        return None
+    return TextStore(text_dir)